@@ -1,158 +1,147 @@
-from flask import Flask, render_template, request, jsonify
-from flask_sqlalchemy import SQLAlchemy  # <-- Импортируем SQLAlchemy
-from flask_migrate import Migrate      # <-- Импортируем Migrate
-import logging
-from logging.handlers import RotatingFileHandler
+from flask import Flask, Response, current_app, render_template, request, jsonify, stream_with_context
+import hmac
 import os
 from datetime import datetime
 import re
-import requests
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# --- Конфигурация Flask ---
-app = Flask(__name__)
+from callback_search import normalize_phone
+from config import get_config
+import database
+from models import db
+import assets
+import callback_archive
+import callback_export
+import callback_spool
+import callback_stats
+import counters
+import critical_css
+import idempotency
+import images
+import logging_setup
+import metrics
+import notifications
+import page_cache
+import profiling
+import price_catalog
+import template_cache
 
-# --- Конфигурация SQLAlchemy ---
-# Указываем Flask, где находится наша база данных
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'database.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+load_dotenv()
 
-# --- Инициализация расширений ---
-db = SQLAlchemy(app)      # <-- Создаем объект БД
-migrate = Migrate(app, db)  # <-- Создаем объект для миграций
 
+# --- Фабрика приложения ---
+def create_app(config_class=None):
+    """Создает и настраивает приложение.
+
+    config_class - класс из config.py; по умолчанию выбирается переменной APP_CONFIG
+    (production или development). При импорте модуля ничего не создается: gunicorn
+    (wsgi.py) и команда flask вызывают фабрику сами.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class or get_config())
+
+    # --- Конфигурация SQLAlchemy ---
+    # Указываем Flask, где находится наша база данных
+    app.config['SQLALCHEMY_DATABASE_URI'] = database.get_database_uri() # Тот же URL использует бот (см. database.py)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # --- Настройка логирования ---
+    # Файл logs/app.log с ротацией и консоль; записи пишет отдельный поток (см. logging_setup.py)
+    logging_setup.init_app(app)
+    check_credentials(app)
+
+    # --- Инициализация расширений ---
+    db.init_app(app)      # <-- Подключаем объект БД (модели описаны в models.py)
+    database.init_app(app, db) # <-- WAL, busy_timeout и прочие прагмы SQLite на каждом соединении
+    if os.environ.get('FLASK_RUN_FROM_CLI'):
+        # Миграции (flask db ...) нужны только командам flask: alembic не загружается в веб-воркеры
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    notifications.init_app(app) # <-- Фоновая доставка уведомлений из outbox
+    counters.init_app(app) # <-- Команда flask reconcile-counters
+    assets.init_app(app) # <-- Статика с хэшем в имени (после flask build-assets)
+    images.init_app(app) # <-- Адаптивные изображения (WebP/AVIF + srcset)
+    critical_css.init_app(app) # <-- Инлайн CSS первого экрана (после flask build-critical-css)
+    callback_archive.init_app(app) # <-- Команда flask archive-callbacks
+    callback_stats.init_app(app) # <-- Команда flask rebuild-stats (сводка для /stats в боте)
+    metrics.init_app(app) # <-- /metrics для Prometheus (время запросов, SQL, отправки в Telegram)
+    profiling.init_app(app) # <-- Профили выбранных запросов в logs/profiles и команда flask profile-token
+    template_cache.init_app(app) # <-- Кэш байткода шаблонов и их компиляция при старте
+    idempotency.init_app(app) # <-- Ключи отправки формы заявки (повторы не создают дублей)
+
+    # --- Отложенная пакетная запись заявок (CALLBACK_WRITE_BEHIND) ---
+    callback_spool.init_app(app, app.config['ADMIN_ID']) # None - заявки пишутся в БД сразу
+
+    # --- Маршруты ---
+    app.add_url_rule('/submit_callback', view_func=submit_callback, methods=['POST'])
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/pricing', view_func=pricing)
+    app.add_url_rule('/about', view_func=about)
+    app.add_url_rule('/export/callbacks.<fmt>', view_func=export_callbacks)
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(Exception, handle_exception)
+
+    app.logger.info('Приложение English School запущено')
+    return app
+
+
+def check_credentials(app):
+    """Проверяет, что BOT_TOKEN и ADMIN_ID заданы; ADMIN_ID в конфигурации приводится к int."""
+    if not app.config['BOT_TOKEN']:
+        app.logger.critical("BOT_TOKEN не найден в переменных окружения!")
+        # Здесь можно либо завершить приложение, либо использовать заглушку, но лучше завершить
+        # raise ValueError("BOT_TOKEN не найден в переменных окружения!")
+    admin_id = app.config['ADMIN_ID']
+    if not admin_id:
+        app.logger.critical("ADMIN_ID не найден в переменных окружения!")
+        # raise ValueError("ADMIN_ID не найден в переменных окружения!")
+    else:
+        try:
+            app.config['ADMIN_ID'] = int(admin_id) # Преобразуем ADMIN_ID в int
+        except ValueError:
+            app.logger.critical(f"ADMIN_ID '{admin_id}' не является корректным числом!")
+            # raise ValueError(f"ADMIN_ID '{admin_id}' не является корректным числом!")
 
-DATABASE = os.getenv('DATABASE_PATH', 'database.db') # 'database.db' - значение по умолчанию
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-ADMIN_ID = os.getenv('ADMIN_ID')
 
-# --- Проверка, что обязательные переменные загружены ---
-if not BOT_TOKEN:
-    app.logger.critical("BOT_TOKEN не найден в переменных окружения!")
-    # Здесь можно либо завершить приложение, либо использовать заглушку, но лучше завершить
-    # raise ValueError("BOT_TOKEN не найден в переменных окружения!")
-if not ADMIN_ID:
-    app.logger.critical("ADMIN_ID не найден в переменных окружения!")
-    # raise ValueError("ADMIN_ID не найден в переменных окружения!")
-else:
-    try:
-        ADMIN_ID = int(ADMIN_ID) # Преобразуем ADMIN_ID в int
-    except ValueError:
-        app.logger.critical(f"ADMIN_ID '{ADMIN_ID}' не является корректным числом!")
-        # raise ValueError(f"ADMIN_ID '{ADMIN_ID}' не является корректным числом!")
-
-
-
-
-# ===>>> ОПРЕДЕЛЕНИЕ МОДЕЛИ БАЗЫ ДАННЫХ <<<===
-# Теперь наша таблица описывается как Python-класс
-class Callback(db.Model):
-    __tablename__ = 'callbacks' # Явно указываем имя таблицы
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(120), nullable=True)
-    phone = db.Column(db.String(20), nullable=False)
-    lesson_type = db.Column(db.String(50), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    processed = db.Column(db.Boolean, default=False, nullable=False)
-
-    def __repr__(self):
-        return f'<Callback {self.name} - {self.phone}>'
-
-# --- Функция отправки уведомления в Telegram ---
-def send_telegram_notification(chat_id, text):
-    """Отправляет сообщение в Telegram чат."""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML' # Можно использовать HTML для форматирования
-    }
-    try:
-        response = requests.post(url, json=payload, timeout=5) # Ставим таймаут
-        response.raise_for_status() # Проверяем на HTTP ошибки
-        app.logger.info(f"Telegram notification sent to {chat_id}. Response: {response.json()}")
-        return True
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Failed to send Telegram notification to {chat_id}: {e}")
-        return False
-    except Exception as e:
-        app.logger.error(f"An unexpected error occurred sending Telegram notification: {e}")
-        return False
-
-
-# --- Настройка логирования ---
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-log_file = os.path.join(log_dir, 'app.log')
-
-# Уровень логирования (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-log_level = logging.INFO
-
-# Форматтер для сообщений лога
-log_formatter = logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-)
-
-pricing_data = {
-    "individual_online": {
-        "title": "Персональное", # Новое название
-        "description": "Персональные онлайн-уроки через Zoom, MTS-link, Вебинар, WhatsApp или другие платформы. Максимальное внимание преподавателя и гибкий график.",
-        "price": "2999", # Актуальная цена
-        "old_price": "4500", # Старая цена (для зачеркивания)
-        "unit": "руб./час" # Единица измерения
-    },
-    "group_online": {
-        "title": "Групповое занятие", # Новое название
-        "description": "Динамичные онлайн-занятия в небольшой группе (до 6 человек). Интерактивное обучение и общение.",
-        "price": "1499", # Актуальная цена
-        "old_price": "2000", # Старая цена
-        "unit": "руб./час" # Единица измерения
-    }
-}
-
-# Обработчик для записи логов в файл с ротацией
-# maxBytes - максимальный размер файла лога перед ротацией
-# backupCount - количество хранимых старых файлов лога
-file_handler = RotatingFileHandler(
-    log_file, maxBytes=1024*1024*5, backupCount=5, encoding='utf-8' # 5 MB
-)
-file_handler.setFormatter(log_formatter)
-file_handler.setLevel(log_level)
-
-# Обработчик для вывода логов в консоль (для отладки)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-console_handler.setLevel(log_level) # Можно поставить DEBUG для разработки
-
-# Добавляем обработчики к логгеру Flask
-app.logger.addHandler(file_handler)
-app.logger.addHandler(console_handler) # Убрать для продакшена, если не нужен вывод в консоль
-app.logger.setLevel(log_level)
-
-# Убираем стандартный обработчик Flask, если он есть
-app.logger.removeHandler(app.logger.handlers[0])
-
-app.logger.info('Приложение English School запущено')
-
-# --- Данные о ценах (пример, замените актуальными) ---
-# Лучше вынести это в отдельный файл конфигурации или базу данных в будущем
+# --- Данные о ценах ---
+# Тарифы хранятся в таблице pricing_plans (меняются командой бота /setprice), см. price_catalog.py
 
 # --- Маршруты (Routes) ---
-@app.route('/submit_callback', methods=['POST'])
+# Ключ отправки формы: UUID из crypto.randomUUID() (или его запасной вариант в script.js)
+SUBMIT_KEY_RE = re.compile(r"^[A-Za-z0-9-]{16,36}$")
+SUBMIT_BUSY = {"success": False, "error": "Заявка уже отправляется, подождите несколько секунд."}
+
 def submit_callback():
-    app.logger.info(f'Получен POST-запрос на /submit_callback с IP: {request.remote_addr}')
+    current_app.logger.info(f'Получен POST-запрос на /submit_callback с IP: {request.remote_addr}')
+    key = request.headers.get(current_app.config['SUBMIT_KEY_HEADER'])
+    if key is None:
+        body, status = accept_callback()
+        return jsonify(body), status
+    if not SUBMIT_KEY_RE.match(key):
+        return jsonify({"success": False, "error": "Некорректный ключ отправки формы."}), 400
+
+    # ===>>> ПОВТОРНАЯ ОТПРАВКА <<<===
+    # Повтор с тем же ключом (ретрай сети, двойной клик) получает ответ первого запроса: без БД и Telegram
+    keys = current_app.extensions['submit_keys']
+    result, replayed = keys.run(f'submit:{key}', current_app.config['SUBMIT_KEY_TTL'],
+                                lambda: accept_callback(submission_id=key))
+    if result is idempotency.PENDING:
+        return jsonify(SUBMIT_BUSY), 409
+    body, status = result
+    if replayed:
+        current_app.logger.info(f'Повтор отправки формы (ключ {key}) - возвращен сохраненный ответ')
+        return jsonify(body), status, {'Idempotent-Replayed': 'true'}
+    return jsonify(body), status
+
+def accept_callback(submission_id=None):
+    """Проверяет и сохраняет заявку из формы. Возвращает (тело ответа, статус)."""
     required_fields = ['name', 'full_phone', 'lesson_type', 'consent']
     missing_fields = [field for field in required_fields if field not in request.form or not request.form[field]]
 
     if missing_fields:
         error_message = f"Отсутствуют обязательные поля: {', '.join(missing_fields)}"
-        app.logger.warning(f"Ошибка валидации формы: {error_message}")
-        return jsonify({"success": False, "error": "Пожалуйста, заполните все обязательные поля и дайте согласие."}), 400
+        current_app.logger.warning(f"Ошибка валидации формы: {error_message}")
+        return {"success": False, "error": "Пожалуйста, заполните все обязательные поля и дайте согласие."}, 400
 
     name = request.form['name'].strip()
     phone = request.form['full_phone'].strip()
@@ -160,91 +149,143 @@ def submit_callback():
     email = request.form.get('email', '').strip()
     consent = request.form['consent']
 
-    if len(name) < 1: return jsonify({"success": False, "error": "Имя слишком короткое."}), 400
-    if not re.match(r"^\+\d{10,}$", phone): return jsonify({"success": False, "error": "Некорректный формат телефона."}), 400
-    if email and not re.match(r"[^@]+@[^@]+\.[^@]+", email): return jsonify({"success": False, "error": "Некорректный формат email."}), 400
-    if consent != 'on': return jsonify({"success": False, "error": "Необходимо согласие на обработку данных."}), 400
+    if len(name) < 1: return {"success": False, "error": "Имя слишком короткое."}, 400
+    if not re.match(r"^\+\d{10,}$", phone): return {"success": False, "error": "Некорректный формат телефона."}, 400
+    if email and not re.match(r"[^@]+@[^@]+\.[^@]+", email): return {"success": False, "error": "Некорректный формат email."}, 400
+    if consent != 'on': return {"success": False, "error": "Необходимо согласие на обработку данных."}, 400
+    if lesson_type not in counters.LESSON_TYPES: return {"success": False, "error": "Некорректный тип занятий."}, 400
+
+    entry = callback_spool.new_entry(name, email, phone, lesson_type, submission_id)
+    window = current_app.config['SUBMIT_DEDUP_WINDOW']
+    if not window:
+        return store_callback(entry)
+
+    # Та же пара (телефон, тип занятия) недавно уже принята - например, форму открыли заново после
+    # ответа, потерянного сетью. Повтору возвращаем тот же успешный ответ
+    keys = current_app.extensions['submit_keys']
+    result, replayed = keys.run(f'lead:{normalize_phone(phone)}:{lesson_type}', window, lambda: store_callback(entry))
+    if result is idempotency.PENDING:
+        return SUBMIT_BUSY, 409
+    if replayed:
+        current_app.logger.info(f"Повторная заявка за {window} сек. пропущена: Телефон={phone}, Тип={lesson_type}")
+    return result
+
+def store_callback(entry):
+    """Пишет заявку в журнал (write-behind) или сразу в БД. Возвращает (тело ответа, статус)."""
+    name, phone, lesson_type, email = entry['name'], entry['phone'], entry['lesson_type'], entry['email'] or ''
+    success = {"success": True, "message": "Заявка успешно отправлена!"}
+
+    # ===>>> ОТЛОЖЕННАЯ ЗАПИСЬ (write-behind) <<<===
+    # Заявка надежно пишется в журнал на диске, а в БД попадает пачкой из фонового потока
+    spool = current_app.extensions['callback_spool']
+    if spool is not None:
+        try:
+            spool.append(entry)
+        except OSError as e:
+            current_app.logger.error(f"Ошибка записи заявки в журнал: {e}")
+            return {"success": False, "error": "Произошла ошибка на сервере. Попробуйте позже."}, 500
+        current_app.logger.info(
+            f"Новая заявка принята в журнал ({entry['submission_id']}): Имя={name}, Телефон={phone}, Тип={lesson_type}, Email={email}")
+        return success, 200
 
     try:
-        new_callback = Callback(
-            name=name,
-            email=email if email else None,
-            phone=phone,
-            lesson_type=lesson_type
-        )
-        db.session.add(new_callback)  # Добавляем новый объект в сессию
-        db.session.commit()  # Сохраняем изменения в БД
-
-        new_callback_id = new_callback.id  # Получаем ID после коммита
-        app.logger.info(
-            f"Новая заявка сохранена (ID: {new_callback_id}): Имя={name}, Телефон={phone}, Тип={lesson_type}, Email={email}")
-
-        # ===>>> ОТПРАВКА УВЕДОМЛЕНИЯ В TELEGRAM <<<===
-        notification_text = (
-            f"🔔 <b>Новая заявка на обратный звонок!</b>\n\n"
-            f"<b>ID:</b> {new_callback_id}\n"
-            f"<b>Имя:</b> {name}\n"
-            f"<b>Телефон:</b> {phone}\n"
-            f"<b>Email:</b> {email if email else 'Не указан'}\n"
-            f"<b>Тип занятия:</b> {lesson_type}\n\n"
-            f"Для просмотра списка заявок используйте команду /callbacks"
-        )
-        send_telegram_notification(ADMIN_ID, notification_text)
-        # ===>>> КОНЕЦ ОТПРАВКИ УВЕДОМЛЕНИЯ <<<===
-
-        return jsonify({"success": True, "message": "Заявка успешно отправлена!"})
+        # Заявка, счетчики и уведомление в outbox (его отправляет фоновый диспетчер) - одним коммитом
+        created = callback_spool.store_callbacks([entry], current_app.config['ADMIN_ID'])
+        db.session.commit()
+        if not created:
+            # submission_id уже в БД: ключ формы пережил свое хранилище (например, его каталог очистили)
+            current_app.logger.info(f"Заявка {entry['submission_id']} уже сохранена ранее - повтор пропущен")
+            return success, 200
+        new_callback = created[0]
+        notifications.get_dispatcher().wake()
+
+        current_app.logger.info(
+            f"Новая заявка сохранена (ID: {new_callback.id}): Имя={name}, Телефон={phone}, Тип={lesson_type}, Email={email}")
+
+        return success, 200
 
 
     except Exception as e:  # Ловим более общую ошибку, т.к. теперь это не sqlite3.Error
 
         db.session.rollback()  # Откатываем транзакцию в случае ошибки
 
-        app.logger.error(f"Ошибка при записи в БД: {e}")
+        current_app.logger.error(f"Ошибка при записи в БД: {e}")
 
-        return jsonify({"success": False, "error": "Произошла ошибка на сервере. Попробуйте позже."}), 500
+        return {"success": False, "error": "Произошла ошибка на сервере. Попробуйте позже."}, 500
 
-@app.route('/')
 def index():
     """Главная страница"""
-    app.logger.info(f'Запрос к главной странице с IP: {request.remote_addr}')
+    logging_setup.log_page_request('главной странице')
     current_year = datetime.now().year
-    return render_template('index.html', current_year=current_year)
+    return page_cache.render_cached('index.html', current_year=current_year)
 
-@app.route('/pricing')
 def pricing():
     """Страница с ценами"""
-    app.logger.info(f'Запрос к странице цен с IP: {request.remote_addr}')
+    logging_setup.log_page_request('странице цен')
     current_year = datetime.now().year
-    return render_template('pricing.html', prices=pricing_data, current_year=current_year)
+    version, prices = price_catalog.get_catalog() # Из памяти; версия в БД сверяется не чаще раза в секунду
+    return page_cache.render_cached('pricing.html', cache_key=current_year, etag_version=version,
+                                    prices=prices, current_year=current_year)
 
-@app.route('/about')
 def about():
     """Страница 'О нас'"""
-    app.logger.info(f'Запрос к странице "О нас" с IP: {request.remote_addr}')
+    logging_setup.log_page_request('странице "О нас"')
     current_year = datetime.now().year
     # Здесь можно передать доп. данные, если нужно (напр., список преподавателей из БД)
     # team_data = [...]
-    return render_template('about.html', current_year=current_year) #, team=team_data)
-
-# Обработчик ошибок 404 (Страница не найдена)
-@app.errorhandler(404)
+    return page_cache.render_cached('about.html', current_year=current_year) #, team=team_data)
+
+def export_callbacks(fmt):
+    """Выгрузка заявок в CSV/XLSX для CRM (?from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД&processed=0|1).
+
+    Файл отдается потоком: строки читаются с курсора пачками по CHUNK_ROWS, поэтому первые
+    байты уходят сразу, а память не зависит от размера таблицы.
+    """
+    token = current_app.config['EXPORT_TOKEN']
+    if not token or fmt not in callback_export.EXPORT_FORMATS:
+        return page_not_found(None)
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        current_app.logger.warning(f'Отказано в выгрузке заявок: IP {request.remote_addr}')
+        return jsonify({"success": False, "error": "Требуется авторизация."}), 401, {'WWW-Authenticate': 'Bearer'}
+    try:
+        filters = callback_export.parse_filters(
+            request.args.get('from'), request.args.get('to'), request.args.get('processed'))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    def partitions():
+        for query in callback_export.export_queries(**filters):
+            query = query.execution_options(yield_per=callback_export.CHUNK_ROWS)
+            yield from db.session.execute(query).partitions()
+
+    current_app.logger.info(f'Выгрузка заявок ({fmt}, фильтры: {filters}) для IP: {request.remote_addr}')
+    filename = callback_export.export_filename(fmt, filters)
+    return Response(
+        stream_with_context(callback_export.stream_export(fmt, partitions())),
+        mimetype=callback_export.EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'},
+    )
+
+# --- Обработчики ошибок ---
+# Страница не найдена (404)
 def page_not_found(error):
-    app.logger.warning(f'Ошибка 404 - Страница не найдена: {request.url} (IP: {request.remote_addr})')
+    current_app.logger.warning(f'Ошибка 404 - Страница не найдена: {request.url} (IP: {request.remote_addr})')
     current_year = datetime.now().year
     return render_template('404.html', current_year=current_year), 404 # Важно вернуть статус 404
 
-# Обработчик общих ошибок сервера 500
-@app.errorhandler(Exception)
+# Общая ошибка сервера (500)
 def handle_exception(e):
     # Логируем полную информацию об ошибке
-    app.logger.error(f'Произошла ошибка сервера (500): {e}', exc_info=True)
+    current_app.logger.error(f'Произошла ошибка сервера (500): {e}', exc_info=True)
     current_year = datetime.now().year
     # Показываем пользователю общую страницу ошибки
     return render_template('500.html', current_year=current_year), 500
 
 # --- Запуск приложения ---
 if __name__ == '__main__':
-    if not BOT_TOKEN or not ADMIN_ID: # Дополнительная проверка перед запуском
+    app = create_app()
+    if not app.config['BOT_TOKEN'] or not app.config['ADMIN_ID']: # Дополнительная проверка перед запуском
         print("Ошибка: BOT_TOKEN или ADMIN_ID не установлены. Проверьте переменные окружения.")
     else:
-        app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
+        app.run(debug=app.debug, host='0.0.0.0', port=5000)
@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+import click
+from flask import request, send_from_directory
+
+try:
+    import brotli # Необязательная зависимость: без нее собираем только .gz
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'dist' # Подпапка static/ для собранных файлов
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt'}
+IMMUTABLE_MAX_AGE = 31536000 # Год: имя файла меняется вместе с содержимым
+
+
+# --- Минификация (консервативная: только то, что гарантированно не меняет смысл) ---
+def minify_css(source):
+    """Убирает комментарии и лишние пробелы из CSS (содержимое строк в кавычках не трогаем)."""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', source)
+    for i in range(0, len(parts), 2): # Четные элементы - код вне строк
+        part = re.sub(r'\s+', ' ', parts[i])
+        # Пробелы вокруг { } ; , и после : не значимы (перед : - значим: "a :hover")
+        part = re.sub(r'\s*([{};,])\s*', r'\1', part)
+        part = re.sub(r':\s+', ':', part)
+        parts[i] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(source):
+    """Убирает отступы, пустые строки и строки-комментарии из JS (переводы строк сохраняются - ASI не ломается)."""
+    lines = []
+    for line in source.splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def _fingerprinted_name(relative_path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{digest}{ext}"
+
+
+def build_assets(static_folder):
+    """Собирает static/dist: минифицирует CSS/JS, добавляет хэш в имена и сжимает (gzip + brotli).
+
+    Возвращает манифест {исходное имя: имя в dist}.
+    """
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder) # Старые версии не нужны: в HTML ссылки только на новые
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_folder]
+        for filename in sorted(files):
+            source_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+            ext = os.path.splitext(filename)[1].lower()
+
+            with open(source_path, 'rb') as f:
+                content = f.read()
+            if ext in MINIFIERS:
+                content = MINIFIERS[ext](content.decode('utf-8')).encode('utf-8')
+
+            target_name = _fingerprinted_name(relative_path, content)
+            target_path = os.path.join(dist_folder, target_name)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, 'wb') as f:
+                f.write(content)
+            if ext in COMPRESSIBLE:
+                with open(target_path + '.gz', 'wb') as f:
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target_path + '.br', 'wb') as f:
+                        f.write(brotli.compress(content, quality=11))
+            manifest[relative_path] = f"{DIST_DIR}/{target_name}"
+
+    with open(os.path.join(dist_folder, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Читает манифест собранных файлов. Если сборки нет - пустой словарь (ссылки как раньше)."""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_app(app):
+    """Подключает манифест: url_for('static', ...) начинает отдавать имена с хэшем."""
+    manifest = load_manifest(app.static_folder)
+    fingerprinted = set(manifest.values())
+    app.extensions['assets_manifest'] = manifest
+    send_static_file = app.view_functions['static']
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def static_with_precompressed(filename):
+        """Отдает файлы из dist с immutable-кэшем и готовым .br/.gz, остальное - как обычно."""
+        if filename not in fingerprinted:
+            return send_static_file(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        served_name, encoding = filename, None
+        accept_encodings = request.accept_encodings
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accept_encodings[candidate] and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+                served_name, encoding = filename + suffix, candidate
+                break
+
+        response = send_from_directory(app.static_folder, served_name, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return response
+
+    app.view_functions['static'] = static_with_precompressed
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Собирает static/dist и манифест (запускать при деплое, затем перезапустить приложение)."""
+        built = build_assets(app.static_folder)
+        for source, target in sorted(built.items()):
+            click.echo(f"{source} -> {target}")
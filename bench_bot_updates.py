@@ -0,0 +1,198 @@
+"""Замер обработки обновлений ботом: long polling против вебхука на локальном фейковом Telegram.
+
+Запуск:    python bench_bot_updates.py --mode webhook --updates 500 --concurrency 20
+Сравнение: python bench_bot_updates.py --mode polling ...
+
+Фейковый Bot API сервер (aiohttp) отвечает на методы, которые вызывает бот, и раздает
+обновления: в режиме polling - через getUpdates, в режиме webhook - POST-запросом на вебхук
+с секретным заголовком. Обновления - нажатия на кнопки заявок (смена статуса). Задержка
+считается от отправки обновления до answerCallbackQuery от бота.
+
+Бот запускается отдельным процессом (python bot.py) на временной БД, рабочая database.db
+не затрагивается.
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+ADMIN_ID = 1
+BOT_TOKEN = '123456:bench-token'
+WEBHOOK_PATH = '/telegram/webhook'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FakeTelegram:
+    """Минимальный Bot API: getMe, get/set/deleteWebhook, getUpdates и ответы бота."""
+
+    def __init__(self):
+        self.updates = asyncio.Queue()
+        self.answered = {} # id нажатия -> future, которую завершает answerCallbackQuery
+        self.webhook = None # (url, secret) после setWebhook
+        self.ready = asyncio.Event() # Бот начал получать обновления
+        self.api_calls = {}
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.api_calls[method] = self.api_calls.get(method, 0) + 1
+        result = True
+        if method == 'getMe':
+            result = {'id': 42, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'setWebhook':
+            self.webhook = (params['url'], params.get('secret_token'))
+            self.ready.set()
+        elif method == 'deleteWebhook':
+            self.webhook = None
+        elif method == 'getUpdates':
+            self.ready.set()
+            result = await self._get_updates(float(params.get('timeout', 0)))
+        elif method == 'answerCallbackQuery':
+            future = self.answered.get(params['callback_query_id'])
+            if future and not future.done():
+                future.set_result(time.perf_counter())
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, timeout):
+        try:
+            updates = [await asyncio.wait_for(self.updates.get(), timeout or None)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty() and len(updates) < 100:
+            updates.append(self.updates.get_nowait())
+        return updates
+
+
+def toggle_update(update_id, callback_id, status, callback_data):
+    """Нажатие на кнопку заявки; клавиатура сообщения приходит вместе с нажатием, как в Telegram."""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': ADMIN_ID, 'is_bot': False, 'first_name': 'Admin'},
+            'chat_instance': '1',
+            'data': callback_data,
+            'message': {
+                'message_id': callback_id, 'date': 0, 'text': 'Список заявок',
+                'chat': {'id': ADMIN_ID, 'type': 'private'},
+                'reply_markup': {'inline_keyboard': [[{'text': f"{'✅' if status else '❌'} Bench - +7",
+                                                       'callback_data': callback_data}]]},
+            },
+        },
+    }
+
+
+async def run(args, workdir):
+    from bot import CallbackAction
+
+    fake = FakeTelegram()
+    api_app = web.Application()
+    api_app.router.add_post('/bot{token}/{method}', fake.handle)
+    runner = web.AppRunner(api_app, access_log=None)
+    await runner.setup()
+    api_port, webhook_port = free_port(), free_port()
+    await web.TCPSite(runner, '127.0.0.1', api_port).start()
+
+    env = dict(os.environ, BOT_MODE=args.mode, TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}',
+               WEBHOOK_BASE_URL=f'http://127.0.0.1:{webhook_port}', WEBHOOK_PORT=str(webhook_port),
+               WEBHOOK_PATH=WEBHOOK_PATH, WEBHOOK_SECRET=secrets.token_urlsafe(16))
+    bot_process = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'bot.py')], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'bot.log'), 'w'))
+    try:
+        await asyncio.wait_for(fake.ready.wait(), 30)
+        async with ClientSession() as client:
+            if args.mode == 'webhook':
+                url, secret = fake.webhook
+                async with client.post(url, json={'update_id': 0}) as response:
+                    print(f"Запрос без секрета: HTTP {response.status}")
+
+            async def send(update):
+                if args.mode == 'webhook':
+                    async with client.post(url, json=update,
+                                           headers={'X-Telegram-Bot-Api-Secret-Token': secret}) as response:
+                        response.raise_for_status()
+                else:
+                    fake.updates.put_nowait(update)
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+
+            async def tap(update_id):
+                callback_id = update_id % args.seed + 1
+                status = (update_id // args.seed) % 2 # Каждый проход по заявкам меняет статус обратно
+                data = CallbackAction(action='toggle_status', item_id=callback_id, page=0,
+                                      current_status=status).pack()
+                async with semaphore:
+                    future = fake.answered[str(update_id)] = asyncio.get_running_loop().create_future()
+                    started = time.perf_counter()
+                    await send(toggle_update(update_id, callback_id, status, data))
+                    latencies.append(await asyncio.wait_for(future, 30) - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(tap(i) for i in range(1, args.updates + 1)))
+            elapsed = time.perf_counter() - started
+    finally:
+        bot_process.terminate()
+        bot_process.wait(10)
+        await runner.cleanup()
+
+    latencies.sort()
+    print(f"Режим: {args.mode}, обновлений: {len(latencies)}, параллельно: {args.concurrency}")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.0f} обновлений/с")
+    print(f"Задержка: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс, макс {latencies[-1] * 1000:.1f} мс")
+    print(f"Вызовы Bot API: {json.dumps(fake.api_calls, ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='webhook')
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20, help='нажатий в обработке одновременно')
+    parser.add_argument('--seed', type=int, default=50, help='заявок в БД')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-bot-')
+    os.chdir(workdir) # Логи приложения пишутся во временную папку
+    sys.path.insert(0, BASE_DIR)
+    os.environ.pop('DATABASE_URL', None)
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['NOTIFY_DISPATCHER_THREAD'] = '0' # Уведомления о заявках не нужны
+    os.environ['CALLBACK_WRITE_BEHIND'] = '0'
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    os.environ['ADMIN_ID'] = str(ADMIN_ID)
+    os.environ['BOT_TOKEN'] = BOT_TOKEN
+
+    import callback_spool
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        callback_spool.store_callbacks(
+            [callback_spool.new_entry('Bench', None, f'+7000000{i:04d}', 'individual_online') for i in range(args.seed)],
+            ADMIN_ID,
+        )
+        db.session.commit()
+
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,80 @@
 import asyncio
-import sqlite3
+import functools
 import logging
-from aiogram import Bot, Dispatcher, types, F
+import random
+import secrets
+import tempfile
+import time
+from datetime import datetime, timedelta
+from html import escape
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import CommandStart, Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.exceptions import TelegramBadRequest # Для обработки ошибок редактирования
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest # Для обработки ошибок редактирования
 from aiogram.filters.callback_data import CallbackData
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from prometheus_client import start_http_server
+from sqlalchemy import select, update, false, func, tuple_, union_all
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker
 import os
 from dotenv import load_dotenv
 
+import callback_archive
+import callback_export
+import callback_search
+import callback_stats
+import counters
+import metrics
+import price_catalog
+import profiling
+from database import SQLITE_CHECKPOINT_INTERVAL, checkpoint_statement, create_async_db_engine
+from models import Callback, CallbackArchive, CallbackCounter, CallbackDailyStat, PricingPlan
+
 load_dotenv()
 
 # --- Константы ---
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_ID_STR = os.getenv('ADMIN_ID')
-DATABASE = os.getenv('DATABASE_PATH', 'database.db')
 CALLBACKS_PER_PAGE = 10 # Количество заявок на одной странице
+# Направления keyset-пагинации (коротко - callback_data в Telegram ограничена 64 байтами)
+DIRECTION_FROM = 'f' # С якоря включительно (перерисовка текущей страницы)
+DIRECTION_AFTER = 'a' # Строго после якоря (следующая страница)
+DIRECTION_BEFORE = 'b' # Строго перед якорем (предыдущая страница)
+SEARCH_MATCHES = 'search' # Ключ числа найденных заявок в словаре счетчиков (для /find)
+UPLOAD_LIMIT = 50 * 1024 * 1024 # Предел размера файла, который бот может отправить через api.telegram.org
+# Массовые действия со страницей заявок: отметить всю страницу, режим выбора, отметить выбранные
+ACTION_MARK_PAGE = 'mark_page'
+ACTION_SELECT_MODE = 'select_mode'
+ACTION_SELECT = 'select'
+ACTION_APPLY_SELECTION = 'apply_selection'
+SELECTED_MARK = '☑️'
+UNSELECTED_MARK = '⬜'
+
+# --- Получение обновлений: long polling или вебхук ---
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower() # 'polling' или 'webhook'
+# Публичный https-адрес, на который Telegram присылает обновления (за nginx), например https://example.com
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1') # Локальный aiohttp-сервер, на который проксирует nginx
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8081))
+# Telegram передает секрет в заголовке X-Telegram-Bot-Api-Secret-Token; без него запросы отклоняются.
+# Если не задан - генерируется при каждом запуске (вебхук все равно переустанавливается)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+# Свой Bot API сервер (или локальный тестовый) вместо api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Порт, на котором бот отдает свои метрики Prometheus (http://127.0.0.1:<порт>/metrics); 0 - не отдавать
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 0))
+# Профилирование обработчиков (свернутые стеки в logs/profiles): имена функций через запятую,
+# например "handle_page_callback,handle_find", и доля профилируемых вызовов
+BOT_PROFILE_HANDLERS = profiling.parse_names(os.getenv('BOT_PROFILE_HANDLERS'))
+BOT_PROFILE_SAMPLE_RATE = float(os.getenv('BOT_PROFILE_SAMPLE_RATE', 1))
+BOT_PROFILE_DIR = os.path.join('logs', profiling.PROFILE_SUBDIR)
 
 ADMIN_ID = None
 if not BOT_TOKEN:
@@ -36,93 +93,259 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Инициализация бота и диспетчера ---
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
 dp = Dispatcher()
 
+# --- Асинхронный движок БД с пулом соединений (модели общие с app.py) ---
+# Запросы выполняются драйвером aiosqlite/asyncpg и не блокируют цикл событий aiogram
+engine = create_async_db_engine()
+async_session = async_sessionmaker(engine, expire_on_commit=False)
+
 # --- CallbackData Фабрики ---
 class CallbackAction(CallbackData, prefix="cb"):
-    action: str # 'toggle_status' или 'page'
-    item_id: int # ID заявки (для toggle_status) или 0 (для page)
-    page: int # Текущая или целевая страница
-    current_status: int # Текущий статус (0 или 1) (для toggle_status)
+    action: str # 'toggle_status', 'page' или массовые действия (ACTION_* выше)
+    item_id: int # ID заявки (для toggle_status и select) или 0
+    page: int # Текущая или целевая страница (только для заголовка)
+    current_status: int # Текущий статус (0 или 1) для toggle_status; для select - выбрана ли заявка
+    cursor: int = 0 # ID заявки-якоря для keyset-пагинации (0 - начало списка)
+    direction: str = DIRECTION_FROM # Как выбирать строки относительно якоря (см. get_callbacks)
+    only_new: int = 0 # 1 - показывать только необработанные заявки (/new)
+    search: int = 0 # 1 - результаты /find (сам запрос не влезает в 64 байта и хранится в search_queries)
 
 # --- Функции для работы с БД ---
-def get_db_connection():
-    """Создает и возвращает соединение с БД."""
-    try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Database connection error: {e}")
-        return None
-
-def get_callbacks(offset=0, limit=CALLBACKS_PER_PAGE):
-    """Получает список заявок из БД с пагинацией."""
-    conn = get_db_connection()
-    if not conn: return [], 0 # Возвращаем пустой список и 0, если нет соединения
-    try:
-        cursor = conn.cursor()
-        # Получаем общее количество записей
-        cursor.execute("SELECT COUNT(*) FROM callbacks")
-        total_count = cursor.fetchone()[0]
-        # Получаем записи для текущей страницы
-        cursor.execute("SELECT id, name, phone, processed, timestamp FROM callbacks ORDER BY timestamp DESC LIMIT ? OFFSET ?", (limit, offset))
-        callbacks = cursor.fetchall()
-        conn.close()
-        return callbacks, total_count
-    except sqlite3.Error as e:
+async def get_callbacks(anchor_id=0, direction=DIRECTION_FROM, only_new=False, limit=CALLBACKS_PER_PAGE, search=None):
+    """Получает страницу заявок из БД (keyset-пагинация по (timestamp, id)).
+
+    anchor_id - ID заявки-якоря, direction - как выбирать строки относительно него:
+    DIRECTION_FROM - начиная с якоря (включительно) и старше, DIRECTION_AFTER - строго старше якоря,
+    DIRECTION_BEFORE - строго новее якоря (предыдущая страница).
+    Возвращает (заявки, счетчики заявок, есть ли следующая страница, достигнуто ли начало списка).
+    Стоимость запроса не зависит от номера страницы - поиск идет по индексу, без OFFSET,
+    а общее количество берется из таблицы счетчиков, а не из COUNT(*).
+    search - разобранный запрос /find (callback_search.parse_query): заявки берутся из поискового
+    индекса, а число найденных возвращается в счетчиках под ключом SEARCH_MATCHES.
+    """
+    if search:
+        # /find ищет и в архиве: найденные строки обеих таблиц листаются как один список
+        source = union_all(*(
+            select(model.id, model.name, model.phone, model.processed, model.timestamp)
+            .where(callback_search.search_filter(engine.dialect.name, search, model))
+            for model in (Callback, CallbackArchive)
+        )).subquery('found')
+    else:
+        source = Callback.__table__
+    row = source.c
+    # "processed = false()" компилируется в литерал, поэтому работает частичный индекс ix_callbacks_unprocessed
+    filters = [row.processed == false()] if only_new else []
+    columns = select(row.id, row.name, row.phone, row.processed, row.timestamp)
+    try:
+        async with async_session() as session:
+            # Счетчики заявок (несколько строк по первичному ключу вместо COUNT(*))
+            counter_rows = await session.execute(select(CallbackCounter.name, CallbackCounter.value))
+            callback_counters = counters.counters_from_rows(counter_rows.all())
+            if search:
+                callback_counters[SEARCH_MATCHES] = await session.scalar(
+                    select(func.count()).select_from(source).where(*filters))
+
+            anchor = None
+            if anchor_id and await session.scalar(select(row.id).where(row.id == anchor_id)):
+                # Время якоря берем подзапросом прямо в SQL: так сравниваются значения в одном
+                # формате хранения (старые строки SQLite записаны без микросекунд).
+                # Если якорь удален - начинаем с начала списка.
+                anchor_ts = select(row.timestamp).where(row.id == anchor_id).correlate(None).scalar_subquery()
+                anchor = tuple_(anchor_ts, anchor_id)
+            position = tuple_(row.timestamp, row.id)
+
+            if direction == DIRECTION_BEFORE and anchor is not None:
+                result = await session.execute(
+                    columns.where(*filters, position > anchor)
+                    .order_by(row.timestamp.asc(), row.id.asc()).limit(limit + 1))
+                callbacks = result.all()
+                if len(callbacks) > limit:
+                    return list(reversed(callbacks[:limit])), callback_counters, True, False
+                # Дошли до начала списка - показываем первую страницу целиком
+                anchor = None
+
+            query = columns.where(*filters)
+            if anchor is not None:
+                query = query.where(position <= anchor if direction == DIRECTION_FROM else position < anchor)
+            result = await session.execute(
+                query.order_by(row.timestamp.desc(), row.id.desc()).limit(limit + 1))
+            callbacks = result.all()
+            return callbacks[:limit], callback_counters, len(callbacks) > limit, anchor is None
+    except SQLAlchemyError as e:
         logger.error(f"Error fetching callbacks: {e}")
-        if conn: conn.close()
-        return [], 0
+        return [], counters.counters_from_rows([]), False, True
 
-def update_callback_status(callback_id: int, status: int):
+async def update_callback_status(callback_id: int, status: int):
     """Обновляет статус processed для заявки."""
-    conn = get_db_connection()
-    if not conn: return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE callbacks SET processed = ? WHERE id = ?", (status, callback_id))
-        conn.commit()
-        conn.close()
+        async with async_session() as session:
+            # Условие на старый статус: счетчики и сводку меняем, только если статус действительно изменился
+            changed = (Callback.id == callback_id, Callback.processed != bool(status))
+            now = datetime.utcnow()
+            await session.execute(callback_stats.status_change_statement(engine.dialect.name, Callback, changed, bool(status), now))
+            result = await session.execute(
+                update(Callback).where(*changed).values(processed=bool(status), processed_at=now if status else None)
+            )
+            if result.rowcount:
+                deltas = counters.status_change_deltas(bool(status), result.rowcount)
+                for statement in counters.counter_upserts(engine.dialect.name, deltas):
+                    await session.execute(statement)
+            elif not status:
+                # Заявки нет среди рабочих - возможно, она в архиве (найдена через /find): возвращаем в работу
+                connection = await session.connection()
+                if await connection.run_sync(callback_archive.restore_callback, callback_id):
+                    logger.info(f"Callback ID {callback_id} restored from archive")
+            await session.commit()
         logger.info(f"Callback ID {callback_id} status updated to {status}")
         return True
-    except sqlite3.Error as e:
+    except SQLAlchemyError as e:
         logger.error(f"Error updating callback status for ID {callback_id}: {e}")
-        if conn: conn.close()
         return False
 
+async def mark_callbacks_processed(ids=None, before=None):
+    """Отмечает обработанными необработанные заявки одним UPDATE и одной транзакцией.
+
+    ids - список ID (страница или выбор), before - все заявки старше этого момента (UTC).
+    Счетчики и сводка /stats меняются в той же транзакции. Возвращает число отмеченных заявок или None при ошибке БД.
+    """
+    # "processed = false()" - литерал, поэтому отбор по времени идет по частичному индексу ix_callbacks_unprocessed
+    condition = [Callback.processed == false()]
+    if ids is not None:
+        condition.append(Callback.id.in_(ids))
+    if before is not None:
+        condition.append(Callback.timestamp < before)
+    now = datetime.utcnow()
+    query = update(Callback).where(*condition).values(processed=True, processed_at=now)
+    try:
+        async with async_session() as session:
+            # Сводка - одним INSERT ... SELECT ... GROUP BY по тем же строкам, до их UPDATE
+            await session.execute(callback_stats.status_change_statement(engine.dialect.name, Callback, condition, True, now))
+            result = await session.execute(query.execution_options(synchronize_session=False))
+            if result.rowcount:
+                deltas = counters.status_change_deltas(True, result.rowcount)
+                for statement in counters.counter_upserts(engine.dialect.name, deltas):
+                    await session.execute(statement)
+            await session.commit()
+        return result.rowcount
+    except SQLAlchemyError as e:
+        logger.error(f"Error marking callbacks processed: {e}")
+        return None
+
+async def get_daily_stats(since):
+    """Строки дневной сводки заявок начиная с дня since (None при ошибке БД).
+
+    Читается не больше "дни x типы занятий" строк по первичному ключу - от размера callbacks не зависит.
+    """
+    try:
+        async with async_session() as session:
+            result = await session.scalars(select(CallbackDailyStat).where(CallbackDailyStat.day >= since))
+            return result.all()
+    except SQLAlchemyError as e:
+        logger.error(f"Error fetching daily stats: {e}")
+        return None
+
+async def get_pricing_plans():
+    """Возвращает тарифы в порядке показа на сайте (None при ошибке БД)."""
+    try:
+        async with async_session() as session:
+            result = await session.scalars(select(PricingPlan).order_by(PricingPlan.position, PricingPlan.key))
+            return result.all()
+    except SQLAlchemyError as e:
+        logger.error(f"Error fetching pricing plans: {e}")
+        return None
+
+async def update_pricing_plan(key: str, field: str, value: str | None):
+    """Меняет поле тарифа и увеличивает версию цен одной транзакцией.
+
+    Возвращает True, False (тарифа нет) или None (ошибка БД). Сайт подхватит изменение в течение секунды.
+    """
+    try:
+        async with async_session() as session:
+            result = await session.execute(
+                update(PricingPlan).where(PricingPlan.key == key).values({field: value, 'updated_at': datetime.utcnow()})
+            )
+            if not result.rowcount:
+                return False
+            await session.execute(price_catalog.bump_version_statement())
+            await session.commit()
+        logger.info(f"Pricing plan {key}: {field} set to {value!r}")
+        return True
+    except SQLAlchemyError as e:
+        logger.error(f"Error updating pricing plan {key}: {e}")
+        return None
+
+async def write_export_file(fmt: str, filters: dict, path: str) -> int:
+    """Пишет выгрузку заявок в файл, читая строки с курсора пачками. Возвращает число строк.
+
+    В памяти одновременно только одна пачка (CHUNK_ROWS строк), запись на диск - в отдельном потоке.
+    """
+    count = 0
+    with open(path, 'wb') as f:
+        writer = callback_export.WRITERS[fmt](f)
+        async with async_session() as session:
+            for query in callback_export.export_queries(**filters): # Архив и рабочая таблица
+                result = await session.stream(query.execution_options(yield_per=callback_export.CHUNK_ROWS))
+                async for rows in result.partitions():
+                    await asyncio.to_thread(writer.write_rows, rows)
+                    count += len(rows)
+        await asyncio.to_thread(writer.close)
+    return count
+
 # --- Клавиатуры ---
-def create_callbacks_keyboard(callbacks: list, current_page: int, total_count: int) -> InlineKeyboardMarkup:
-    """Создает инлайн-клавиатуру для списка заявок с пагинацией."""
+def status_button_text(processed, label: str) -> str:
+    """Текст кнопки заявки: значок статуса и "Имя - Телефон"."""
+    return f"{'✅' if processed else '❌'} {label}"
+
+def create_callbacks_keyboard(callbacks: list, current_page: int, has_next: bool, only_new: bool = False,
+                              search: bool = False) -> InlineKeyboardMarkup:
+    """Создает инлайн-клавиатуру для списка заявок с keyset-пагинацией."""
     builder = InlineKeyboardBuilder()
     if not callbacks:
-        builder.row(InlineKeyboardButton(text="Нет необработанных заявок", callback_data=CallbackAction(action="noop", item_id=0, page=0, current_status=0).pack())) # Пустая кнопка
+        empty_text = "Ничего не найдено" if search else "Нет необработанных заявок"
+        builder.row(InlineKeyboardButton(text=empty_text, callback_data=CallbackAction(action="noop", item_id=0, page=0, current_status=0).pack())) # Пустая кнопка
         return builder.as_markup()
 
-    # Кнопки для каждой заявки
-    for cb in callbacks:
-        status_icon = "✅" if cb['processed'] == 1 else "❌"
-        button_text = f"{status_icon} {cb['name']} - {cb['phone']}"
-        # Передаем ID заявки, текущую страницу и ТЕКУЩИЙ статус
-        callback_data = CallbackAction(
-            action="toggle_status",
-            item_id=cb['id'],
+    first_id, last_id = callbacks[0].id, callbacks[-1].id
+
+    def page_action(action, item_id=0, current_status=0):
+        # Действие на текущей странице: после него страница перерисовывается с ее первой заявки
+        return CallbackAction(
+            action=action,
+            item_id=item_id,
             page=current_page,
-            current_status=cb['processed']
+            current_status=current_status,
+            cursor=first_id if current_page > 0 else 0,
+            direction=DIRECTION_FROM,
+            only_new=int(only_new),
+            search=int(search)
         ).pack()
+
+    # Кнопки для каждой заявки
+    for cb in callbacks:
+        button_text = status_button_text(cb.processed, f"{cb.name} - {cb.phone}")
+        # Передаем ID заявки, текущую страницу (через ее первую заявку) и ТЕКУЩИЙ статус
+        callback_data = page_action("toggle_status", cb.id, int(cb.processed))
         builder.row(InlineKeyboardButton(text=button_text, callback_data=callback_data))
 
-    # Кнопки пагинации
-    total_pages = (total_count + CALLBACKS_PER_PAGE - 1) // CALLBACKS_PER_PAGE
+    # Массовые действия: вся страница сразу или выбранные заявки
+    bulk_buttons = []
+    if any(not cb.processed for cb in callbacks):
+        bulk_buttons.append(InlineKeyboardButton(text="✅ Всю страницу", callback_data=page_action(ACTION_MARK_PAGE)))
+    bulk_buttons.append(InlineKeyboardButton(text=f"{SELECTED_MARK} Выбрать", callback_data=page_action(ACTION_SELECT_MODE)))
+    builder.row(*bulk_buttons)
+
+    # Кнопки пагинации: якорем служит первая/последняя заявка текущей страницы
     pagination_buttons = []
     if current_page > 0:
         pagination_buttons.append(
-            InlineKeyboardButton(text="⬅️ Назад", callback_data=CallbackAction(action="page", item_id=0, page=current_page - 1, current_status=0).pack())
+            InlineKeyboardButton(text="⬅️ Назад", callback_data=CallbackAction(action="page", item_id=0, page=current_page - 1, current_status=0, cursor=first_id, direction=DIRECTION_BEFORE, only_new=int(only_new), search=int(search)).pack())
         )
-    if current_page < total_pages - 1:
+    if has_next:
         pagination_buttons.append(
-            InlineKeyboardButton(text="Вперед ➡️", callback_data=CallbackAction(action="page", item_id=0, page=current_page + 1, current_status=0).pack())
+            InlineKeyboardButton(text="Вперед ➡️", callback_data=CallbackAction(action="page", item_id=0, page=current_page + 1, current_status=0, cursor=last_id, direction=DIRECTION_AFTER, only_new=int(only_new), search=int(search)).pack())
         )
 
     if pagination_buttons:
@@ -130,10 +353,115 @@ def create_callbacks_keyboard(callbacks: list, current_page: int, total_count: i
 
     return builder.as_markup()
 
+def unpack_button(button: InlineKeyboardButton) -> CallbackAction | None:
+    """Данные кнопки списка заявок (None - у кнопки нет наших данных)."""
+    try:
+        return CallbackAction.unpack(button.callback_data) if button.callback_data else None
+    except (TypeError, ValueError):
+        return None # Чужая кнопка
+
+def patch_status_button(keyboard: InlineKeyboardMarkup, callback_id: int, status: int) -> InlineKeyboardMarkup | None:
+    """Копия клавиатуры, в которой у кнопки заявки callback_id выставлен статус status.
+
+    Остальные кнопки не меняются. Возвращает None, если кнопки этой заявки на клавиатуре нет.
+    """
+    found = False
+    rows = []
+    for row in keyboard.inline_keyboard:
+        new_row = []
+        for button in row:
+            data = unpack_button(button)
+            if data and data.action == "toggle_status" and data.item_id == callback_id:
+                label = button.text.split(" ", 1)[-1]
+                button = button.model_copy(update={
+                    "text": status_button_text(status, label),
+                    "callback_data": data.model_copy(update={"current_status": status}).pack(),
+                })
+                found = True
+            new_row.append(button)
+        rows.append(new_row)
+    return InlineKeyboardMarkup(inline_keyboard=rows) if found else None
+
+def keyboard_items(keyboard: InlineKeyboardMarkup, action: str) -> list[CallbackAction]:
+    """Данные кнопок заявок с действием action в порядке показа."""
+    items = []
+    for row in keyboard.inline_keyboard:
+        for button in row:
+            data = unpack_button(button)
+            if data and data.action == action:
+                items.append(data)
+    return items
+
+def selection_keyboard(keyboard: InlineKeyboardMarkup) -> InlineKeyboardMarkup | None:
+    """Клавиатура режима выбора, собранная из клавиатуры страницы (без чтения из БД).
+
+    Нажатие на заявку только отмечает ее (меняется одна кнопка), внизу - "отметить выбранные" и "отмена".
+    Выбор хранится в самих кнопках, поэтому переживает и перезапуск бота. None - на клавиатуре нет заявок.
+    """
+    rows, context = [], None
+    for row in keyboard.inline_keyboard:
+        for button in row:
+            data = unpack_button(button)
+            if data and data.action == "toggle_status":
+                context = data
+                select_data = data.model_copy(update={"action": ACTION_SELECT, "current_status": 0})
+                rows.append([button.model_copy(update={
+                    "text": f"{UNSELECTED_MARK} {button.text}", "callback_data": select_data.pack()})])
+    if context is None:
+        return None
+    page_data = context.model_copy(update={"item_id": 0, "current_status": 0})
+    rows.append([
+        InlineKeyboardButton(text="✅ Отметить выбранные",
+                             callback_data=page_data.model_copy(update={"action": ACTION_APPLY_SELECTION}).pack()),
+        # Отмена - та же страница в обычном виде
+        InlineKeyboardButton(text="✖️ Отмена", callback_data=page_data.model_copy(update={"action": "page"}).pack()),
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def toggle_selection(keyboard: InlineKeyboardMarkup, callback_id: int) -> InlineKeyboardMarkup | None:
+    """Копия клавиатуры режима выбора с переключенной отметкой заявки callback_id (None - кнопки нет)."""
+    found = False
+    rows = []
+    for row in keyboard.inline_keyboard:
+        new_row = []
+        for button in row:
+            data = unpack_button(button)
+            if data and data.action == ACTION_SELECT and data.item_id == callback_id:
+                selected = 1 - data.current_status
+                label = button.text.split(" ", 1)[-1]
+                button = button.model_copy(update={
+                    "text": f"{SELECTED_MARK if selected else UNSELECTED_MARK} {label}",
+                    "callback_data": data.model_copy(update={"current_status": selected}).pack(),
+                })
+                found = True
+            new_row.append(button)
+        rows.append(new_row)
+    return InlineKeyboardMarkup(inline_keyboard=rows) if found else None
+
+# --- Последняя отрисованная страница в каждом чате ---
+# chat_id -> (message_id, клавиатура). При смене статуса по ней меняется одна кнопка без
+# повторного чтения страницы из БД, а повторное нажатие не вызывает Telegram вовсе.
+# Бот отвечает только администратору, поэтому записей здесь единицы.
+last_pages = {}
+
+# chat_id -> строка последнего поиска /find (для кнопок пагинации и смены статуса в результатах)
+search_queries = {}
+
+def remember_page(message: types.Message, keyboard: InlineKeyboardMarkup):
+    last_pages[message.chat.id] = (message.message_id, keyboard)
+
+def last_page_keyboard(message) -> InlineKeyboardMarkup | None:
+    """Клавиатура сообщения: из кэша, а если его нет (например, после перезапуска) - присланная Telegram."""
+    cached = last_pages.get(message.chat.id)
+    if cached and cached[0] == message.message_id:
+        return cached[1]
+    return getattr(message, "reply_markup", None) # У недоступного (старого) сообщения клавиатуры нет
+
 # --- Обработчики команд и колбэков ---
 
 # Декоратор для проверки ID админа
 def admin_only(handler):
+    @functools.wraps(handler) # aiogram берет имя и параметры обработчика из обернутой функции
     async def wrapper(event: types.Message | types.CallbackQuery, *args, **kwargs):
         if event.from_user.id != ADMIN_ID:
             logger.warning(f"Unauthorized access attempt by user {event.from_user.id}")
@@ -146,32 +474,96 @@ def admin_only(handler):
     return wrapper
 
 
-async def show_page(event: types.Message | types.CallbackQuery, page: int = 0):
-    """Отображает страницу со списком заявок."""
-    offset = page * CALLBACKS_PER_PAGE
-    callbacks, total_count = get_callbacks(offset=offset, limit=CALLBACKS_PER_PAGE)
-    total_pages = (total_count + CALLBACKS_PER_PAGE - 1) // CALLBACKS_PER_PAGE
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы и исключения каждого обработчика (метрики bot_handler_*)."""
 
-    text = f"<b>Список заявок</b> (Страница {page + 1}/{total_pages}, Всего: {total_count}):\n\n"
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.BOT_HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            metrics.BOT_HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Профилирует обработчики из BOT_PROFILE_HANDLERS (см. profiling.StackSampler)."""
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        if name not in BOT_PROFILE_HANDLERS or (BOT_PROFILE_SAMPLE_RATE < 1 and random.random() >= BOT_PROFILE_SAMPLE_RATE):
+            return await handler(event, data)
+        sampler = profiling.StackSampler(task=asyncio.current_task()).start()
+        try:
+            return await handler(event, data)
+        finally:
+            stacks = sampler.stop()
+            try:
+                path = await asyncio.to_thread(profiling.write_profile, BOT_PROFILE_DIR, name, stacks, sampler.elapsed)
+                logger.info(f"Profile of {name} ({sampler.elapsed * 1000:.0f} ms): {path or 'no samples'}")
+            except OSError as e:
+                logger.error(f"Failed to write profile of {name}: {e}")
+
+
+for observer in (dp.message, dp.callback_query):
+    observer.middleware(HandlerMetricsMiddleware())
+    if BOT_PROFILE_HANDLERS:
+        observer.middleware(ProfilingMiddleware())
+
+
+async def show_page(event: types.Message | types.CallbackQuery, page: int = 0, anchor_id: int = 0,
+                    direction: str = DIRECTION_FROM, only_new: bool = False, search: str | None = None,
+                    notice: str | None = None):
+    """Отображает страницу со списком заявок (search - строка поиска /find, notice - строка над заголовком)."""
+    parsed_search = callback_search.parse_query(search) if search else None
+    callbacks, callback_counters, has_next, at_start = await get_callbacks(
+        anchor_id=anchor_id, direction=direction, only_new=only_new, limit=CALLBACKS_PER_PAGE,
+        search=parsed_search)
+    if at_start:
+        page = 0 # Например, сверху добавились новые заявки и "Назад" привел к началу списка
+    if parsed_search:
+        total_count = callback_counters.get(SEARCH_MATCHES, 0)
+    else:
+        total_count = callback_counters[counters.UNPROCESSED if only_new else counters.TOTAL]
+    total_pages = max((total_count + CALLBACKS_PER_PAGE - 1) // CALLBACKS_PER_PAGE, page + 1)
+
+    if parsed_search:
+        title = f"Поиск: {escape(search)}"
+    else:
+        title = "Необработанные заявки" if only_new else "Список заявок"
+    text = f"{notice}\n\n" if notice else ""
+    text += f"<b>{title}</b> (Страница {page + 1}/{total_pages}, Всего: {total_count})\n"
+    # Счетчики уже прочитаны вместе со страницей - показываем их бесплатно
+    text += f"🔴 Необработано: {callback_counters[counters.UNPROCESSED]} | ✅ Обработано: {callback_counters[counters.PROCESSED]}\n"
+    by_type = counters.lesson_type_counts(callback_counters)
+    if by_type:
+        text += " | ".join(f"{escape(lesson_type)}: {count}" for lesson_type, count in sorted(by_type.items())) + "\n"
+    text += "\n"
     if not callbacks and total_count > 0:
          text += "На этой странице заявок нет."
     elif not callbacks and total_count == 0:
-         text += "Новых заявок нет."
+         text += "Ничего не найдено." if parsed_search else "Новых заявок нет."
     # Текст заявки теперь в кнопках
 
-    keyboard = create_callbacks_keyboard(callbacks, page, total_count)
+    keyboard = create_callbacks_keyboard(callbacks, page, has_next, only_new, search=bool(parsed_search))
 
     if isinstance(event, types.Message):
-        await event.answer(text, reply_markup=keyboard)
+        sent = await event.answer(text, reply_markup=keyboard)
+        remember_page(sent, keyboard)
     elif isinstance(event, types.CallbackQuery) and event.message:
         try:
             # Пытаемся отредактировать сообщение
             await event.message.edit_text(text, reply_markup=keyboard)
+            remember_page(event.message, keyboard)
             await event.answer() # Убираем часики на кнопке
         except TelegramBadRequest as e:
             # Если сообщение не изменилось, просто убираем часики
             if "message is not modified" in str(e):
-                await event.answer("Статус обновлен.")
+                remember_page(event.message, keyboard)
+                await event.answer()
             else:
                 logger.error(f"Error editing message: {e}")
                 await event.answer("Не удалось обновить список.", show_alert=True)
@@ -187,12 +579,173 @@ async def handle_start_or_callbacks(message: types.Message, **kwargs): # <-- Д
     await show_page(message, page=0)
 
 
+@dp.message(Command("new"))
+@admin_only
+async def handle_new_callbacks(message: types.Message, **kwargs):
+    """Обработчик команды /new - только необработанные заявки."""
+    logger.info(f"Admin {message.from_user.id} requested unprocessed callbacks list.")
+    await show_page(message, page=0, only_new=True)
+
+
+@dp.message(Command("markold"))
+@admin_only
+async def handle_mark_old(message: types.Message, command: CommandObject, **kwargs):
+    """Обработчик команды /markold N - отметить обработанными все заявки старше N дней."""
+    days = (command.args or "").strip()
+    if not days.isdigit():
+        await message.answer("Использование: <code>/markold 30</code> - отметить обработанными все заявки старше 30 дней.")
+        return
+    marked = await mark_callbacks_processed(before=datetime.utcnow() - timedelta(days=int(days)))
+    if marked is None:
+        await message.answer("Ошибка при обновлении статусов в БД.")
+        return
+    logger.info(f"Admin {message.from_user.id} marked {marked} callbacks older than {days} days as processed")
+    await show_page(message, page=0, only_new=True, notice=f"✅ Отмечено обработанными: {marked} (старше {days} дн.)")
+
+
+@dp.message(Command("stats"))
+@admin_only
+async def handle_stats(message: types.Message, command: CommandObject, **kwargs):
+    """Обработчик команды /stats - заявки по дням или неделям, по типам занятий и время до обработки."""
+    try:
+        weekly, periods = callback_stats.parse_stats_args(command.args)
+    except ValueError:
+        await message.answer("Использование: <code>/stats</code> или <code>/stats 30</code> - по дням, "
+                             "<code>/stats week</code> или <code>/stats week 12</code> - по неделям.")
+        return
+    today = datetime.utcnow().date()
+    start = callback_stats.period_start(today, weekly, periods)
+    rows = await get_daily_stats(start)
+    if rows is None:
+        await message.answer("Ошибка при чтении статистики из БД.")
+        return
+    logger.info(f"Admin {message.from_user.id} requested stats ({'weeks' if weekly else 'days'}: {periods})")
+    await message.answer(callback_stats.format_stats(rows, weekly, start, today))
+
+
+@dp.message(Command("find"))
+@admin_only
+async def handle_find(message: types.Message, command: CommandObject, **kwargs):
+    """Обработчик команды /find - поиск заявок по имени, email или части телефона."""
+    query = (command.args or "").strip()
+    if not callback_search.parse_query(query):
+        await message.answer("Использование: <code>/find Иван</code>, <code>/find mail.ru</code> или "
+                             f"<code>/find 9161234</code> (не короче {callback_search.MIN_TERM_LENGTH} символов)")
+        return
+    logger.info(f"Admin {message.from_user.id} searched callbacks")
+    search_queries[message.chat.id] = query
+    await show_page(message, page=0, search=query)
+
+
+def search_query_for(query: types.CallbackQuery, callback_data: CallbackAction):
+    """Строка поиска для кнопки из результатов /find. None - кнопка не из поиска."""
+    if not callback_data.search:
+        return None
+    return search_queries.get(query.message.chat.id) if query.message else None
+
+
+@dp.message(Command("export"))
+@admin_only
+async def handle_export(message: types.Message, command: CommandObject, **kwargs):
+    """Обработчик команды /export [csv|xlsx] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [new|done] - файл с заявками."""
+    usage = ("Использование: <code>/export [csv|xlsx] [2025-01-01 [2025-01-31]] [new|done]</code>\n"
+             "new - только необработанные, done - только обработанные.")
+    fmt, dates, processed = 'csv', [], None
+    for arg in (command.args or "").split():
+        lowered = arg.lower()
+        if lowered in callback_export.EXPORT_FORMATS:
+            fmt = lowered
+        elif lowered in ('new', 'done'):
+            processed = '1' if lowered == 'done' else '0'
+        else:
+            dates.append(arg)
+    try:
+        if len(dates) > 2:
+            raise ValueError("Укажите не больше двух дат.")
+        filters = callback_export.parse_filters(*dates, processed=processed)
+    except ValueError as e:
+        await message.answer(f"{escape(str(e))}\n{usage}")
+        return
+
+    logger.info(f"Admin {message.from_user.id} requested export ({fmt}, {filters})")
+    await bot.send_chat_action(message.chat.id, "upload_document")
+    filename = callback_export.export_filename(fmt, filters)
+    with tempfile.TemporaryDirectory(prefix="export-") as directory:
+        path = os.path.join(directory, filename)
+        try:
+            count = await write_export_file(fmt, filters, path)
+        except SQLAlchemyError as e:
+            logger.error(f"Error exporting callbacks: {e}")
+            await message.answer("Ошибка при выгрузке заявок из БД.")
+            return
+        size = os.path.getsize(path)
+        if size > UPLOAD_LIMIT:
+            await message.answer(f"Файл получился {size // (1024 * 1024)} МБ - больше лимита Telegram. "
+                                 "Сузьте период или скачайте выгрузку по HTTP (/export/callbacks.csv).")
+            return
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"Заявок: {count}")
+
+
+@dp.message(Command("prices"))
+@admin_only
+async def handle_prices(message: types.Message, **kwargs):
+    """Обработчик команды /prices - текущие тарифы с ключами для /setprice."""
+    plans = await get_pricing_plans()
+    if plans is None:
+        await message.answer("Ошибка при чтении тарифов из БД.")
+        return
+    lines = ["<b>Тарифы на сайте</b>\n"]
+    for plan in plans:
+        old_price = f" (было {escape(plan.old_price)})" if plan.old_price else ""
+        lines.append(f"<code>{escape(plan.key)}</code> - {escape(plan.title)}: "
+                     f"<b>{escape(plan.price)}</b>{old_price} {escape(plan.unit)}")
+    lines.append("\nИзменить цену: <code>/setprice ключ 3200</code>\n"
+                 f"Другое поле: <code>/setprice ключ поле значение</code> (поля: {', '.join(price_catalog.EDITABLE_FIELDS)}; "
+                 "<code>-</code> убирает старую цену)")
+    await message.answer("\n".join(lines))
+
+
+@dp.message(Command("setprice"))
+@admin_only
+async def handle_set_price(message: types.Message, command: CommandObject, **kwargs):
+    """Обработчик команды /setprice ключ [поле] значение."""
+    args = (command.args or "").split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer("Использование: <code>/setprice ключ 3200</code> или "
+                             "<code>/setprice ключ поле значение</code>. Список тарифов: /prices")
+        return
+    key, rest = args
+    field, value = "price", rest.strip()
+    first_word, _, remainder = rest.partition(" ")
+    if first_word in price_catalog.EDITABLE_FIELDS and remainder.strip():
+        field, value = first_word, remainder.strip()
+    if field == "old_price" and value == "-":
+        value = None
+    elif field in ("price", "old_price") and not value.isdigit():
+        await message.answer("Цена должна быть целым числом, например <code>3200</code>.")
+        return
+
+    updated = await update_pricing_plan(key, field, value)
+    if updated is None:
+        await message.answer("Ошибка при обновлении тарифа в БД.")
+    elif not updated:
+        await message.answer(f"Тариф <code>{escape(key)}</code> не найден. Список тарифов: /prices")
+    else:
+        logger.info(f"Admin {message.from_user.id} changed {key}.{field}")
+        await message.answer(f"✅ {escape(key)}.{field} = {escape(value or '—')}. На сайте обновится в течение секунды.")
+
+
 @dp.callback_query(CallbackAction.filter(F.action == "page"))
 @admin_only
 async def handle_page_callback(query: types.CallbackQuery, callback_data: CallbackAction, **kwargs): # <-- Добавили **kwargs
     """Обработчик нажатия на кнопки пагинации."""
     logger.info(f"Admin {query.from_user.id} requested page {callback_data.page}")
-    await show_page(query, page=callback_data.page)
+    search = search_query_for(query, callback_data)
+    if callback_data.search and not search:
+        await query.answer("Результаты поиска устарели, повторите /find.", show_alert=True)
+        return
+    await show_page(query, page=callback_data.page, anchor_id=callback_data.cursor,
+                    direction=callback_data.direction, only_new=bool(callback_data.only_new), search=search)
 
 
 @dp.callback_query(CallbackAction.filter(F.action == "toggle_status"))
@@ -207,20 +760,196 @@ async def handle_toggle_status_callback(query: types.CallbackQuery, callback_dat
 
     logger.info(f"Admin {query.from_user.id} toggling status for callback ID {callback_id} to {new_status}")
 
-    success = update_callback_status(callback_id, new_status)
-
-    if success:
-        # Обновляем сообщение с той же страницей
-        await show_page(query, page=current_page)
-    else:
+    success = await update_callback_status(callback_id, new_status)
+    if not success:
         await query.answer("Ошибка при обновлении статуса в БД.", show_alert=True)
+        return
+
+    # Меняем только нажатую кнопку: страницу из БД не перечитываем и текст не перерисовываем
+    # (счетчики в заголовке обновятся при следующем переходе по страницам)
+    keyboard = last_page_keyboard(query.message) if query.message else None
+    patched = patch_status_button(keyboard, callback_id, new_status) if keyboard else None
+    if patched is None:
+        # Клавиатура неизвестна - обновляем сообщение с той же страницей целиком
+        await show_page(query, page=current_page, anchor_id=callback_data.cursor,
+                        only_new=bool(callback_data.only_new), search=search_query_for(query, callback_data))
+        return
+    if patched == keyboard:
+        # Повторное нажатие до обновления клавиатуры у клиента: на экране уже верный статус
+        await query.answer("Статус обновлен.")
+        return
+    try:
+        await query.message.edit_reply_markup(reply_markup=patched)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.error(f"Error editing keyboard: {e}")
+            await query.answer("Не удалось обновить список.", show_alert=True)
+            return
+    remember_page(query.message, patched)
+    await query.answer()
+
+
+async def apply_bulk_mark(query: types.CallbackQuery, callback_data: CallbackAction, ids: list[int]):
+    """Отмечает заявки ids одним запросом и один раз перерисовывает страницу (кнопки и счетчики)."""
+    search = search_query_for(query, callback_data)
+    marked = await mark_callbacks_processed(ids=ids)
+    if marked is None:
+        await query.answer("Ошибка при обновлении статусов в БД.", show_alert=True)
+        return
+    logger.info(f"Admin {query.from_user.id} marked {marked} of {len(ids)} callbacks as processed")
+    await show_page(query, page=callback_data.page, anchor_id=callback_data.cursor,
+                    only_new=bool(callback_data.only_new), search=search,
+                    notice=f"✅ Отмечено обработанными: {marked}")
+
+
+@dp.callback_query(CallbackAction.filter(F.action == ACTION_MARK_PAGE))
+@admin_only
+async def handle_mark_page_callback(query: types.CallbackQuery, callback_data: CallbackAction, **kwargs):
+    """Обработчик кнопки "Всю страницу": отмечает все необработанные заявки, видимые на странице."""
+    keyboard = last_page_keyboard(query.message) if query.message else None
+    ids = [item.item_id for item in keyboard_items(keyboard, "toggle_status") if not item.current_status] if keyboard else []
+    if not ids:
+        await query.answer("На странице нет необработанных заявок.")
+        return
+    await apply_bulk_mark(query, callback_data, ids)
+
+
+@dp.callback_query(CallbackAction.filter(F.action == ACTION_SELECT_MODE))
+@admin_only
+async def handle_select_mode_callback(query: types.CallbackQuery, callback_data: CallbackAction, **kwargs):
+    """Обработчик кнопки "Выбрать": переводит клавиатуру страницы в режим выбора."""
+    keyboard = last_page_keyboard(query.message) if query.message else None
+    selection = selection_keyboard(keyboard) if keyboard else None
+    if selection is None:
+        await query.answer("Список устарел, откройте его заново.", show_alert=True)
+        return
+    try:
+        await query.message.edit_reply_markup(reply_markup=selection)
+    except TelegramBadRequest as e:
+        logger.error(f"Error editing keyboard: {e}")
+        await query.answer("Не удалось обновить список.", show_alert=True)
+        return
+    remember_page(query.message, selection)
+    await query.answer("Отметьте заявки и нажмите \"Отметить выбранные\".")
+
+
+@dp.callback_query(CallbackAction.filter(F.action == ACTION_SELECT))
+@admin_only
+async def handle_select_callback(query: types.CallbackQuery, callback_data: CallbackAction, **kwargs):
+    """Обработчик нажатия на заявку в режиме выбора: меняется только ее отметка (без запросов к БД)."""
+    keyboard = last_page_keyboard(query.message) if query.message else None
+    patched = toggle_selection(keyboard, callback_data.item_id) if keyboard else None
+    if patched is None:
+        await query.answer("Список устарел, откройте его заново.", show_alert=True)
+        return
+    try:
+        await query.message.edit_reply_markup(reply_markup=patched)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.error(f"Error editing keyboard: {e}")
+            await query.answer("Не удалось обновить список.", show_alert=True)
+            return
+    remember_page(query.message, patched)
+    await query.answer()
+
+
+@dp.callback_query(CallbackAction.filter(F.action == ACTION_APPLY_SELECTION))
+@admin_only
+async def handle_apply_selection_callback(query: types.CallbackQuery, callback_data: CallbackAction, **kwargs):
+    """Обработчик кнопки "Отметить выбранные"."""
+    keyboard = last_page_keyboard(query.message) if query.message else None
+    ids = [item.item_id for item in keyboard_items(keyboard, ACTION_SELECT) if item.current_status] if keyboard else []
+    if not ids:
+        await query.answer("Ничего не выбрано.")
+        return
+    await apply_bulk_mark(query, callback_data, ids)
+
+# --- Обслуживание БД ---
+async def sqlite_checkpoint_loop():
+    """Периодически переносит WAL в файл БД, чтобы он не рос при постоянных читателях."""
+    while True:
+        await asyncio.sleep(SQLITE_CHECKPOINT_INTERVAL)
+        try:
+            async with engine.connect() as connection:
+                result = await connection.exec_driver_sql(checkpoint_statement())
+                busy, log_frames, checkpointed = result.one()
+            logger.info(f"WAL checkpoint: {checkpointed}/{log_frames} pages" + (" (busy)" if busy else ""))
+        except SQLAlchemyError as e:
+            logger.error(f"WAL checkpoint failed: {e}")
+
+async def archive_loop():
+    """Периодически переносит старые обработанные заявки в архив (таблица callbacks остается маленькой)."""
+    while True:
+        await asyncio.sleep(callback_archive.ARCHIVE_INTERVAL)
+        try:
+            moved = await callback_archive.archive_callbacks_async(engine)
+            if moved:
+                logger.info(f"Archived {moved} processed callbacks")
+        except SQLAlchemyError as e:
+            logger.error(f"Archiving callbacks failed: {e}")
 
 # --- Запуск бота ---
+async def run_polling():
+    """Long polling: бот сам забирает обновления (запасной режим, не требует внешнего адреса)."""
+    await bot.delete_webhook() # Пока установлен вебхук, getUpdates не работает
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def run_webhook():
+    """Вебхук: Telegram сам присылает обновления на aiohttp-сервер.
+
+    Возвращает False, если вебхук установить не удалось (тогда main переходит на polling).
+    Обновление обрабатывается в фоне, а Telegram сразу получает ответ 200.
+    """
+    webhook_app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(webhook_app, path=WEBHOOK_PATH)
+    setup_application(webhook_app, dp, bot=bot)
+    runner = web.AppRunner(webhook_app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(), # Только типы, для которых есть обработчики
+        )
+    except (OSError, TelegramAPIError) as e:
+        logger.error(f"Webhook setup failed: {e}")
+        await runner.cleanup()
+        return False
+    logger.info(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait() # Работаем до остановки процесса
+    finally:
+        await runner.cleanup()
+    return True
+
+
 async def main():
-    logger.info("Starting bot...")
+    logger.info(f"Starting bot ({BOT_MODE})...")
     # Можно добавить проверку/создание БД здесь, если бот запускается отдельно
     # init_db_bot() # По аналогии с init_db в app.py
-    await dp.start_polling(bot)
+    if BOT_METRICS_PORT:
+        metrics.instrument_sqlalchemy()
+        start_http_server(BOT_METRICS_PORT, addr='127.0.0.1') # Отдельный поток, циклу событий не мешает
+        logger.info(f"Metrics on http://127.0.0.1:{BOT_METRICS_PORT}/metrics")
+    checkpoint_task = None
+    if engine.dialect.name == 'sqlite' and SQLITE_CHECKPOINT_INTERVAL > 0:
+        checkpoint_task = asyncio.create_task(sqlite_checkpoint_loop())
+    archive_task = None
+    if callback_archive.ARCHIVE_INTERVAL > 0:
+        archive_task = asyncio.create_task(archive_loop())
+    try:
+        if BOT_MODE == 'webhook' and not WEBHOOK_BASE_URL:
+            logger.warning("BOT_MODE=webhook, но WEBHOOK_BASE_URL не задан - используется polling")
+        if BOT_MODE != 'webhook' or not WEBHOOK_BASE_URL or not await run_webhook():
+            await run_polling()
+    finally:
+        for task in (checkpoint_task, archive_task):
+            if task:
+                task.cancel()
+        await bot.session.close()
+        await engine.dispose() # Закрываем соединения пула
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, false, func, insert, literal, null, select, true
+
+import callback_stats
+import counters
+from models import db, Callback, CallbackArchive
+
+# --- Настройки архивации (общие для бота и flask archive-callbacks) ---
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180)) # Обработанные заявки старше - в архив
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500)) # Строк в одной транзакции
+ARCHIVE_BATCH_PAUSE = 0.05 # сек. между пачками: веб-приложение успевает записать свои заявки
+ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', 3600)) # сек., как часто бот запускает архивацию; 0 - не запускать
+VACUUM_PAGES = 1000 # Страниц, возвращаемых ОС за один шаг PRAGMA incremental_vacuum
+# Колонки, которые переносятся между callbacks и callbacks_archive (ID сохраняется)
+COLUMNS = ('id', 'name', 'email', 'phone', 'phone_digits', 'lesson_type', 'timestamp', 'processed', 'processed_at',
+           'submission_id')
+
+
+def archive_batch(connection, cutoff, after_id=0, batch_size=ARCHIVE_BATCH_SIZE):
+    """Переносит в архив одну пачку обработанных заявок старше cutoff (ID больше after_id).
+
+    Выполняется в транзакции вызывающего (sync Connection; бот вызывает через run_sync).
+    Возвращает (перенесено строк, ID последней просмотренной заявки) - с него начинается следующая пачка.
+    """
+    # Самую новую заявку не трогаем никогда: SQLite выдает новые ID как max(id) + 1, и без нее
+    # ID могли бы повториться и совпасть с архивными
+    newest_id = select(func.max(Callback.id)).scalar_subquery()
+    ids = connection.scalars(
+        select(Callback.id)
+        .where(Callback.id > after_id, Callback.processed == true(), Callback.timestamp < cutoff, Callback.id < newest_id)
+        .order_by(Callback.id).limit(batch_size).with_for_update()
+    ).all()
+    if not ids:
+        return 0, after_id
+
+    # Условие на статус повторяется: заявку могли вернуть в работу, пока шел SELECT
+    movable = (Callback.id.in_(ids), Callback.processed == true())
+    connection.execute(insert(CallbackArchive).from_select(
+        [*COLUMNS, 'archived_at'],
+        select(*(Callback.__table__.c[name] for name in COLUMNS),
+               literal(datetime.utcnow(), CallbackArchive.archived_at.type)).where(*movable),
+    ))
+    moved = connection.execute(delete(Callback).where(*movable).returning(Callback.lesson_type)).scalars().all()
+
+    deltas = Counter({counters.TOTAL: -len(moved), counters.PROCESSED: -len(moved)})
+    for lesson_type in moved:
+        deltas[counters.LESSON_TYPE_PREFIX + lesson_type] -= 1
+    for statement in counters.counter_upserts(connection.dialect.name, deltas):
+        connection.execute(statement)
+    return len(moved), ids[-1]
+
+
+def restore_callback(connection, callback_id):
+    """Возвращает заявку из архива в callbacks как необработанную. False - в архиве ее нет.
+
+    Нужна, когда админ снимает отметку "обработана" с архивной заявки, найденной через /find.
+    """
+    lesson_type = connection.scalar(select(CallbackArchive.lesson_type).where(CallbackArchive.id == callback_id))
+    if lesson_type is None:
+        return False
+    archived = CallbackArchive.__table__.c
+    returned = {'processed': false(), 'processed_at': null()} # Заявка снова в работе
+    connection.execute(callback_stats.status_change_statement(
+        connection.dialect.name, CallbackArchive, [archived.id == callback_id], False, datetime.utcnow()))
+    connection.execute(insert(Callback).from_select(
+        COLUMNS,
+        select(*(returned.get(name, archived[name]) for name in COLUMNS))
+        .where(archived.id == callback_id),
+    ))
+    connection.execute(delete(CallbackArchive).where(CallbackArchive.id == callback_id))
+    for statement in counters.counter_upserts(connection.dialect.name, counters.new_callback_deltas(lesson_type)):
+        connection.execute(statement)
+    return True
+
+
+# --- Возврат места на диске (SQLite) ---
+def incremental_vacuum_step(connection, pages=VACUUM_PAGES):
+    """Возвращает ОС до pages свободных страниц. Возвращает число оставшихся свободных страниц.
+
+    Работает, только если файл БД в режиме auto_vacuum=INCREMENTAL (flask archive-callbacks --convert-vacuum).
+    """
+    if connection.dialect.name != 'sqlite':
+        return 0
+    if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+        return 0
+    free_pages = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+    # Драйвер sqlite3 выполняет только первый шаг прагмы, а каждый шаг освобождает одну страницу -
+    # поэтому по одной странице за вызов (десятки микросекунд, блокировка записи не копится)
+    for _ in range(min(free_pages, pages)):
+        connection.exec_driver_sql('PRAGMA incremental_vacuum(1)')
+    return max(free_pages - pages, 0)
+
+
+# --- Запуск ---
+def archive_callbacks(engine, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Переносит все подходящие заявки короткими транзакциями и освобождает место. Возвращает число строк."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total, after_id = 0, 0
+    while True:
+        with engine.begin() as connection:
+            moved, last_id = archive_batch(connection, cutoff, after_id, batch_size)
+        if last_id == after_id:
+            break
+        total, after_id = total + moved, last_id
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+    while True:
+        with engine.begin() as connection:
+            if not incremental_vacuum_step(connection):
+                break
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+    return total
+
+
+async def archive_callbacks_async(engine, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """То же для асинхронного движка бота (пачки выполняются через run_sync, цикл событий не блокируется)."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total, after_id = 0, 0
+    while True:
+        async with engine.begin() as connection:
+            moved, last_id = await connection.run_sync(archive_batch, cutoff, after_id, batch_size)
+        if last_id == after_id:
+            break
+        total, after_id = total + moved, last_id
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+    while True:
+        async with engine.begin() as connection:
+            if not await connection.run_sync(incremental_vacuum_step):
+                break
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+    return total
+
+
+def init_app(app):
+    """Регистрирует команду flask archive-callbacks (для cron, если архивацию не запускает бот)."""
+
+    @app.cli.command('archive-callbacks')
+    @click.option('--days', default=ARCHIVE_AFTER_DAYS, show_default=True, help='Архивировать обработанные заявки старше')
+    @click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True)
+    @click.option('--convert-vacuum', is_flag=True,
+                  help='Один раз перевести файл SQLite в auto_vacuum=INCREMENTAL (полный VACUUM, БД блокируется)')
+    def archive_callbacks_command(days, batch_size, convert_vacuum):
+        """Переносит старые обработанные заявки в callbacks_archive и возвращает освободившееся место."""
+        if convert_vacuum:
+            if db.engine.dialect.name != 'sqlite':
+                raise click.ClickException("--convert-vacuum нужен только для SQLite")
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+                connection.exec_driver_sql('VACUUM') # Режим auto_vacuum меняется только при пересборке файла
+            click.echo("Файл БД переведен в режим auto_vacuum=INCREMENTAL")
+        moved = archive_callbacks(db.engine, days, batch_size)
+        click.echo(f"Перенесено в архив заявок: {moved}")
@@ -0,0 +1,235 @@
+import codecs
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime, timedelta
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select
+
+from models import Callback, CallbackArchive
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+CHUNK_ROWS = 1000 # Строк за одну выборку с курсора и за одну порцию ответа
+# Колонка выгрузки: (заголовок, атрибут строки)
+EXPORT_COLUMNS = (
+    ('ID', 'id'),
+    ('Дата', 'timestamp'),
+    ('Имя', 'name'),
+    ('Телефон', 'phone'),
+    ('Email', 'email'),
+    ('Тип занятия', 'lesson_type'),
+    ('Обработана', 'processed'),
+)
+
+
+# --- Фильтры ---
+def parse_filters(date_from=None, date_to=None, processed=None):
+    """Проверяет фильтры выгрузки из строк: даты YYYY-MM-DD (включительно), processed '0'/'1'.
+
+    Неверное значение - ValueError с понятным текстом.
+    """
+    filters = {}
+    for key, value in (('date_from', date_from), ('date_to', date_to)):
+        if value:
+            try:
+                filters[key] = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Дата должна быть в формате ГГГГ-ММ-ДД: {value}")
+    if processed not in (None, ''):
+        if processed not in ('0', '1'):
+            raise ValueError("processed должен быть 0 или 1")
+        filters['processed'] = processed == '1'
+    return filters
+
+
+def export_query(date_from=None, date_to=None, processed=None, model=Callback):
+    """SELECT заявок model для выгрузки (по возрастанию ID). Выполнять с yield_per - строки идут с курсора."""
+    columns = [getattr(model, attribute) for _, attribute in EXPORT_COLUMNS]
+    query = select(*columns).order_by(model.id)
+    if date_from:
+        query = query.where(model.timestamp >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.where(model.timestamp < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if processed is not None:
+        query = query.where(model.processed.is_(processed))
+    return query
+
+
+def export_queries(date_from=None, date_to=None, processed=None):
+    """Запросы выгрузки по порядку: сначала архив (старые заявки), затем рабочая таблица.
+
+    Два последовательных запроса вместо UNION ... ORDER BY: общая сортировка потребовала бы
+    прочитать все строки до отдачи первой.
+    """
+    if processed is False:
+        return [export_query(date_from, date_to, processed)] # В архиве только обработанные
+    return [export_query(date_from, date_to, processed, model) for model in (CallbackArchive, Callback)]
+
+
+def export_filename(fmt, filters):
+    parts = ['callbacks']
+    if filters.get('date_from'):
+        parts.append(f"from-{filters['date_from']}")
+    if filters.get('date_to'):
+        parts.append(f"to-{filters['date_to']}")
+    if 'processed' in filters:
+        parts.append('processed' if filters['processed'] else 'new')
+    return f"{'_'.join(parts)}.{fmt}"
+
+
+# Начало текста, с которого Excel читает ячейку как формулу (или DDE) - такие ячейки CSV экранируем "'"
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Телефон проверен формой (+ и цифры) и начинается с "+" - его оставляем как есть
+CSV_TRUSTED_COLUMNS = {'phone'}
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, bool):
+        return int(value)
+    return '' if value is None else value
+
+
+# --- Запись файлов ---
+class CsvWriter:
+    """CSV в UTF-8 с BOM (чтобы Excel сразу узнал кодировку)."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer)
+        self.stream.write(codecs.BOM_UTF8)
+        self.write_rows([[title for title, _ in EXPORT_COLUMNS]])
+
+    def write_rows(self, rows):
+        self._csv.writerows([self._csv_cell(value, attribute) for value, (_, attribute) in zip(row, EXPORT_COLUMNS)]
+                            for row in rows)
+        self.stream.write(self._buffer.getvalue().encode('utf-8'))
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    @staticmethod
+    def _csv_cell(value, attribute):
+        value = _cell(value)
+        # Имя, email и тип занятия приходят из формы: "=HYPERLINK(...)" выполнился бы при открытии в Excel
+        if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and attribute not in CSV_TRUSTED_COLUMNS:
+            return "'" + value
+        return value
+
+    def close(self):
+        pass
+
+
+class XlsxWriter:
+    """Минимальный XLSX (один лист, строки inline), который пишется потоком.
+
+    ZIP пишется в поток без перемоток (zipfile сам использует data descriptor), поэтому
+    файл можно отдавать по HTTP по мере выборки строк и память не растет с размером выгрузки.
+    """
+
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    )
+    ROOT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    )
+    WORKBOOK = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Заявки" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+    WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    )
+    # Символы, недопустимые в XML 1.0 (могли попасть в имя из формы)
+    INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+    def __init__(self, stream):
+        self._zip = zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED)
+        for name, content in (('[Content_Types].xml', self.CONTENT_TYPES), ('_rels/.rels', self.ROOT_RELS),
+                              ('xl/workbook.xml', self.WORKBOOK), ('xl/_rels/workbook.xml.rels', self.WORKBOOK_RELS)):
+            self._zip.writestr(name, content)
+        self._sheet = self._zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        self.write_rows([[title for title, _ in EXPORT_COLUMNS]])
+
+    def _cell_xml(self, value):
+        value = _cell(value)
+        if isinstance(value, int):
+            return f'<c t="n"><v>{value}</v></c>'
+        text = escape(self.INVALID_XML_CHARS.sub('', str(value)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+    def write_rows(self, rows):
+        xml = ''.join('<row>' + ''.join(self._cell_xml(value) for value in row) + '</row>' for row in rows)
+        self._sheet.write(xml.encode('utf-8'))
+
+    def close(self):
+        self._sheet.write(b'</sheetData></worksheet>')
+        self._sheet.close()
+        self._zip.close()
+
+
+WRITERS = {'csv': CsvWriter, 'xlsx': XlsxWriter}
+
+
+class _ChunkBuffer:
+    """Поток, из которого забирается все записанное с прошлого раза (для отдачи частями)."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_export(fmt, partitions):
+    """Генератор байтов файла выгрузки. partitions - пачки строк (Result.partitions()).
+
+    Заголовок отдается до выполнения запроса, дальше - по порции на каждую пачку строк.
+    """
+    buffer = _ChunkBuffer()
+    writer = WRITERS[fmt](buffer)
+    yield buffer.drain()
+    for rows in partitions:
+        writer.write_rows(rows)
+        chunk = buffer.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield buffer.drain()
@@ -0,0 +1,59 @@
+import re
+
+from sqlalchemy import and_, column, or_, text, Integer
+
+from models import Callback, CallbackArchive
+
+# FTS5 (trigram) по name, email и phone_digits для каждой таблицы, см. миграции 4c8d1e7b3a56 и b3e9d5a7c148
+FTS_TABLES = {
+    Callback: 'callbacks_fts',
+    CallbackArchive: 'callbacks_archive_fts',
+}
+MIN_TERM_LENGTH = 3 # Триграммный индекс ищет подстроки не короче трех символов
+PHONE_PUNCTUATION = re.compile(r'[\s+().-]')
+
+
+def normalize_phone(phone):
+    """'+7 (916) 123-45-67' -> '79161234567' (то, что хранится в callbacks.phone_digits)."""
+    return re.sub(r'\D', '', phone or '')
+
+
+def parse_query(query):
+    """Разбирает строку поиска: ('phone', цифры) для номера или ('text', [слова]).
+
+    Возвращает None, если искать нечего (все слова короче MIN_TERM_LENGTH).
+    """
+    query = (query or '').strip()
+    digits = PHONE_PUNCTUATION.sub('', query)
+    if digits.isdigit():
+        return ('phone', digits) if len(digits) >= MIN_TERM_LENGTH else None
+    terms = [term for term in query.split() if len(term) >= MIN_TERM_LENGTH]
+    return ('text', terms) if terms else None
+
+
+def _fts_match(parsed):
+    """Строка для MATCH: каждое слово - фраза в кавычках (операторы FTS5 из ввода не работают)."""
+    kind, value = parsed
+    if kind == 'phone':
+        return f'phone_digits : "{value}"'
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in value)
+
+
+def search_filter(dialect_name, parsed, model=Callback):
+    """Условие WHERE для заявок model (Callback или CallbackArchive), найденных по запросу (см. parse_query).
+
+    SQLite: id из FTS5-индекса (триггеры держат его в актуальном состоянии).
+    Postgres: ILIKE по GIN-индексам pg_trgm - тоже ищет подстроки по триграммам.
+    """
+    kind, value = parsed
+    if dialect_name == 'sqlite':
+        fts_table = FTS_TABLES[model]
+        matches = text(f'SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :match') \
+            .bindparams(match=_fts_match(parsed)).columns(column('rowid', Integer))
+        return model.id.in_(matches)
+    if kind == 'phone':
+        return model.phone_digits.contains(value, autoescape=True)
+    return and_(*(
+        or_(model.name.icontains(term, autoescape=True), model.email.icontains(term, autoescape=True))
+        for term in value
+    ))
@@ -0,0 +1,279 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from html import escape
+
+import click
+from sqlalchemy import select
+
+try:
+    import fcntl # Блокировки файлов журнала (только Unix - там и работает gunicorn)
+except ImportError:
+    fcntl = None
+
+import callback_stats
+import counters
+import notifications
+from callback_search import normalize_phone
+from models import db, Callback
+
+ACTIVE_SUFFIX = '.spool' # Файл, в который процесс сейчас дописывает заявки
+SEALED_SUFFIX = '.ready' # Закрытый файл, ожидающий записи в БД
+
+
+# --- Сохранение заявок в БД (общая часть для прямой и пакетной записи) ---
+def new_entry(name, email, phone, lesson_type, submission_id=None):
+    """Проверенная заявка в виде словаря (так она хранится в журнале)."""
+    return {
+        'submission_id': submission_id or str(uuid.uuid4()),
+        'name': name,
+        'email': email or None,
+        'phone': phone,
+        'lesson_type': lesson_type,
+        'timestamp': datetime.utcnow().isoformat(),
+    }
+
+
+def lead_notification_text(callback):
+    # Сообщение уходит с parse_mode=HTML: поля из формы экранируем, иначе Telegram ответит 400,
+    # а outbox сочтет это неисправимой ошибкой и уведомление о заявке пропадет
+    return (
+        f"🔔 <b>Новая заявка на обратный звонок!</b>\n\n"
+        f"<b>ID:</b> {callback.id}\n"
+        f"<b>Имя:</b> {escape(callback.name)}\n"
+        f"<b>Телефон:</b> {escape(callback.phone)}\n"
+        f"<b>Email:</b> {escape(callback.email) if callback.email else 'Не указан'}\n"
+        f"<b>Тип занятия:</b> {escape(callback.lesson_type)}\n\n"
+        f"Для просмотра списка заявок используйте команду /callbacks"
+    )
+
+
+def store_callbacks(entries, chat_id):
+    """Добавляет заявки в текущую сессию вместе со счетчиками и уведомлениями. Коммит - за вызывающим.
+
+    Заявки с уже сохраненным submission_id пропускаются, поэтому журнал можно
+    безопасно записать повторно. Возвращает список созданных Callback.
+    """
+    seen = set(db.session.scalars(
+        select(Callback.submission_id).where(Callback.submission_id.in_([e['submission_id'] for e in entries]))
+    ))
+    created = []
+    deltas = Counter()
+    stat_deltas = Counter() # (день, тип занятия) -> новых заявок, для сводки /stats
+    for entry in entries:
+        if entry['submission_id'] in seen:
+            continue
+        seen.add(entry['submission_id'])
+        callback = Callback(
+            name=entry['name'],
+            email=entry['email'],
+            phone=entry['phone'],
+            phone_digits=normalize_phone(entry['phone']),
+            lesson_type=entry['lesson_type'],
+            timestamp=datetime.fromisoformat(entry['timestamp']),
+            submission_id=entry['submission_id'],
+        )
+        db.session.add(callback)
+        created.append(callback)
+        deltas.update(counters.new_callback_deltas(entry['lesson_type']))
+        stat_deltas[callback.timestamp.date(), callback.lesson_type] += 1
+    if not created:
+        return created
+
+    db.session.flush() # Получаем ID заявок до коммита, чтобы вставить их в уведомления
+    counters.apply_counter_deltas(db.session, deltas) # Один UPSERT на счетчик для всей пачки
+    callback_stats.apply_submitted_deltas(db.session, stat_deltas) # И один на день и тип занятия
+    for callback in created:
+        notifications.enqueue_notification(
+            chat_id, lead_notification_text(callback), kind=notifications.KIND_LEAD,
+            payload={'id': callback.id, 'name': callback.name, 'phone': callback.phone,
+                     'email': callback.email or '', 'lesson_type': callback.lesson_type}
+        )
+    return created
+
+
+# --- Журнал заявок (write-behind) ---
+class CallbackSpool:
+    """Журнал заявок на диске с пакетной записью в БД (group commit).
+
+    Запрос дописывает заявку в файл журнала своего процесса и делает fsync - после этого
+    заявка не потеряется даже при падении, а ответ уходит без ожидания блокировки БД.
+    Фоновый поток раз в CALLBACK_FLUSH_INTERVAL (или по набору CALLBACK_FLUSH_BATCH заявок)
+    закрывает файл и записывает его содержимое в БД одной транзакцией.
+
+    Пока процесс пишет или записывает файл, он держит на нем flock. Файлы упавших процессов
+    никем не заблокированы, и их подбирает любой живой воркер или команда flask flush-callbacks.
+    """
+
+    def __init__(self, app, chat_id):
+        self.app = app
+        self.chat_id = chat_id
+        self.directory = os.path.join(app.root_path, app.config['CALLBACK_SPOOL_DIR'])
+        self.batch_size = app.config['CALLBACK_FLUSH_BATCH']
+        self.interval = app.config['CALLBACK_FLUSH_INTERVAL']
+        self._lock = threading.Lock()
+        self._fd = None
+        self._path = None
+        self._pending = 0
+        self._pid = None
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    def ensure_started(self):
+        """Запускает поток записи в текущем процессе (после fork - заново)."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            if self._pid != os.getpid() and self._fd is not None:
+                os.close(self._fd) # Файл родителя остается ему, дочерний процесс откроет свой
+                self._fd = None
+                self._pending = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='callback-spool', daemon=True)
+            self._thread.start()
+
+    def append(self, entry):
+        """Надежно записывает заявку в журнал (write + fsync)."""
+        self.ensure_started()
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._fd is None:
+                self._open_active()
+            os.write(self._fd, line)
+            if hasattr(os, 'fdatasync'):
+                os.fdatasync(self._fd)
+            else:
+                os.fsync(self._fd)
+            self._pending += 1
+            full = self._pending >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _open_active(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Имя уникально даже при повторном использовании PID после перезапуска контейнера
+        self._path = os.path.join(self.directory, f"callbacks-{os.getpid()}-{time.time_ns()}{ACTIVE_SUFFIX}")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        # Новая запись в каталоге тоже должна пережить падение
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _seal(self):
+        """Закрывает текущий файл журнала: дальше он ждет записи в БД, новые заявки идут в новый."""
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                return
+            sealed_path = self._path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX
+            os.rename(self._path, sealed_path)
+            os.close(self._fd) # Снимает flock - файл может забрать любой процесс
+            self._fd = None
+            self._pending = 0
+
+    def flush(self):
+        """Записывает в БД все доступные файлы журнала. Нужен контекст приложения."""
+        self._seal()
+        if not os.path.isdir(self.directory):
+            return 0
+        stored = 0
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.endswith((ACTIVE_SUFFIX, SEALED_SUFFIX)):
+                stored += self._flush_file(os.path.join(self.directory, filename))
+        return stored
+
+    def _flush_file(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return 0 # Уже записан другим процессом
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0 # Файл пишет (или записывает в БД) другой живой процесс
+            try:
+                if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                    return 0
+            except FileNotFoundError:
+                return 0 # Пока ждали, файл записали и удалили
+
+            with os.fdopen(os.dup(fd), 'r', encoding='utf-8') as f:
+                entries = []
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # Недописанная строка при падении: ответ клиенту по ней не отправлялся
+                        self.app.logger.warning(f"Пропущена поврежденная строка журнала заявок в {path}")
+
+            created_ids = []
+            try:
+                for start in range(0, len(entries), self.batch_size):
+                    created = store_callbacks(entries[start:start + self.batch_size], self.chat_id)
+                    created_ids += [callback.id for callback in created]
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise # Файл остается на месте - запишем при следующей попытке
+            os.remove(path)
+        finally:
+            os.close(fd)
+
+        if created_ids:
+            notifications.get_dispatcher().wake()
+            self.app.logger.info(
+                f"Из журнала записано заявок: {len(created_ids)} (ID: {', '.join(map(str, created_ids))})")
+        return len(created_ids)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception as e:
+                self.app.logger.error(f"Ошибка записи журнала заявок в БД: {e}", exc_info=True)
+
+    def close(self):
+        """При завершении процесса пытается записать свой журнал (если не выйдет - его подберут другие)."""
+        if self._pid != os.getpid():
+            return
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception as e:
+            self.app.logger.error(f"Журнал заявок не записан при остановке: {e}")
+
+
+def init_app(app, chat_id):
+    """Подключает журнал заявок, если включен CALLBACK_WRITE_BEHIND. Возвращает его или None."""
+    spool = None
+    if app.config['CALLBACK_WRITE_BEHIND']:
+        if fcntl is None:
+            app.logger.warning("CALLBACK_WRITE_BEHIND требует fcntl (Unix) - заявки пишутся в БД напрямую")
+        else:
+            spool = CallbackSpool(app, chat_id)
+            app.before_request(spool.ensure_started) # Подбирает и журналы упавших процессов
+            atexit.register(spool.close)
+    app.extensions['callback_spool'] = spool
+
+    @app.cli.command('flush-callbacks')
+    def flush_callbacks_command():
+        """Записывает в БД заявки из журналов (например, оставшиеся после падения всех воркеров)."""
+        if fcntl is None:
+            raise click.ClickException("Журнал заявок поддерживается только в Unix")
+        stored = CallbackSpool(app, chat_id).flush()
+        click.echo(f"Записано заявок: {stored}")
+
+    return spool
@@ -0,0 +1,176 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+from html import escape
+
+import click
+from sqlalchemy import BigInteger, Date, DateTime, Integer, cast, delete, extract, func, literal, select, text, union_all
+
+from counters import INSERTS
+from models import db, Callback, CallbackArchive, CallbackDailyStat
+
+# Колонки сводки, которые меняются прибавлением (ключ - день и тип занятия)
+VALUE_COLUMNS = ('submitted', 'processed', 'processed_timed', 'processing_seconds')
+DEFAULT_DAYS = 7 # /stats - последние 7 дней
+DEFAULT_WEEKS = 8 # /stats week - последние 8 недель
+MAX_DAYS = 92
+MAX_WEEKS = 53
+
+
+# --- Выражения, зависящие от СУБД ---
+def day_expression(dialect_name, column):
+    """Дата (день UTC) из колонки DateTime."""
+    if dialect_name == 'sqlite':
+        return func.date(column, type_=Date) # Строка 'ГГГГ-ММ-ДД' - в том же виде SQLite хранит Date
+    return cast(column, Date)
+
+
+def seconds_between(dialect_name, start, end):
+    """Целое число секунд от start до end."""
+    if dialect_name == 'sqlite':
+        return cast(func.round((func.julianday(end) - func.julianday(start)) * 86400), Integer)
+    return cast(extract('epoch', end - start), BigInteger)
+
+
+# --- Изменения сводки (в транзакции вызывающего, как и счетчики в counters.py) ---
+def stat_upsert(statement):
+    """Дополняет INSERT в сводку (одна строка или INSERT ... SELECT) до UPSERT "колонка = колонка + значение"."""
+    return statement.on_conflict_do_update(
+        index_elements=[CallbackDailyStat.day, CallbackDailyStat.lesson_type],
+        set_={name: CallbackDailyStat.__table__.c[name] + statement.excluded[name] for name in VALUE_COLUMNS},
+    )
+
+
+def apply_submitted_deltas(session, deltas):
+    """Прибавляет новые заявки к сводке в синхронной сессии. deltas - Counter {(день, тип занятия): число}."""
+    insert = INSERTS[session.get_bind().dialect.name]
+    for (day, lesson_type), count in deltas.items():
+        session.execute(stat_upsert(insert(CallbackDailyStat).values(
+            day=day, lesson_type=lesson_type, submitted=count, processed=0, processed_timed=0, processing_seconds=0)))
+
+
+def status_change_statement(dialect_name, model, condition, processed, now):
+    """Один INSERT ... SELECT ... GROUP BY, переносящий в сводку смену статуса заявок model по condition.
+
+    Выполняется ДО самого UPDATE в той же транзакции: условие еще выбирает строки со старым статусом.
+    processed=True - заявки отмечаются обработанными в момент now (время до обработки прибавляется);
+    False - возвращаются в работу (вычитается то, что было прибавлено по их processed_at).
+    """
+    day = day_expression(dialect_name, model.timestamp)
+    finished = literal(now, DateTime()) if processed else model.processed_at
+    sign = 1 if processed else -1
+    query = (
+        select(day, model.lesson_type, literal(0), func.count() * sign, func.count(finished) * sign,
+               func.coalesce(func.sum(seconds_between(dialect_name, model.timestamp, finished)), 0) * sign)
+        .where(*condition)
+        .group_by(day, model.lesson_type)
+    )
+    return stat_upsert(INSERTS[dialect_name](CallbackDailyStat).from_select(['day', 'lesson_type', *VALUE_COLUMNS], query))
+
+
+def rebuild_statements(dialect_name):
+    """Запросы, которые пересчитывают всю сводку по callbacks и callbacks_archive с нуля."""
+    statements = []
+    if dialect_name == 'postgresql':
+        # Как и в counters.reconcile_statements: новые заявки не потеряются между DELETE и INSERT
+        statements.append(text('LOCK TABLE callback_daily_stats IN EXCLUSIVE MODE'))
+    statements.append(delete(CallbackDailyStat))
+    columns = ('timestamp', 'lesson_type', 'processed', 'processed_at')
+    rows = union_all(*(
+        select(*(model.__table__.c[name] for name in columns)) for model in (Callback, CallbackArchive)
+    )).subquery()
+    day = day_expression(dialect_name, rows.c.timestamp)
+    finished = rows.c.processed_at
+    statements.append(CallbackDailyStat.__table__.insert().from_select(
+        ['day', 'lesson_type', *VALUE_COLUMNS],
+        select(day, rows.c.lesson_type, func.count(),
+               func.count().filter(rows.c.processed.is_(True)), func.count(finished),
+               func.coalesce(func.sum(seconds_between(dialect_name, rows.c.timestamp, finished)), 0))
+        .group_by(day, rows.c.lesson_type),
+    ))
+    return statements
+
+
+def rebuild_stats(session):
+    """Пересчитывает сводку в одной транзакции. Возвращает число строк в ней."""
+    for statement in rebuild_statements(session.get_bind().dialect.name):
+        session.execute(statement)
+    session.commit()
+    return session.scalar(select(func.count()).select_from(CallbackDailyStat))
+
+
+# --- Отчет /stats ---
+def period_start(today, weekly, periods):
+    """Первый день отчета: periods дней до today включительно или periods недель (с понедельника)."""
+    if weekly:
+        return today - timedelta(days=today.weekday() + 7 * (periods - 1))
+    return today - timedelta(days=periods - 1)
+
+
+def parse_stats_args(args):
+    """'/stats', '/stats 30', '/stats week', '/stats week 12' -> (weekly, periods). ValueError - неверно."""
+    words = (args or '').lower().split()
+    weekly = bool(words) and words[0] in ('week', 'weeks', 'w', 'нед', 'неделя', 'недели')
+    if weekly:
+        words = words[1:]
+    if len(words) > 1 or (words and not words[0].isdigit()):
+        raise ValueError(args)
+    limit = MAX_WEEKS if weekly else MAX_DAYS
+    periods = int(words[0]) if words else (DEFAULT_WEEKS if weekly else DEFAULT_DAYS)
+    if not 1 <= periods <= limit:
+        raise ValueError(args)
+    return weekly, periods
+
+
+def format_duration(seconds):
+    """3 ч 20 мин, 2 дн 4 ч, 45 мин."""
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+    days, hours = divmod(hours, 24)
+    return f"{days} дн {hours} ч" if hours else f"{days} дн"
+
+
+def format_stats(rows, weekly, start, today):
+    """Текст ответа /stats из строк сводки (CallbackDailyStat) за период от start до today."""
+    periods = defaultdict(lambda: {'by_type': Counter(), **dict.fromkeys(VALUE_COLUMNS, 0)})
+    for row in rows:
+        key = row.day - timedelta(days=row.day.weekday()) if weekly else row.day
+        for period in (periods[key], periods['total']):
+            period['by_type'][row.lesson_type] += row.submitted
+            for name in VALUE_COLUMNS:
+                period[name] += getattr(row, name)
+
+    def line(label, period):
+        text = f"<b>{label}</b>: {period['submitted']}"
+        by_type = ", ".join(f"{escape(lesson_type)} {count}" for lesson_type, count in sorted(period['by_type'].items()) if count)
+        if by_type:
+            text += f" ({by_type})"
+        if period['processed']:
+            text += f" | ✅ {period['processed']}"
+        if period['processed_timed']:
+            text += f", ⏱ {format_duration(period['processing_seconds'] / period['processed_timed'])}"
+        return text
+
+    step = timedelta(days=7 if weekly else 1)
+    title = "Заявки по неделям" if weekly else "Заявки по дням"
+    lines = [f"<b>{title}</b> ({start:%d.%m.%Y} - {today:%d.%m.%Y}, UTC)", ""]
+    key = today - timedelta(days=today.weekday()) if weekly else today
+    while key >= start:
+        label = f"с {key:%d.%m}" if weekly else f"{key:%d.%m}"
+        lines.append(line(label, periods[key]))
+        key -= step
+    lines += ["", line("Всего", periods['total']),
+              "✅ - обработано из поступивших, ⏱ - среднее время до обработки"]
+    return "\n".join(lines)
+
+
+def init_app(app):
+    """Регистрирует команду flask rebuild-stats."""
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats_command():
+        """Пересчитывает дневную сводку заявок (/stats) по callbacks и архиву."""
+        click.echo(f"Строк в сводке: {rebuild_stats(db.session)}")
@@ -9,12 +9,107 @@ class Config:
     DATABASE_PATH = os.environ.get('DATABASE_PATH') or 'database.db'
     BOT_TOKEN = os.environ.get('BOT_TOKEN')
     ADMIN_ID = os.environ.get('ADMIN_ID')
+    TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL') or 'https://api.telegram.org'
+    # Кэш отрендеренных страниц (index, pricing, about) с ETag и сжатием; в режиме DEBUG выключен
+    PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', '1') == '1'
+    # Как часто воркер сверяет версию тарифов в БД (сек.); сами тарифы перечитываются только при ее смене
+    PRICING_VERSION_CHECK_INTERVAL = float(os.environ.get('PRICING_VERSION_CHECK_INTERVAL', 1))
+
+    # --- Шаблоны Jinja ---
+    # Кэш байткода скомпилированных шаблонов (относительно папки приложения): новый процесс их не компилирует
+    JINJA_BYTECODE_CACHE_DIR = os.path.join('build', 'jinja')
+    # Компилировать все шаблоны при создании приложения. С gunicorn --preload это делает мастер один раз,
+    # и воркеры получают готовые шаблоны в общей памяти (copy-on-write)
+    TEMPLATES_PRECOMPILE = True
+
+    # --- Отложенная запись заявок (write-behind) ---
+    # Заявка пишется в журнал на диске (fsync) и попадает в БД пачкой из фонового потока.
+    # Полезно для SQLite при всплесках, когда воркеры упираются в блокировку записи.
+    CALLBACK_WRITE_BEHIND = os.environ.get('CALLBACK_WRITE_BEHIND', '0') == '1'
+    CALLBACK_SPOOL_DIR = 'spool' # Относительно папки приложения
+    CALLBACK_FLUSH_INTERVAL = float(os.environ.get('CALLBACK_FLUSH_INTERVAL', 0.5)) # сек.
+    CALLBACK_FLUSH_BATCH = 100 # Заявок в одной транзакции (и досрочная запись при наборе)
+
+    # --- Повторная отправка формы заявки ---
+    # Форма шлет ключ (заголовок SUBMIT_KEY_HEADER), созданный при открытии окна: повтор с тем же ключом
+    # получает сохраненный ответ без записи в БД и уведомления. Ключи - файлы в каталоге, общем для
+    # воркеров (относительно папки приложения; можно указать, например, /dev/shm/english-school-keys)
+    SUBMIT_KEYS_DIR = os.environ.get('SUBMIT_KEYS_DIR') or os.path.join('spool', 'keys')
+    SUBMIT_KEY_HEADER = 'Idempotency-Key'
+    SUBMIT_KEY_TTL = int(os.environ.get('SUBMIT_KEY_TTL', 3600)) # сек., сколько помнить ответ по ключу
+    # Заявка с тем же телефоном и типом занятия в течение окна считается повтором (даже с другим ключом). 0 - отключить
+    SUBMIT_DEDUP_WINDOW = int(os.environ.get('SUBMIT_DEDUP_WINDOW', 600)) # сек.
+
+    # --- Логирование (logs/app.log + консоль, запись в отдельном потоке) ---
+    LOG_DIR = 'logs'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'text' # 'text' или 'json' (одна запись - одна строка JSON)
+    # Файл и строка вызова в каждой записи; поиск стоит времени на каждом вызове логгера
+    LOG_CALLER_INFO = os.environ.get('LOG_CALLER_INFO', '1') == '1'
+    LOG_MAX_BYTES = 1024 * 1024 * 5 # 5 MB до ротации
+    LOG_BACKUP_COUNT = 5
+    LOG_QUEUE_SIZE = 10000 # При переполнении записи отбрасываются, а не тормозят запросы
+    # Доля логируемых запросов к страницам: общая и по маршрутам ("index=0.1,about=0.5")
+    LOG_PAGE_SAMPLE_RATE = float(os.environ.get('LOG_PAGE_SAMPLE_RATE', 1))
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+
+    # --- Доставка уведомлений в Telegram через outbox ---
+    # Запускать ли диспетчер потоком в каждом веб-воркере (иначе: flask dispatch-notifications)
+    NOTIFY_DISPATCHER_THREAD = os.environ.get('NOTIFY_DISPATCHER_THREAD', '1') == '1'
+    NOTIFY_POLL_INTERVAL = float(os.environ.get('NOTIFY_POLL_INTERVAL', 5)) # сек., страховочный опрос очереди
+    NOTIFY_BATCH_SIZE = 20
+    NOTIFY_LEASE_SECONDS = 60 # На сколько строка "арендуется" воркером
+    NOTIFY_BACKOFF_BASE = 2 # сек., первая задержка повтора
+    NOTIFY_BACKOFF_MAX = 600 # сек., потолок задержки повтора
+    NOTIFY_HTTP_TIMEOUT = 10
+    # Группировка заявок при всплеске: если за окно пришло больше THRESHOLD заявок,
+    # остальные уходят одним сообщением-дайджестом в конце окна. 0 - отключить.
+    NOTIFY_DIGEST_WINDOW = int(os.environ.get('NOTIFY_DIGEST_WINDOW', 60)) # сек.
+    NOTIFY_DIGEST_THRESHOLD = int(os.environ.get('NOTIFY_DIGEST_THRESHOLD', 3))
+    NOTIFY_DIGEST_ITEMS = int(os.environ.get('NOTIFY_DIGEST_ITEMS', 5)) # Сколько заявок перечислить в дайджесте
+    NOTIFY_DIGEST_MAX_ROWS = 500 # Максимум заявок в одном дайджесте
+
+    # --- Выгрузка заявок (GET /export/callbacks.csv|xlsx) ---
+    # Доступ по заголовку "Authorization: Bearer <токен>"; без токена выгрузка по HTTP выключена
+    EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN')
+
+    # --- Метрики Prometheus (GET /metrics) ---
+    # Под gunicorn значения всех воркеров собираются через PROMETHEUS_MULTIPROC_DIR (см. gunicorn.conf.py)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # Если задан - нужен заголовок "Authorization: Bearer <токен>"
+
+    # --- Профилирование запросов (свернутые стеки в logs/profiles/*.folded) ---
+    # Маршруты, которые профилируются всегда (с долей PROFILE_SAMPLE_RATE), например "submit_callback,index".
+    # Любой запрос можно профилировать заголовком PROFILE_HEADER с токеном из flask profile-token -
+    # только если задан PROFILE_SECRET (у него нет значения по умолчанию: без него заголовок игнорируется)
+    PROFILE_SECRET = os.environ.get('PROFILE_SECRET')
+    PROFILE_ENDPOINTS = os.environ.get('PROFILE_ENDPOINTS', '')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 1))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.002)) # сек. между снимками стека
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_TOKEN_MAX_AGE = 3600 # сек., сколько действует токен
 
 class DevelopmentConfig(Config):
     """Конфигурация для разработки."""
     DEBUG = True
+    TEMPLATES_AUTO_RELOAD = True # Правки шаблонов видны без перезапуска
+    JINJA_BYTECODE_CACHE_DIR = None
+    TEMPLATES_PRECOMPILE = False
 
 class ProductionConfig(Config):
     """Конфигурация для продакшена."""
     DEBUG = False
-    # Здесь могут быть другие настройки, например, другой путь к БД
\ No newline at end of file
+    # Здесь могут быть другие настройки, например, другой путь к БД
+
+# Выбор конфигурации по переменной окружения APP_CONFIG (см. create_app в app.py)
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
+
+def get_config(name=None):
+    """Класс конфигурации по имени (по умолчанию из APP_CONFIG, иначе production)."""
+    name = name or os.environ.get('APP_CONFIG') or 'production'
+    if name not in CONFIGS:
+        raise ValueError(f"Неизвестная конфигурация APP_CONFIG='{name}' (допустимо: {', '.join(CONFIGS)})")
+    return CONFIGS[name]
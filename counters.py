@@ -0,0 +1,114 @@
+import click
+from sqlalchemy import delete, func, literal, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Callback, CallbackCounter
+
+TOTAL = 'total'
+PROCESSED = 'processed'
+UNPROCESSED = 'unprocessed'
+LESSON_TYPE_PREFIX = 'lesson_type:'
+# Типы занятий из формы заявки (<select name="lesson_type"> в base.html); другие значения не принимаются
+LESSON_TYPES = ('individual_online', 'group_online', 'unsure')
+
+INSERTS = { # Диалект -> insert с поддержкой ON CONFLICT (UPSERT)
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def new_callback_deltas(lesson_type, processed=False):
+    """Изменения счетчиков при добавлении новой заявки."""
+    return {
+        TOTAL: 1,
+        PROCESSED if processed else UNPROCESSED: 1,
+        LESSON_TYPE_PREFIX + lesson_type: 1,
+    }
+
+
+def status_change_deltas(processed, count=1):
+    """Изменения счетчиков, когда count заявок переведены в статус processed."""
+    sign = 1 if processed else -1
+    return {PROCESSED: sign * count, UNPROCESSED: -sign * count}
+
+
+def counter_upserts(dialect_name, deltas):
+    """Возвращает UPSERT-запросы "value = value + delta" для переданных изменений.
+
+    Запросы выполняет вызывающий код в СВОЕЙ транзакции (sync-сессия Flask или async-сессия бота),
+    поэтому счетчики меняются атомарно вместе с заявками.
+    """
+    insert = INSERTS[dialect_name]
+    statements = []
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        statement = insert(CallbackCounter).values(name=name, value=delta)
+        statements.append(statement.on_conflict_do_update(
+            index_elements=[CallbackCounter.name],
+            set_={'value': CallbackCounter.value + statement.excluded.value},
+        ))
+    return statements
+
+
+def apply_counter_deltas(session, deltas):
+    """Применяет изменения счетчиков в синхронной сессии (веб-приложение)."""
+    for statement in counter_upserts(session.get_bind().dialect.name, deltas):
+        session.execute(statement)
+
+
+def counters_from_rows(rows):
+    """Собирает словарь счетчиков из строк (name, value). Отсутствующие счетчики равны 0."""
+    counters = {TOTAL: 0, PROCESSED: 0, UNPROCESSED: 0}
+    counters.update({name: value for name, value in rows})
+    return counters
+
+
+def lesson_type_counts(counters):
+    """Выделяет из словаря счетчиков количество заявок по известным типам занятий (LESSON_TYPES)."""
+    return {
+        lesson_type: counters[LESSON_TYPE_PREFIX + lesson_type]
+        for lesson_type in LESSON_TYPES
+        if counters.get(LESSON_TYPE_PREFIX + lesson_type)
+    }
+
+
+def reconcile_statements(dialect_name):
+    """Запросы, которые пересчитывают все счетчики по таблице callbacks с нуля."""
+    statements = []
+    if dialect_name == 'postgresql':
+        # Блокируем счетчики, чтобы параллельные заявки не потерялись между DELETE и INSERT
+        statements.append(text('LOCK TABLE callback_counters IN EXCLUSIVE MODE'))
+    statements.append(delete(CallbackCounter))
+    aggregates = [
+        select(literal(TOTAL), func.count()).select_from(Callback),
+        select(literal(PROCESSED), func.count()).select_from(Callback).where(Callback.processed.is_(True)),
+        select(literal(UNPROCESSED), func.count()).select_from(Callback).where(Callback.processed.is_(False)),
+        select(literal(LESSON_TYPE_PREFIX) + Callback.lesson_type, func.count())
+        .group_by(Callback.lesson_type),
+    ]
+    for aggregate in aggregates:
+        statements.append(
+            CallbackCounter.__table__.insert().from_select(['name', 'value'], aggregate)
+        )
+    return statements
+
+
+def reconcile_counters(session):
+    """Пересчитывает счетчики в одной транзакции. Возвращает новые значения."""
+    for statement in reconcile_statements(session.get_bind().dialect.name):
+        session.execute(statement)
+    session.commit()
+    return counters_from_rows(session.execute(select(CallbackCounter.name, CallbackCounter.value)).all())
+
+
+def init_app(app):
+    """Регистрирует команду flask reconcile-counters."""
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters_command():
+        """Пересчитывает счетчики заявок, если они разошлись с таблицей callbacks."""
+        counters = reconcile_counters(db.session)
+        for name, value in sorted(counters.items()):
+            click.echo(f"{name}: {value}")
@@ -0,0 +1,296 @@
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import click
+from flask import current_app, request, url_for
+from markupsafe import Markup, escape
+
+import page_cache
+from assets import minify_css
+
+BUILD_DIR = os.path.join('build', 'critical') # Относительно папки приложения, по файлу <endpoint>.css
+CRITICAL_PAGES = ('index', 'pricing', 'about')
+FOLD_ELEMENTS = 3 # Сколько первых блоков <main> считаем "первым экраном" (шапка учитывается всегда)
+SAFELIST_CLASSES = {'light-mode'} # Классы, которые скрипт в <head> ставит до отрисовки
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+FETCH_TIMEOUT = 15
+# Google Fonts отдает разный CSS в зависимости от браузера - просим вариант для современного (woff2)
+FETCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/120.0 Safari/537.36',
+}
+
+
+# --- Разбор HTML: что видно на первом экране ---
+class AboveTheFoldParser(HTMLParser):
+    """Собирает теги, классы и id элементов первого экрана и ссылки на таблицы стилей."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tags = {'html', 'body'}
+        self.classes = set(SAFELIST_CLASSES)
+        self.ids = set()
+        self.stylesheets = []
+        self._depth = 0
+        self._header_depth = None # Глубина открытого <header> (None - мы не внутри шапки)
+        self._main_depth = None # Глубина открытого <main>
+        self._main_children = 0
+
+    def _collect(self, tag, attrs):
+        self.tags.add(tag)
+        self.classes.update((attrs.get('class') or '').split())
+        if attrs.get('id'):
+            self.ids.add(attrs['id'])
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and 'stylesheet' in (attrs.get('rel') or '').split() and attrs.get('href'):
+            if attrs['href'] not in self.stylesheets: # <noscript> дублирует ссылку
+                self.stylesheets.append(attrs['href'])
+
+        if tag == 'header' and self._header_depth is None:
+            self._header_depth = self._depth
+        if self._main_depth is not None and self._depth == self._main_depth + 1:
+            self._main_children += 1
+        in_fold = (self._header_depth is not None
+                   or (self._main_depth is not None and 0 < self._main_children <= FOLD_ELEMENTS))
+        if tag in ('body', 'main') or in_fold:
+            self._collect(tag, attrs)
+        if tag == 'main' and self._main_depth is None and not self._main_children:
+            self._main_depth = self._depth
+
+        if tag not in VOID_TAGS:
+            self._depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self._depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        self._depth -= 1
+        if tag == 'header' and self._depth == self._header_depth:
+            self._header_depth = None
+        if tag == 'main' and self._depth == self._main_depth:
+            self._main_depth = None # Подвал и модальные окна после <main> - не первый экран
+
+
+# --- Разбор CSS ---
+def _split_blocks(css):
+    """Разбивает CSS на блоки верхнего уровня [(заголовок, тело)] с учетом строк в кавычках."""
+    blocks = []
+    depth = 0
+    start = body_start = 0
+    quote = None
+    i = 0
+    while i < len(css):
+        char = css[i]
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                body_start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                prelude_end = css.rfind('{', start, body_start)
+                blocks.append((css[start:prelude_end].strip(), css[body_start:i]))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            start = i + 1 # @charset/@import и т.п. без тела - в критический CSS не попадают
+        i += 1
+    return blocks
+
+
+def _split_selectors(prelude):
+    """Делит список селекторов по запятым верхнего уровня (не внутри :is(...)/:not(...))."""
+    selectors, depth, current = [], 0, ''
+    for char in prelude:
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        if char == ',' and depth == 0:
+            selectors.append(current.strip())
+            current = ''
+        else:
+            current += char
+    selectors.append(current.strip())
+    return [s for s in selectors if s]
+
+
+def _selector_matches(selector, page):
+    """Селектор нужен, если все его теги, классы и id встречаются на первом экране.
+
+    Псевдоклассы и атрибуты не проверяем (оставляем правило) - лишнее правило безопаснее
+    пропущенного.
+    """
+    simplified = re.sub(r'\[[^\]]*\]', '', selector)
+    simplified = re.sub(r'::?[\w-]+(\((?:[^()]|\([^()]*\))*\))?', '', simplified)
+    classes = re.findall(r'\.((?:\\.|[\w-])+)', simplified)
+    ids = re.findall(r'#((?:\\.|[\w-])+)', simplified)
+    tags = re.findall(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)', simplified)
+    return (all(c.replace('\\', '') in page.classes for c in classes)
+            and all(i.replace('\\', '') in page.ids for i in ids)
+            and all(t.lower() in page.tags for t in tags))
+
+
+def _absolutize_urls(css, base_url):
+    """url() в инлайновом <style> считаются от страницы, а не от файла стилей - делаем их абсолютными."""
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', '#')):
+            return match.group(0)
+        return f'url("{urljoin(base_url, url)}")'
+    return re.sub(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', replace, css)
+
+
+def extract_critical(stylesheets, page):
+    """Оставляет из таблиц стилей (в порядке подключения) только правила для первого экрана.
+
+    @keyframes и @font-face сохраняются, только если на них ссылаются оставленные правила
+    (шрифт может быть объявлен в одном файле, а использоваться в другом).
+    """
+    deferred = []
+
+    def walk(blocks):
+        out = []
+        for prelude, body in blocks:
+            lowered = prelude.lower()
+            if lowered.startswith(('@media', '@supports', '@layer')):
+                nested = walk(_split_blocks(body))
+                if nested:
+                    out.append(f"{prelude}{{{nested}}}")
+            elif lowered.startswith(('@keyframes', '@-webkit-keyframes', '@font-face')):
+                out.append(f"\0{len(deferred)}\0") # Решим в конце, когда известны все правила
+                deferred.append((prelude, body))
+            elif lowered.startswith('@'):
+                continue # @page, @property и прочее первому экрану не нужны
+            else:
+                selectors = [s for s in _split_selectors(prelude) if _selector_matches(s, page)]
+                if selectors:
+                    out.append(f"{','.join(selectors)}{{{body}}}")
+        return ''.join(out)
+
+    css = '\n'.join(walk(_split_blocks(sheet)) for sheet in stylesheets)
+    used = re.sub(r'\0\d+\0', '', css)
+
+    def resolve(match):
+        prelude, body = deferred[int(match.group(1))]
+        if prelude.lower().startswith('@font-face'):
+            family = re.search(r'font-family\s*:\s*([\'"]?)([^;\'"]+)\1', body)
+            keep = family is not None and family.group(2).strip() in used
+        else:
+            keep = re.search(rf'[\s:,]{re.escape(prelude.split()[-1])}\b', used) is not None
+        return f"{prelude}{{{body}}}" if keep else ''
+
+    return re.sub(r'\0(\d+)\0', resolve, css)
+
+
+def build_critical_css(app, endpoints=CRITICAL_PAGES):
+    """Рендерит страницы и сохраняет для каждой критический CSS. Возвращает {endpoint: размер}."""
+    import requests # Нужен только при сборке (flask build-critical-css), не в веб-воркерах
+    app.extensions['critical_css'] = {} # Разбираем страницы в обычном виде, без старого инлайна
+    client = app.test_client()
+    build_folder = os.path.join(app.root_path, BUILD_DIR)
+    os.makedirs(build_folder, exist_ok=True)
+    stylesheet_cache = {}
+    sizes = {}
+
+    for endpoint in endpoints:
+        with app.test_request_context():
+            page_url = url_for(endpoint)
+        response = client.get(page_url)
+        if response.status_code != 200:
+            raise click.ClickException(f"Страница {page_url} вернула {response.status_code}")
+
+        page = AboveTheFoldParser()
+        page.feed(response.get_data(as_text=True))
+        for href in page.stylesheets:
+            if href not in stylesheet_cache:
+                if href.startswith(('http://', 'https://', '//')):
+                    url = 'https:' + href if href.startswith('//') else href
+                    try:
+                        remote = requests.get(url, headers=FETCH_HEADERS, timeout=FETCH_TIMEOUT)
+                        remote.raise_for_status()
+                    except requests.exceptions.RequestException as e:
+                        raise click.ClickException(f"Не удалось скачать {url}: {e}")
+                    stylesheet_cache[href] = _absolutize_urls(remote.text, url)
+                else:
+                    local = client.get(href)
+                    if local.status_code != 200:
+                        raise click.ClickException(f"Файл стилей {href} вернул {local.status_code}")
+                    stylesheet_cache[href] = _absolutize_urls(local.get_data(as_text=True), href)
+
+        css = minify_css(extract_critical([stylesheet_cache[href] for href in page.stylesheets], page))
+        with open(os.path.join(build_folder, f"{endpoint}.css"), 'w', encoding='utf-8') as f:
+            f.write(css)
+        sizes[endpoint] = len(css.encode('utf-8'))
+
+    app.extensions['critical_css'] = load_critical_css(app)
+    page_cache.clear() # В кэше страницы, отрендеренные без нового инлайна
+    return sizes
+
+
+def load_critical_css(app):
+    """Читает собранный критический CSS. Страницы без него подключают стили как раньше."""
+    build_folder = os.path.join(app.root_path, BUILD_DIR)
+    styles = {}
+    for endpoint in CRITICAL_PAGES:
+        try:
+            with open(os.path.join(build_folder, f"{endpoint}.css"), encoding='utf-8') as f:
+                styles[endpoint] = f.read()
+        except OSError:
+            continue
+    return styles
+
+
+# --- Шаблонные хелперы ---
+def critical_css():
+    """<style> с критическим CSS текущей страницы (пустая строка, если сборки нет)."""
+    css = current_app.extensions['critical_css'].get(request.endpoint)
+    if not css:
+        return ''
+    return Markup(f'<style>{css}</style>') # CSS собран нами из доверенных файлов
+
+
+def stylesheet(href, **attrs):
+    """Подключение таблицы стилей: блокирующее, а при наличии критического CSS - асинхронное.
+
+    Пример: {{ stylesheet('https://cdn.example/bootstrap.min.css', integrity='sha384-...', crossorigin='anonymous') }}.
+    Асинхронная загрузка - через media="print" с переключением на "all" в onload, плюс <noscript>.
+    """
+    html_attrs = ''.join(
+        f' {escape(name.rstrip("_").replace("_", "-"))}="{escape(value)}"' for name, value in attrs.items()
+    )
+    link = f'<link rel="stylesheet" href="{escape(href)}"{html_attrs}>'
+    if not current_app.extensions['critical_css'].get(request.endpoint):
+        return Markup(link)
+    return Markup(
+        f'<link rel="stylesheet" href="{escape(href)}"{html_attrs} media="print" '
+        f'onload="this.media=\'all\'; this.onload=null;">'
+        f'<noscript>{link}</noscript>'
+    )
+
+
+def init_app(app):
+    """Регистрирует хелперы critical_css/stylesheet и команду flask build-critical-css."""
+    app.extensions['critical_css'] = load_critical_css(app)
+    app.add_template_global(critical_css)
+    app.add_template_global(stylesheet)
+
+    @app.cli.command('build-critical-css')
+    def build_critical_css_command():
+        """Извлекает CSS первого экрана для страниц (запускать после flask build-assets)."""
+        for endpoint, size in build_critical_css(app).items():
+            click.echo(f"{endpoint}: {size // 1024}KB критического CSS")
@@ -0,0 +1,191 @@
+import logging
+import os
+import time
+import weakref
+
+import click
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# Асинхронные драйверы для бота (sync-драйвер в URL заменяется на async)
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# --- Профиль SQLite (общий для веб-приложения и бота) ---
+# Веб-воркеры и бот пишут в один файл из разных процессов. WAL позволяет читать во время записи,
+# а busy_timeout - ждать освобождения блокировки вместо мгновенной ошибки "database is locked".
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', '1') == '1'
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 10000)) # мс
+SQLITE_PRAGMAS = (
+    # Новый файл БД сразу создается с возвратом места по частям (см. callback_archive.py);
+    # для существующего файла режим включается один раз: flask archive-callbacks --convert-vacuum
+    ('auto_vacuum', 'INCREMENTAL'),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'), # В режиме WAL безопасно: при сбое питания теряется только последний коммит
+    ('busy_timeout', SQLITE_BUSY_TIMEOUT),
+    ('cache_size', -20000), # Отрицательное значение - в КБ (~20 МБ на соединение)
+    ('mmap_size', 268435456), # 256 МБ чтения через mmap
+)
+SQLITE_CHECKPOINT_INTERVAL = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', 300)) # сек., 0 - не запускать
+
+# --- Лог медленных запросов (веб-приложение и бот) ---
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200)) # Запросы дольше пишутся в лог; 0 - не писать
+SLOW_QUERY_MAX_SQL = 1000 # Символов SQL в записи
+
+
+def get_database_uri():
+    """Возвращает URL БД, общий для веб-приложения и бота.
+
+    DATABASE_URL (например, Postgres) имеет приоритет, иначе используется файл SQLite
+    DATABASE_PATH относительно папки проекта.
+    """
+    url = os.environ.get('DATABASE_URL')
+    if url:
+        # Heroku-подобные сервисы отдают устаревшую схему postgres://
+        if url.startswith('postgres://'):
+            url = 'postgresql://' + url[len('postgres://'):]
+        return url
+    return 'sqlite:///' + os.path.join(BASE_DIR, os.environ.get('DATABASE_PATH') or 'database.db')
+
+
+def get_async_database_uri():
+    """Тот же URL БД, но с асинхронным драйвером (aiosqlite / asyncpg)."""
+    url = make_url(get_database_uri())
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Нет асинхронного драйвера для БД '{backend}'")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Выставляет SQLITE_PRAGMAS на новом соединении (обработчик события connect)."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def redact_parameters(parameters):
+    """Параметры запроса для лога без персональных данных: строки и байты заменяются длиной.
+
+    Числа, даты и None остаются - по ним видно, какие ID и лимиты были у запроса.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact_parameters(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_parameters(value) for value in parameters]
+    if isinstance(parameters, (str, bytes, bytearray, memoryview)):
+        return f"<{type(parameters).__name__}:{len(parameters)}>"
+    return parameters
+
+
+def log_slow_queries(sync_engine, logger, threshold_ms=SLOW_QUERY_MS):
+    """Пишет в logger (WARNING) запросы дольше threshold_ms вместе с обезличенными параметрами."""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['slow_query_start'].pop()) * 1000
+        if elapsed_ms < threshold_ms:
+            return
+        sql = ' '.join(statement.split())[:SLOW_QUERY_MAX_SQL]
+        if executemany:
+            params = f"{len(parameters)} наборов, первый: {redact_parameters(parameters[0]) if parameters else []}"
+        else:
+            params = redact_parameters(parameters)
+        logger.warning(f"Медленный запрос ({elapsed_ms:.0f} мс): {sql} | параметры: {params}")
+
+    def handle_error(exception_context):
+        starts = exception_context.connection.info.get('slow_query_start') if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', handle_error)
+
+
+def configure_engine(engine, logger=None):
+    """Подключает профиль SQLite к движку: прагмы выполняются на каждом новом соединении пула.
+
+    Подходит и для асинхронного движка (событие вешается на его sync_engine). Для Postgres прагмы
+    не нужны, но медленные запросы (SLOW_QUERY_MS) логируются для любой БД.
+    """
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    if SQLITE_PROFILE and sync_engine.dialect.name == 'sqlite':
+        event.listen(sync_engine, 'connect', apply_sqlite_pragmas)
+    if SLOW_QUERY_MS > 0:
+        log_slow_queries(sync_engine, logger or logging.getLogger(__name__))
+    return engine
+
+
+def checkpoint_statement(mode='TRUNCATE'):
+    """PRAGMA wal_checkpoint: переносит WAL в основной файл. TRUNCATE еще и обрезает WAL до нуля.
+
+    Автоматический checkpoint SQLite может не завершаться при постоянных читателях,
+    и WAL растет - поэтому бот периодически запускает его явно (и есть flask sqlite-checkpoint).
+    """
+    return f"PRAGMA wal_checkpoint({mode})"
+
+
+def create_async_db_engine(pool_size=5, max_overflow=5):
+    """Создает асинхронный движок SQLAlchemy с пулом соединений (для бота)."""
+    from sqlalchemy.ext.asyncio import create_async_engine # Веб-приложению async-часть не нужна
+    return configure_engine(create_async_engine(
+        get_async_database_uri(),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True, # Проверяем соединение из пула перед использованием (важно для Postgres)
+    ))
+
+
+# Движки веб-приложения, чей пул сбрасывается в дочернем процессе после fork. Слабые ссылки:
+# приложения, созданные в тестах и CLI, не живут вечно из-за хука
+_fork_engines = weakref.WeakSet()
+_fork_hook_registered = False
+
+
+def _dispose_after_fork():
+    # Соединения родителя в дочернем процессе использовать нельзя - пул воркера начинает с нуля
+    # (close=False: закрывать их может только родитель)
+    for engine in list(_fork_engines):
+        engine.dispose(close=False)
+
+
+def dispose_engine_after_fork(engine):
+    """Сбрасывает пул engine в дочернем процессе после fork (хук регистрируется один раз на процесс)."""
+    if not hasattr(os, 'register_at_fork'):
+        return # Windows: fork нет - нет и унаследованных соединений
+    global _fork_hook_registered
+    if not _fork_hook_registered:
+        os.register_at_fork(after_in_child=_dispose_after_fork)
+        _fork_hook_registered = True
+    _fork_engines.add(engine)
+
+
+def init_app(app, db):
+    """Подключает профиль SQLite к движку Flask-SQLAlchemy и команду flask sqlite-checkpoint."""
+    with app.app_context():
+        engine = configure_engine(db.engine, app.logger)
+    # gunicorn --preload: приложение создается в мастере, воркеры получают копию пула после fork
+    dispose_engine_after_fork(engine)
+
+    @app.cli.command('sqlite-checkpoint')
+    @click.option('--mode', default='TRUNCATE', type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE']))
+    def sqlite_checkpoint_command(mode):
+        """Переносит WAL в файл БД (для запуска по cron, если бот не запущен)."""
+        if db.engine.dialect.name != 'sqlite':
+            raise click.ClickException("Команда нужна только для SQLite")
+        with db.engine.connect() as connection:
+            busy, log_frames, checkpointed = connection.exec_driver_sql(checkpoint_statement(mode)).one()
+        click.echo(f"WAL: страниц {log_frames}, перенесено {checkpointed}" + (" (БД была занята)" if busy else ""))
@@ -0,0 +1,36 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+import gc
+import os
+import shutil
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# Приложение создается в мастере один раз (create_app в wsgi.py), воркеры получают его копией при fork:
+# быстрее старт, меньше памяти на воркер. Соединения с БД и фоновые потоки воркеры создают сами
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Метрики воркеров пишутся в файлы этого каталога, /metrics любого воркера отдает их сумму.
+# Переменная выставляется здесь, до любого импорта prometheus_client (и приложения): класс значений
+# выбирается при импорте, и без нее каждый воркер работал бы в режиме одного процесса.
+METRICS_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prometheus_multiproc'))
+os.makedirs(METRICS_DIR, exist_ok=True) # Нужен уже при загрузке приложения в мастере (preload_app)
+
+
+def on_starting(server):
+    # Файлы прошлого запуска дали бы удвоенные счетчики (мастер в них не пишет, воркеры создадут свои)
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def pre_fork(server, worker):
+    # Объекты, созданные в мастере, переносятся в постоянное поколение: сборщик мусора воркера их не обходит
+    # и не пишет в их заголовки, поэтому страницы памяти остаются общими
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess # Импорт здесь: к этому моменту PROMETHEUS_MULTIPROC_DIR уже задан
+
+    # Значения gauge-метрик умершего воркера больше не актуальны (счетчики и гистограммы сохраняются)
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import time
+
+PENDING = object() # Запрос с этим ключом еще выполняется в другом воркере
+WAIT_STEP = 0.05 # сек. между проверками, пока ключ занят
+PRUNE_INTERVAL = 60 # сек., как часто воркер удаляет просроченные ключи
+
+
+class ResponseStore:
+    """Общее для всех воркеров хранилище ответов по ключу с коротким сроком жизни (файлы в каталоге).
+
+    Ключ - отдельный файл: его создание с O_EXCL атомарно, поэтому из параллельных запросов
+    с одним ключом выполняется только первый. Пока он выполняется, файл пуст; затем в него
+    пишется ответ. Срок жизни ответа хранится во времени изменения файла (пустой файл живет
+    pending_timeout от создания) - просроченные ключи удаляются по stat(), без чтения содержимого.
+    БД при этом не используется.
+    """
+
+    def __init__(self, directory, pending_timeout=30, wait=2.0):
+        self.directory = directory
+        self.pending_timeout = pending_timeout # Ключ упавшего запроса освобождается через это время
+        self.wait = wait # Сколько повтор ждет ответа первого запроса, прежде чем вернуть PENDING
+        self._pruned_at = 0.0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def begin(self, key):
+        """Занимает ключ. None - ключ свободен, запрос выполняет вызывающий (и потом зовет complete или release).
+
+        Иначе - сохраненный ответ (тело, статус) или PENDING, если первый запрос не успел за self.wait.
+        """
+        self._prune()
+        path = self._path(key)
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileNotFoundError:
+                os.makedirs(self.directory, exist_ok=True)
+                continue
+            except FileExistsError:
+                pass
+            else:
+                os.close(fd)
+                return None
+            stored = self._read(path)
+            if stored is None: # Ключ просрочен (или удален) - пробуем занять заново
+                continue
+            if stored is not PENDING or time.monotonic() >= deadline:
+                return stored
+            time.sleep(WAIT_STEP)
+
+    def run(self, key, ttl, produce):
+        """Выполняет produce() -> (тело, статус) один раз на ключ; успешный (2xx) ответ помнится ttl секунд.
+
+        Возвращает (ответ, replayed). replayed=True - ответ сохранен раньше (или PENDING вместо него).
+        """
+        stored = self.begin(key)
+        if stored is not None:
+            return stored, True
+        try:
+            body, status = produce()
+        except BaseException:
+            self.release(key)
+            raise
+        if 200 <= status < 300:
+            self.complete(key, body, status, ttl)
+        else:
+            self.release(key) # Ошибку не запоминаем: исправленный запрос выполнится заново
+        return (body, status), False
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self._expires(stat, path) < time.time():
+            self._remove(path)
+            return None
+        if not data:
+            return PENDING
+        stored = json.loads(data)
+        return stored['body'], stored['status']
+
+    def complete(self, key, body, status, ttl):
+        """Сохраняет ответ на ttl секунд (атомарно: повтор видит либо пустой файл, либо ответ целиком)."""
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'body': body, 'status': status}, f, ensure_ascii=False)
+        expires = time.time() + ttl
+        os.utime(temp_path, (expires, expires))
+        os.replace(temp_path, path)
+
+    def release(self, key):
+        """Освобождает ключ без ответа (ошибку не запоминаем - повтор выполнится заново)."""
+        self._remove(self._path(key))
+
+    def _expires(self, stat, path):
+        if not stat.st_size or path.endswith('.tmp'): # Запрос еще выполняется или ответ дописывается
+            return stat.st_mtime + self.pending_timeout
+        return stat.st_mtime
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _prune(self):
+        now = time.time()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if self._expires(entry.stat(), entry.path) < now:
+                    self._remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def init_app(app):
+    """Хранилище ключей отправки формы заявки (app.extensions['submit_keys'])."""
+    directory = os.path.join(app.root_path, app.config['SUBMIT_KEYS_DIR'])
+    app.extensions['submit_keys'] = ResponseStore(directory)
@@ -0,0 +1,159 @@
+import os
+
+import click
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image, ImageOps, features # Необязательная зависимость: без Pillow отдаем оригиналы
+except ImportError:
+    Image = None
+
+VARIANTS_DIR = 'img/variants' # Подпапка static/ с уменьшенными копиями (кэш на диске)
+
+# Исходные изображения и ширины (px), в которых они реально показываются на сайте (с запасом для retina)
+RESPONSIVE_IMAGES = {
+    'img/founder.jpg': (160, 200, 320, 400, 600), # .founder-photo-container: 200px, на мобильных 160px
+    'img/logo.png': (30, 60, 80, 160), # Навбар: 30px, главная: 80px
+}
+
+# Формат запасного варианта (для браузеров без WebP/AVIF) по расширению исходника
+FALLBACK_FORMATS = {
+    '.jpg': ('jpg', 'JPEG'),
+    '.jpeg': ('jpg', 'JPEG'),
+    '.png': ('png', 'PNG'),
+}
+SAVE_OPTIONS = {
+    'AVIF': {'quality': 55},
+    'WEBP': {'quality': 80, 'method': 6},
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+}
+
+_variants_cache = {} # filename -> {формат: [(ширина, путь)]} или None, чтобы не ходить на диск при каждом рендере
+
+
+def modern_formats():
+    """Современные форматы, которые умеет кодировать установленный Pillow (лучший - первым)."""
+    formats = []
+    if features.check('avif'):
+        formats.append(('avif', 'AVIF', 'image/avif'))
+    if features.check('webp'):
+        formats.append(('webp', 'WEBP', 'image/webp'))
+    return formats
+
+
+def variant_path(filename, width, ext):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return f"{VARIANTS_DIR}/{name}-{width}w.{ext}"
+
+
+def _save_atomically(image, path, pil_format):
+    # Воркеры могут читать файл во время сборки - пишем во временный и переименовываем
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp_path, format=pil_format, **SAVE_OPTIONS[pil_format])
+    os.replace(tmp_path, path)
+
+
+def build_variants(static_folder, filename, widths):
+    """Генерирует уменьшенные копии одного изображения. Уже готовые и свежие файлы не пересоздаются.
+
+    Возвращает {расширение: [(ширина, путь относительно static/)]}.
+    """
+    source_path = os.path.join(static_folder, filename)
+    source_mtime = os.path.getmtime(source_path)
+    fallback_ext, fallback_format = FALLBACK_FORMATS[os.path.splitext(filename)[1].lower()]
+    formats = modern_formats() + [(fallback_ext, fallback_format, None)]
+    os.makedirs(os.path.join(static_folder, VARIANTS_DIR), exist_ok=True)
+
+    source = None
+    variants = {}
+    for ext, pil_format, _ in formats:
+        for width in widths:
+            path = variant_path(filename, width, ext)
+            full_path = os.path.join(static_folder, path)
+            if not os.path.exists(full_path) or os.path.getmtime(full_path) < source_mtime:
+                if source is None:
+                    # Фото с телефона хранят поворот в EXIF - применяем его до уменьшения
+                    source = ImageOps.exif_transpose(Image.open(source_path))
+                target_width = min(width, source.width)
+                resized = source.resize(
+                    (target_width, round(source.height * target_width / source.width)), Image.LANCZOS)
+                if pil_format == 'JPEG' and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+                _save_atomically(resized, full_path, pil_format)
+            variants.setdefault(ext, []).append((width, path))
+    return variants
+
+
+def find_variants(static_folder, filename, widths):
+    """Готовые варианты изображения на диске (без генерации) или None, если каких-то файлов нет."""
+    fallback_ext = FALLBACK_FORMATS[os.path.splitext(filename)[1].lower()][0]
+    variants = {}
+    for ext in [ext for ext, _, _ in modern_formats()] + [fallback_ext]:
+        paths = [(width, variant_path(filename, width, ext)) for width in widths]
+        if not all(os.path.exists(os.path.join(static_folder, path)) for _, path in paths):
+            if ext == fallback_ext:
+                return None
+            continue # Без AVIF/WebP обойдемся - отдадим остальные форматы
+        variants[ext] = paths
+    return variants
+
+
+def get_variants(filename):
+    """Возвращает варианты изображения, подготовленные командой flask build-images (проверка - раз на процесс).
+
+    В запросе ничего не генерируется: если вариантов нет, хелпер выводит оригинал.
+    """
+    if filename not in _variants_cache:
+        variants = None
+        if Image is not None and filename in RESPONSIVE_IMAGES:
+            variants = find_variants(current_app.static_folder, filename, RESPONSIVE_IMAGES[filename])
+            if variants is None:
+                current_app.logger.warning(f"Нет вариантов изображения {filename} - выполните flask build-images")
+        _variants_cache[filename] = variants # Гонка между потоками безобидна: результат одинаковый
+    return _variants_cache[filename]
+
+
+def responsive_image(filename, alt, sizes, **attrs):
+    """Шаблонный хелпер: <picture> с AVIF/WebP и запасным JPEG/PNG в нескольких ширинах.
+
+    Пример: {{ responsive_image('img/logo.png', 'Logo', '30px', width=30, class='me-2') }}.
+    Без Pillow, для неизвестного файла или до flask build-images выводит обычный <img> с оригиналом.
+    """
+    html_attrs = ''.join(
+        f' {escape(name.rstrip("_").replace("_", "-"))}="{escape(value)}"' for name, value in attrs.items()
+    )
+    variants = get_variants(filename)
+    if not variants:
+        return Markup(f'<img src="{url_for("static", filename=filename)}" alt="{escape(alt)}"{html_attrs}>')
+
+    def srcset(ext):
+        return ', '.join(f'{url_for("static", filename=path)} {width}w' for width, path in variants[ext])
+
+    fallback_ext = FALLBACK_FORMATS[os.path.splitext(filename)[1].lower()][0]
+    sources = ''.join(
+        f'<source type="{mime}" srcset="{srcset(ext)}" sizes="{escape(sizes)}">'
+        for ext, _, mime in modern_formats() if ext in variants
+    )
+    fallback_src = url_for('static', filename=variants[fallback_ext][-1][1])
+    return Markup(
+        f'<picture>{sources}'
+        f'<img src="{fallback_src}" srcset="{srcset(fallback_ext)}" sizes="{escape(sizes)}" '
+        f'alt="{escape(alt)}"{html_attrs}></picture>'
+    )
+
+
+def init_app(app):
+    """Регистрирует хелпер responsive_image и команду flask build-images."""
+    app.add_template_global(responsive_image)
+
+    @app.cli.command('build-images')
+    def build_images_command():
+        """Заранее генерирует варианты изображений (запускать перед flask build-assets)."""
+        if Image is None:
+            raise click.ClickException("Для генерации изображений нужен Pillow")
+        for filename, widths in RESPONSIVE_IMAGES.items():
+            for ext, paths in build_variants(app.static_folder, filename, widths).items():
+                sizes = [os.path.getsize(os.path.join(app.static_folder, path)) // 1024 for _, path in paths]
+                click.echo(f"{filename} [{ext}]: " + ', '.join(f"{w}w={s}KB" for (w, _), s in zip(paths, sizes)))
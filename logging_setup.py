@@ -0,0 +1,175 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import current_app, request
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+CALLER_SUFFIX = ' [in %(pathname)s:%(lineno)d]'
+# Стандартные поля LogRecord - все остальное (extra=...) попадает в JSON отдельными ключами
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON (для сборщиков логов)."""
+
+    def __init__(self, caller_info=True):
+        super().__init__()
+        self.caller_info = caller_info
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if self.caller_info:
+            entry['path'] = record.pathname
+            entry['line'] = record.lineno
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """QueueHandler с одним потоком-писателем (QueueListener) на процесс.
+
+    Поток запускается лениво при первой записи в каждом процессе (после fork у gunicorn
+    поток родителя не существует). Если очередь переполнена (диск или stdout не успевают),
+    запись отбрасывается, а не блокирует запрос; число потерянных записей логируется позже.
+    """
+
+    def __init__(self, handlers, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.target_handlers = handlers
+        self.maxsize = maxsize
+        self.listener = None
+        self.dropped = 0
+        self._dropped_lock = threading.Lock() # enqueue вызывается из потоков всех запросов
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                if self._pid is not None:
+                    self.queue = queue.Queue(self.maxsize) # Очередь родителя после fork не обслуживается
+                self.listener = QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Сообщение и traceback собираем сейчас (аргументы могут измениться), форматирование и запись - в потоке
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        if self.dropped: # Чтение без блокировки - только подсказка, сам счетчик меняется под ней
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped and not self._put(logging.makeLogRecord({
+                'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"Очередь логов была переполнена, потеряно записей: {dropped}",
+            })):
+                # Очередь все еще полна: ни сообщение, ни сама запись не влезут - сообщим в следующий раз
+                self._count_dropped(dropped + 1)
+                return
+        if not self._put(record):
+            self._count_dropped(1)
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            return False
+
+    def _count_dropped(self, count):
+        with self._dropped_lock:
+            self.dropped += count
+
+    def stop(self):
+        """Дописывает оставшиеся записи и останавливает поток (вызывается при выходе)."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+
+
+def parse_sample_rates(value):
+    """'index=0.1,about=0.5' -> {'index': 0.1, 'about': 0.5}."""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            endpoint, rate = item.split('=', 1)
+            rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+def log_page_request(page):
+    """Пишет "Запрос к <page> с IP" с учетом доли сэмплирования для маршрута.
+
+    Доля берется из LOG_SAMPLE_RATES (по endpoint), иначе LOG_PAGE_SAMPLE_RATE. Отброшенная
+    запись не форматируется и не попадает в очередь вовсе.
+    """
+    rate = current_app.extensions['log_sample_rates'].get(request.endpoint, current_app.config['LOG_PAGE_SAMPLE_RATE'])
+    if rate < 1 and random.random() >= rate:
+        return
+    current_app.logger.info('Запрос к %s с IP: %s', page, request.remote_addr, stacklevel=2, # Файл и строка - представления
+                            extra={'endpoint': request.endpoint, 'ip': request.remote_addr, 'sample_rate': rate})
+
+
+def init_app(app):
+    """Настраивает логгер приложения: файл с ротацией и консоль, запись через очередь в отдельном потоке."""
+    config = app.config
+    caller_info = config['LOG_CALLER_INFO']
+    if not caller_info:
+        logging._srcfile = None # Не ищем файл/строку вызова (рекомендация из документации logging)
+
+    if config['LOG_FORMAT'] == 'json':
+        formatter = JsonFormatter(caller_info=caller_info)
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT + (CALLER_SUFFIX if caller_info else ''))
+    log_level = logging.getLevelName(config['LOG_LEVEL'])
+
+    os.makedirs(config['LOG_DIR'], exist_ok=True)
+    # Обработчик для записи логов в файл с ротацией
+    file_handler = RotatingFileHandler(
+        os.path.join(config['LOG_DIR'], 'app.log'),
+        maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8',
+    )
+    # Обработчик для вывода логов в консоль
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+        handler.setLevel(log_level)
+
+    queue_handler = BackgroundQueueHandler([file_handler, console_handler], config['LOG_QUEUE_SIZE'])
+    atexit.register(queue_handler.stop)
+
+    # Заменяем стандартный обработчик Flask на очередь
+    for handler in list(app.logger.handlers):
+        app.logger.removeHandler(handler)
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(log_level)
+    app.extensions['log_sample_rates'] = parse_sample_rates(config['LOG_SAMPLE_RATES'])
+    return queue_handler
@@ -0,0 +1,123 @@
+import hmac
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Под gunicorn каждый воркер пишет значения в свои файлы в PROMETHEUS_MULTIPROC_DIR
+# (каталог задается и очищается в gunicorn.conf.py), а /metrics складывает их вместе.
+# Переменная должна быть выставлена до импорта prometheus_client.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+# Маршруты, для которых пишется гистограмма; остальные (статика, 404) идут под меткой 'other'
+TRACKED_ENDPOINTS = {'index', 'pricing', 'about', 'submit_callback', 'export_callbacks'}
+# Границы корзин (сек.): от быстрых ответов из кэша страниц до медленных запросов к Telegram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'Время выполнения SQL-запроса', ['operation'], buckets=LATENCY_BUCKETS,
+)
+DB_COMMIT_LATENCY = Histogram(
+    'db_commit_duration_seconds', 'Время коммита сессии (вместе с flush)', buckets=LATENCY_BUCKETS,
+)
+TELEGRAM_SEND_LATENCY = Histogram(
+    'telegram_send_duration_seconds', 'Время вызова sendMessage из веб-приложения', buckets=LATENCY_BUCKETS,
+)
+TELEGRAM_SEND_FAILURES = Counter(
+    'telegram_send_failures', 'Неудачные отправки в Telegram', ['reason'],
+)
+BOT_HANDLER_LATENCY = Histogram(
+    'bot_handler_duration_seconds', 'Время работы обработчика бота', ['handler'], buckets=LATENCY_BUCKETS,
+)
+BOT_HANDLER_ERRORS = Counter(
+    'bot_handler_errors', 'Исключения в обработчиках бота', ['handler'],
+)
+
+
+# --- SQLAlchemy: запросы и коммиты (веб-приложение и бот) ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_start'].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    if operation not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+        operation = 'OTHER' # PRAGMA, BEGIN и т.п. - без отдельной метки на каждое слово
+    DB_QUERY_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get('metrics_query_start') if exception_context.connection else None
+    if starts:
+        starts.pop() # after_cursor_execute для упавшего запроса не вызывается
+
+
+def _before_commit(session):
+    session.info['metrics_commit_start'] = time.perf_counter()
+
+
+def _after_commit(session):
+    started = session.info.pop('metrics_commit_start', None)
+    if started is not None:
+        DB_COMMIT_LATENCY.observe(time.perf_counter() - started)
+
+
+def instrument_sqlalchemy():
+    """Подключает таймеры ко всем движкам и сессиям процесса (sync и async - под капотом тот же Engine)."""
+    if event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+    event.listen(Session, 'before_commit', _before_commit)
+    event.listen(Session, 'after_commit', _after_commit)
+
+
+# --- Flask ---
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _observe_request(response):
+    started = g.pop('metrics_start', None)
+    if started is not None and request.endpoint != 'metrics':
+        endpoint = request.endpoint if request.endpoint in TRACKED_ENDPOINTS else 'other'
+        REQUEST_LATENCY.labels(endpoint, request.method, str(response.status_code)) \
+            .observe(time.perf_counter() - started)
+    return response
+
+
+def render_metrics():
+    """Текст для /metrics: в режиме нескольких процессов - сумма по файлам всех воркеров."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_app(app):
+    """Таймеры запросов и SQL плюс маршрут /metrics (формат Prometheus)."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    instrument_sqlalchemy()
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                             f'Bearer {token}'.encode()):
+            return Response('Unauthorized\n', status=401, headers={'WWW-Authenticate': 'Bearer'})
+        return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
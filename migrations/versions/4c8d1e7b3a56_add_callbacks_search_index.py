@@ -0,0 +1,74 @@
+"""Add phone_digits and full-text search index for callbacks.
+
+Revision ID: 4c8d1e7b3a56
+Revises: e7a1c3f5b902
+Create Date: 2026-10-17 22:05:31.270415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8d1e7b3a56'
+down_revision = 'e7a1c3f5b902'
+branch_labels = None
+depends_on = None
+
+# FTS5 с внешним содержимым: текст хранится только в callbacks, индекс синхронизируют триггеры.
+# Триггер на UPDATE срабатывает только при смене индексируемых полей (не при смене статуса)
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE callbacks_fts USING fts5(
+        name, email, phone_digits, content='callbacks', content_rowid='id', tokenize='trigram')""",
+    "INSERT INTO callbacks_fts(callbacks_fts) VALUES ('rebuild')",
+    """CREATE TRIGGER callbacks_fts_ai AFTER INSERT ON callbacks BEGIN
+        INSERT INTO callbacks_fts(rowid, name, email, phone_digits)
+        VALUES (new.id, new.name, new.email, new.phone_digits);
+    END""",
+    """CREATE TRIGGER callbacks_fts_ad AFTER DELETE ON callbacks BEGIN
+        INSERT INTO callbacks_fts(callbacks_fts, rowid, name, email, phone_digits)
+        VALUES ('delete', old.id, old.name, old.email, old.phone_digits);
+    END""",
+    """CREATE TRIGGER callbacks_fts_au AFTER UPDATE OF name, email, phone_digits ON callbacks BEGIN
+        INSERT INTO callbacks_fts(callbacks_fts, rowid, name, email, phone_digits)
+        VALUES ('delete', old.id, old.name, old.email, old.phone_digits);
+        INSERT INTO callbacks_fts(rowid, name, email, phone_digits)
+        VALUES (new.id, new.name, new.email, new.phone_digits);
+    END""",
+]
+POSTGRES_TRGM_COLUMNS = ('name', 'email', 'phone_digits')
+
+
+def upgrade():
+    with op.batch_alter_table('callbacks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_digits', sa.String(length=20), nullable=True))
+        batch_op.create_index('ix_callbacks_phone_digits', ['phone_digits'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(r"UPDATE callbacks SET phone_digits = regexp_replace(phone, '\D', '', 'g')")
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in POSTGRES_TRGM_COLUMNS:
+            op.create_index(f'ix_callbacks_{column}_trgm', 'callbacks', [column], postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'})
+    elif dialect == 'sqlite':
+        # Телефоны приходят из формы в формате E.164, но старые записи могут быть с пробелами и скобками
+        op.execute("UPDATE callbacks SET phone_digits = replace(replace(replace(replace(replace(replace("
+                   "phone, '+', ''), ' ', ''), '-', ''), '(', ''), ')', ''), '.', '')")
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for column in POSTGRES_TRGM_COLUMNS:
+            op.drop_index(f'ix_callbacks_{column}_trgm', table_name='callbacks')
+    elif dialect == 'sqlite':
+        for trigger in ('callbacks_fts_ai', 'callbacks_fts_ad', 'callbacks_fts_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS callbacks_fts')
+
+    with op.batch_alter_table('callbacks', schema=None) as batch_op:
+        batch_op.drop_index('ix_callbacks_phone_digits')
+        batch_op.drop_column('phone_digits')
@@ -0,0 +1,34 @@
+"""Create callback_counters table.
+
+Revision ID: 5b9e3f7a1c24
+Revises: c52d7e0f9a13
+Create Date: 2026-10-17 16:48:19.552071
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e3f7a1c24'
+down_revision = 'c52d7e0f9a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('callback_counters',
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # Начальные значения считаем по уже накопленным заявкам
+    op.execute("INSERT INTO callback_counters (name, value) SELECT 'total', COUNT(*) FROM callbacks")
+    op.execute("INSERT INTO callback_counters (name, value) SELECT 'processed', COUNT(*) FROM callbacks WHERE processed")
+    op.execute("INSERT INTO callback_counters (name, value) SELECT 'unprocessed', COUNT(*) FROM callbacks WHERE NOT processed")
+    op.execute("INSERT INTO callback_counters (name, value) "
+               "SELECT 'lesson_type:' || lesson_type, COUNT(*) FROM callbacks GROUP BY lesson_type")
+
+
+def downgrade():
+    op.drop_table('callback_counters')
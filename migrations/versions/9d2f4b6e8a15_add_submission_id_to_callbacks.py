@@ -0,0 +1,29 @@
+"""Add submission_id to callbacks.
+
+Revision ID: 9d2f4b6e8a15
+Revises: 5b9e3f7a1c24
+Create Date: 2026-10-17 21:40:12.318645
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2f4b6e8a15'
+down_revision = '5b9e3f7a1c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('callbacks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('submission_id', sa.String(length=36), nullable=True))
+        # Уникальность защищает от повторной вставки при перезапуске журнала (у старых заявок NULL)
+        batch_op.create_index('ix_callbacks_submission_id', ['submission_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('callbacks', schema=None) as batch_op:
+        batch_op.drop_index('ix_callbacks_submission_id')
+        batch_op.drop_column('submission_id')
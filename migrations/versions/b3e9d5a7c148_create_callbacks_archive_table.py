@@ -0,0 +1,73 @@
+"""Create callbacks_archive table with its search index.
+
+Revision ID: b3e9d5a7c148
+Revises: 4c8d1e7b3a56
+Create Date: 2026-10-17 22:48:09.513276
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9d5a7c148'
+down_revision = '4c8d1e7b3a56'
+branch_labels = None
+depends_on = None
+
+# Тот же поиск, что и по callbacks (см. 4c8d1e7b3a56), чтобы /find находил и архивные заявки
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE callbacks_archive_fts USING fts5(
+        name, email, phone_digits, content='callbacks_archive', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER callbacks_archive_fts_ai AFTER INSERT ON callbacks_archive BEGIN
+        INSERT INTO callbacks_archive_fts(rowid, name, email, phone_digits)
+        VALUES (new.id, new.name, new.email, new.phone_digits);
+    END""",
+    """CREATE TRIGGER callbacks_archive_fts_ad AFTER DELETE ON callbacks_archive BEGIN
+        INSERT INTO callbacks_archive_fts(callbacks_archive_fts, rowid, name, email, phone_digits)
+        VALUES ('delete', old.id, old.name, old.email, old.phone_digits);
+    END""",
+    """CREATE TRIGGER callbacks_archive_fts_au AFTER UPDATE OF name, email, phone_digits ON callbacks_archive BEGIN
+        INSERT INTO callbacks_archive_fts(callbacks_archive_fts, rowid, name, email, phone_digits)
+        VALUES ('delete', old.id, old.name, old.email, old.phone_digits);
+        INSERT INTO callbacks_archive_fts(rowid, name, email, phone_digits)
+        VALUES (new.id, new.name, new.email, new.phone_digits);
+    END""",
+]
+POSTGRES_TRGM_COLUMNS = ('name', 'email', 'phone_digits')
+
+
+def upgrade():
+    op.create_table('callbacks_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.Column('phone', sa.String(length=20), nullable=False),
+        sa.Column('phone_digits', sa.String(length=20), nullable=True),
+        sa.Column('lesson_type', sa.String(length=50), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('processed', sa.Boolean(), nullable=False),
+        sa.Column('submission_id', sa.String(length=36), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('callbacks_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_callbacks_archive_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_callbacks_archive_phone_digits', ['phone_digits'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for column in POSTGRES_TRGM_COLUMNS:
+            op.create_index(f'ix_callbacks_archive_{column}_trgm', 'callbacks_archive', [column],
+                            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+    elif dialect == 'sqlite':
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('callbacks_archive_fts_ai', 'callbacks_archive_fts_ad', 'callbacks_archive_fts_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS callbacks_archive_fts')
+    op.drop_table('callbacks_archive') # Индексы удаляются вместе с таблицей
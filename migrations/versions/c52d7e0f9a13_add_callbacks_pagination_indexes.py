@@ -0,0 +1,31 @@
+"""Add indexes for keyset pagination of callbacks.
+
+Revision ID: c52d7e0f9a13
+Revises: 8a4e6c1b2d90
+Create Date: 2026-10-17 15:02:47.104839
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52d7e0f9a13'
+down_revision = '8a4e6c1b2d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('callbacks', schema=None) as batch_op:
+        batch_op.create_index('ix_callbacks_timestamp_id', ['timestamp', 'id'], unique=False)
+        # Частичный индекс: в нем только необработанные заявки, поэтому он остается маленьким
+        batch_op.create_index('ix_callbacks_unprocessed', ['timestamp', 'id'], unique=False,
+                              sqlite_where=sa.text('processed = 0'),
+                              postgresql_where=sa.text('NOT processed'))
+
+
+def downgrade():
+    with op.batch_alter_table('callbacks', schema=None) as batch_op:
+        batch_op.drop_index('ix_callbacks_unprocessed')
+        batch_op.drop_index('ix_callbacks_timestamp_id')
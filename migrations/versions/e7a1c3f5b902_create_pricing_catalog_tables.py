@@ -0,0 +1,69 @@
+"""Create pricing_plans and catalog_versions tables.
+
+Revision ID: e7a1c3f5b902
+Revises: 9d2f4b6e8a15
+Create Date: 2026-10-17 22:05:37.902114
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a1c3f5b902'
+down_revision = '9d2f4b6e8a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pricing_plans = op.create_table('pricing_plans',
+    sa.Column('key', sa.String(length=50), nullable=False),
+    sa.Column('title', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.Text(), nullable=False),
+    sa.Column('price', sa.String(length=20), nullable=False),
+    sa.Column('old_price', sa.String(length=20), nullable=True),
+    sa.Column('unit', sa.String(length=30), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    catalog_versions = op.create_table('catalog_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Тарифы, которые раньше были зашиты в app.py (pricing_data)
+    now = datetime.utcnow()
+    op.bulk_insert(pricing_plans, [
+        {
+            'key': 'individual_online',
+            'title': 'Персональное',
+            'description': 'Персональные онлайн-уроки через Zoom, MTS-link, Вебинар, WhatsApp или другие платформы. Максимальное внимание преподавателя и гибкий график.',
+            'price': '2999',
+            'old_price': '4500',
+            'unit': 'руб./час',
+            'position': 1,
+            'updated_at': now,
+        },
+        {
+            'key': 'group_online',
+            'title': 'Групповое занятие',
+            'description': 'Динамичные онлайн-занятия в небольшой группе (до 6 человек). Интерактивное обучение и общение.',
+            'price': '1499',
+            'old_price': '2000',
+            'unit': 'руб./час',
+            'position': 2,
+            'updated_at': now,
+        },
+    ])
+    op.bulk_insert(catalog_versions, [{'name': 'pricing', 'version': 1, 'updated_at': now}])
+
+
+def downgrade():
+    op.drop_table('catalog_versions')
+    op.drop_table('pricing_plans')
@@ -0,0 +1,147 @@
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+
+# Объект БД создается без приложения и подключается через db.init_app(app)
+db = SQLAlchemy()
+
+
+# ===>>> ОПРЕДЕЛЕНИЕ МОДЕЛЕЙ БАЗЫ ДАННЫХ <<<===
+class Callback(db.Model):
+    __tablename__ = 'callbacks' # Явно указываем имя таблицы
+    __table_args__ = (
+        # Keyset-пагинация в боте: ORDER BY timestamp DESC, id DESC
+        db.Index('ix_callbacks_timestamp_id', 'timestamp', 'id'),
+        # Частичный индекс только по необработанным заявкам (команда /new в боте)
+        db.Index('ix_callbacks_unprocessed', 'timestamp', 'id',
+                 sqlite_where=db.text('processed = 0'), postgresql_where=db.text('NOT processed')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(120), nullable=True)
+    phone = db.Column(db.String(20), nullable=False)
+    # Только цифры телефона для поиска в боте (/find 9161234); заполняется при сохранении заявки
+    phone_digits = db.Column(db.String(20), nullable=True, index=True)
+    lesson_type = db.Column(db.String(50), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed = db.Column(db.Boolean, default=False, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True) # Когда отмечена обработанной (для /stats); NULL - в работе
+    # Идентификатор отправки формы: повторная запись из журнала (callback_spool.py) не создаст дубль
+    submission_id = db.Column(db.String(36), nullable=True, unique=True, index=True)
+
+    def __repr__(self):
+        return f'<Callback {self.name} - {self.phone}>'
+
+
+class CallbackArchive(db.Model):
+    """Архив обработанных заявок: сюда переносятся старые строки из callbacks (см. callback_archive.py).
+
+    Колонки те же, ID сохраняется. Так таблица callbacks остается маленькой, а /find и выгрузка
+    смотрят в обе таблицы.
+    """
+    __tablename__ = 'callbacks_archive'
+    __table_args__ = (
+        db.Index('ix_callbacks_archive_timestamp_id', 'timestamp', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(120), nullable=True)
+    phone = db.Column(db.String(20), nullable=False)
+    phone_digits = db.Column(db.String(20), nullable=True, index=True)
+    lesson_type = db.Column(db.String(50), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    processed = db.Column(db.Boolean, default=True, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    submission_id = db.Column(db.String(36), nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CallbackArchive {self.name} - {self.phone}>'
+
+
+class NotificationOutbox(db.Model):
+    """Очередь исходящих уведомлений в Telegram (паттерн transactional outbox).
+
+    Строка пишется в той же транзакции, что и заявка, а отправляет её
+    фоновый диспетчер из notifications.py. После успешной отправки строка помечается
+    sent_at и удаляется, когда перестает быть нужной для группировки в дайджест.
+    """
+    __tablename__ = 'notification_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.BigInteger, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    kind = db.Column(db.String(20), nullable=True) # 'lead' - уведомление о заявке (см. notifications.KIND_LEAD)
+    payload = db.Column(db.JSON, nullable=True) # Поля заявки для сборки дайджеста
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    locked_until = db.Column(db.DateTime, nullable=True) # "Аренда" строки воркером, чтобы не слать дважды
+    last_error = db.Column(db.Text, nullable=True)
+    failed_at = db.Column(db.DateTime, nullable=True) # Заполняется при неисправимой ошибке (например, 403)
+    sent_at = db.Column(db.DateTime, nullable=True) # Отправленные строки живут одно окно дайджеста
+
+    def __repr__(self):
+        return f'<NotificationOutbox {self.id} -> {self.chat_id}>'
+
+
+class CallbackCounter(db.Model):
+    """Агрегированные счетчики заявок (вместо COUNT(*) на каждый показ списка в боте).
+
+    Имена: 'total', 'processed', 'unprocessed' и 'lesson_type:<тип>'. Обновляются
+    в той же транзакции, что и сами заявки (см. counters.py).
+    """
+    __tablename__ = 'callback_counters'
+    name = db.Column(db.String(80), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CallbackCounter {self.name}={self.value}>'
+
+
+class CallbackDailyStat(db.Model):
+    """Сводка заявок за день (UTC) по типу занятия для команды бота /stats.
+
+    День - дата поступления заявки. processed - сколько заявок этого дня уже обработано,
+    processing_seconds - их суммарное время до обработки (только у processed_timed заявок:
+    у отмеченных до появления processed_at время неизвестно). Обновляется в тех же
+    транзакциях, что и заявки (см. callback_stats.py).
+    """
+    __tablename__ = 'callback_daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    lesson_type = db.Column(db.String(50), primary_key=True)
+    submitted = db.Column(db.BigInteger, nullable=False, default=0)
+    processed = db.Column(db.BigInteger, nullable=False, default=0)
+    processed_timed = db.Column(db.BigInteger, nullable=False, default=0)
+    processing_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CallbackDailyStat {self.day} {self.lesson_type}={self.submitted}>'
+
+
+class PricingPlan(db.Model):
+    """Тариф на странице /pricing. Цены меняются командой бота /setprice без перезапуска."""
+    __tablename__ = 'pricing_plans'
+    key = db.Column(db.String(50), primary_key=True) # Например, 'individual_online'
+    title = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    price = db.Column(db.String(20), nullable=False)
+    old_price = db.Column(db.String(20), nullable=True) # Зачеркнутая цена (если есть)
+    unit = db.Column(db.String(30), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0) # Порядок карточек на странице
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PricingPlan {self.key}={self.price}>'
+
+
+class CatalogVersion(db.Model):
+    """Номер версии справочника (например, 'pricing'), увеличивается при каждом изменении.
+
+    Воркеры сверяют только этот номер и перечитывают справочник, когда он изменился (см. price_catalog.py).
+    """
+    __tablename__ = 'catalog_versions'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CatalogVersion {self.name}={self.version}>'
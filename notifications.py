@@ -0,0 +1,374 @@
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from html import escape
+
+from flask import current_app
+from sqlalchemy import delete, func, or_, update
+
+import metrics
+from models import db, NotificationOutbox
+
+KIND_LEAD = 'lead' # Уведомление о новой заявке (может попасть в дайджест)
+
+
+class TelegramSendError(Exception):
+    """Ошибка отправки сообщения в Telegram.
+
+    retry_after - сколько секунд просит подождать Telegram (ответ 429),
+    permanent - повторять отправку бессмысленно (неверный chat_id, бот заблокирован и т.п.),
+    reason - короткая причина для метрики telegram_send_failures.
+    """
+
+    def __init__(self, message, retry_after=None, permanent=False, reason='other'):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+        self.reason = reason
+
+
+# --- HTTP-сессия с пулом keep-alive соединений ---
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Возвращает общую для процесса requests.Session (создается лениво, отдельно в каждом воркере).
+
+    requests импортируется здесь же: воркеры без потока-диспетчера (NOTIFY_DISPATCHER_THREAD=0)
+    не загружают его вовсе.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # Повторы делает диспетчер сам, поэтому max_retries=0
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+# --- Функция отправки уведомления в Telegram ---
+def send_telegram_notification(chat_id, text):
+    """Отправляет сообщение в Telegram чат. При ошибке бросает TelegramSendError.
+
+    Время вызова и причины неудач попадают в /metrics (telegram_send_*).
+    """
+    started = time.perf_counter()
+    try:
+        _post_message(chat_id, text)
+    except TelegramSendError as e:
+        metrics.TELEGRAM_SEND_FAILURES.labels(e.reason).inc()
+        raise
+    finally:
+        metrics.TELEGRAM_SEND_LATENCY.observe(time.perf_counter() - started)
+    current_app.logger.info(f"Telegram notification sent to {chat_id}.")
+
+
+def _post_message(chat_id, text):
+    url = f"{current_app.config['TELEGRAM_API_URL']}/bot{current_app.config['BOT_TOKEN']}/sendMessage"
+    payload = {
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': 'HTML' # Можно использовать HTML для форматирования
+    }
+    session = get_http_session()
+    from requests.exceptions import RequestException # Уже загружен get_http_session
+    try:
+        response = session.post(url, json=payload, timeout=current_app.config['NOTIFY_HTTP_TIMEOUT'])
+    except RequestException as e:
+        raise TelegramSendError(f"Network error: {e}", reason='network') from e
+
+    if response.status_code == 429:
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+        except ValueError:
+            retry_after = 1
+        raise TelegramSendError("Too Many Requests", retry_after=int(retry_after), reason='rate_limited')
+    if 400 <= response.status_code < 500:
+        # 400/401/403/404 - повтор не поможет (неверный токен, chat_id, бот заблокирован)
+        raise TelegramSendError(f"HTTP {response.status_code}: {response.text[:200]}", permanent=True,
+                                reason='client_error')
+    if response.status_code >= 500:
+        raise TelegramSendError(f"HTTP {response.status_code}", reason='server_error')
+
+
+def enqueue_notification(chat_id, text, kind=None, payload=None):
+    """Добавляет уведомление в outbox в ТЕКУЩУЮ сессию. Коммит делает вызывающий код
+    вместе с основной записью, поэтому уведомление не потеряется и не уйдет без заявки.
+
+    Для kind=KIND_LEAD в payload передаются поля заявки - из них собирается дайджест.
+    """
+    if not chat_id:
+        current_app.logger.warning("ADMIN_ID не задан, уведомление не будет поставлено в очередь.")
+        return None
+    message = NotificationOutbox(chat_id=chat_id, text=text, kind=kind, payload=payload)
+    db.session.add(message)
+    return message
+
+
+# --- Фоновый диспетчер outbox ---
+class OutboxDispatcher:
+    """Фоновый поток, который доставляет уведомления из outbox (at-least-once).
+
+    Каждая строка перед отправкой "арендуется" (locked_until), поэтому несколько
+    воркеров gunicorn могут работать одновременно и не дублировать отправку.
+    Если процесс упадет посреди отправки, аренда истечет и строку заберет другой воркер.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._paused_until = None # Глобальная пауза после ответа 429
+
+    def ensure_started(self):
+        """Запускает поток в текущем процессе (безопасно после fork - поток создается заново)."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Будит диспетчер сразу после коммита новой заявки (не блокирует запрос)."""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _run(self):
+        poll_interval = self.app.config['NOTIFY_POLL_INTERVAL']
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    has_more = self.dispatch_once()
+            except Exception as e:
+                has_more = False
+                self.app.logger.error(f"Outbox dispatcher error: {e}", exc_info=True)
+            if not has_more:
+                self._wakeup.wait(poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self, now, *criteria, limit=None):
+        """Выбирает и арендует пачку готовых к отправке строк. Возвращает арендованные строки."""
+        config = self.app.config
+        lease_until = now + timedelta(seconds=config['NOTIFY_LEASE_SECONDS'])
+        candidate_ids = db.session.execute(
+            db.select(NotificationOutbox.id)
+            .where(
+                NotificationOutbox.sent_at.is_(None),
+                NotificationOutbox.failed_at.is_(None),
+                NotificationOutbox.next_attempt_at <= now,
+                or_(NotificationOutbox.locked_until.is_(None), NotificationOutbox.locked_until < now),
+                *criteria,
+            )
+            .order_by(NotificationOutbox.id)
+            .limit(limit or config['NOTIFY_BATCH_SIZE'])
+        ).scalars().all()
+
+        claimed_ids = []
+        for message_id in candidate_ids:
+            result = db.session.execute(
+                update(NotificationOutbox)
+                .where(
+                    NotificationOutbox.id == message_id,
+                    or_(NotificationOutbox.locked_until.is_(None), NotificationOutbox.locked_until < now),
+                )
+                .values(locked_until=lease_until)
+            )
+            if result.rowcount == 1:
+                claimed_ids.append(message_id)
+        db.session.commit()
+
+        if not claimed_ids:
+            return []
+        return db.session.execute(
+            db.select(NotificationOutbox).where(NotificationOutbox.id.in_(claimed_ids)).order_by(NotificationOutbox.id)
+        ).scalars().all()
+
+    def dispatch_once(self):
+        """Один проход диспетчера. Возвращает True, если в очереди, вероятно, остались строки."""
+        now = datetime.utcnow()
+        if self._paused_until and now < self._paused_until:
+            return False
+
+        messages = self._claim(now)
+        digest_enabled = self.app.config['NOTIFY_DIGEST_WINDOW'] > 0
+        leads_by_chat = {}
+        others = []
+        for message in messages:
+            if digest_enabled and message.kind == KIND_LEAD:
+                leads_by_chat.setdefault(message.chat_id, []).append(message)
+            else:
+                others.append(message)
+
+        delivered = all(self._deliver([message], message.text) for message in others) and \
+            all(self._deliver_leads(chat_id, leads, now) for chat_id, leads in leads_by_chat.items())
+        if not delivered:
+            # Telegram ограничил бота целиком - остальные строки этой пачки тоже ждут
+            self._release([m for m in messages if m.sent_at is None and m.failed_at is None], self._paused_until)
+            return False
+
+        self._purge_sent(now)
+        return len(messages) == self.app.config['NOTIFY_BATCH_SIZE']
+
+    def _deliver(self, messages, text):
+        """Отправляет text и помечает messages отправленными. False - Telegram попросил паузу (429)."""
+        chat_id = messages[0].chat_id
+        try:
+            send_telegram_notification(chat_id, text)
+        except TelegramSendError as e:
+            for message in messages:
+                self._reschedule(message, e)
+            db.session.commit()
+            return not e.retry_after
+        sent_at = datetime.utcnow()
+        for message in messages:
+            # Строка остается в таблице до конца окна группировки - по ней считается частота заявок
+            message.sent_at = sent_at
+            message.locked_until = None
+        db.session.commit()
+        return True
+
+    def _deliver_leads(self, chat_id, leads, now):
+        """Отправляет уведомления о заявках: по одному при обычном потоке, дайджестом при всплеске.
+
+        Пока за окно NOTIFY_DIGEST_WINDOW пришло не больше NOTIFY_DIGEST_THRESHOLD заявок,
+        каждая уходит отдельным сообщением, как раньше. Остальные заявки всплеска копятся
+        до конца окна и уходят одним сообщением-дайджестом.
+        """
+        config = self.app.config
+        window = timedelta(seconds=config['NOTIFY_DIGEST_WINDOW'])
+        oldest_created_at = db.session.execute(
+            db.select(func.min(NotificationOutbox.created_at)).where(
+                NotificationOutbox.chat_id == chat_id,
+                NotificationOutbox.kind == KIND_LEAD,
+                NotificationOutbox.sent_at.is_(None),
+                NotificationOutbox.failed_at.is_(None),
+            )
+        ).scalar() or now
+        # Частота считается от самой старой неотправленной заявки, а не от "сейчас":
+        # иначе к моменту отправки дайджеста окно уже уедет и заявки уйдут по одной
+        recent_count = db.session.execute(
+            db.select(func.count(NotificationOutbox.id)).where(
+                NotificationOutbox.chat_id == chat_id,
+                NotificationOutbox.kind == KIND_LEAD,
+                NotificationOutbox.created_at >= oldest_created_at - window,
+            )
+        ).scalar()
+
+        if recent_count <= config['NOTIFY_DIGEST_THRESHOLD']:
+            return all(self._deliver([message], message.text) for message in leads)
+
+        # Всплеск: дайджест уходит, когда истекает окно самой старой неотправленной заявки
+        due_at = oldest_created_at + window
+        if now < due_at:
+            self._release(leads, due_at)
+            return True
+
+        # Забираем и остальные отложенные заявки этого чата (кроме арендованных другими воркерами)
+        leads = leads + self._claim(
+            now,
+            NotificationOutbox.chat_id == chat_id,
+            NotificationOutbox.kind == KIND_LEAD,
+            limit=config['NOTIFY_DIGEST_MAX_ROWS'],
+        )
+        return self._deliver(leads, build_digest_text(leads, config['NOTIFY_DIGEST_ITEMS']))
+
+    def _reschedule(self, message, error):
+        config = self.app.config
+        now = datetime.utcnow()
+        message.attempts += 1
+        message.last_error = str(error)
+        message.locked_until = None
+        if error.permanent:
+            message.failed_at = now
+            self.app.logger.error(f"Notification {message.id} to {message.chat_id} failed permanently: {error}")
+        elif error.retry_after:
+            delay = error.retry_after
+            self._paused_until = now + timedelta(seconds=delay)
+            message.next_attempt_at = self._paused_until
+            self.app.logger.warning(f"Telegram rate limit hit, pausing dispatcher for {delay}s")
+        else:
+            # Экспоненциальная задержка с "дрожанием", чтобы воркеры не долбили API синхронно
+            delay = min(config['NOTIFY_BACKOFF_MAX'], config['NOTIFY_BACKOFF_BASE'] * 2 ** (message.attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            message.next_attempt_at = now + timedelta(seconds=delay)
+            self.app.logger.warning(
+                f"Notification {message.id} attempt {message.attempts} failed: {error}. Retry in {delay:.1f}s")
+
+    def _release(self, messages, next_attempt_at):
+        """Снимает аренду со строк и откладывает их до next_attempt_at."""
+        for message in messages:
+            message.locked_until = None
+            message.next_attempt_at = next_attempt_at
+        db.session.commit()
+
+    def _purge_sent(self, now):
+        """Удаляет отправленные строки, которые уже не нужны для подсчета частоты заявок."""
+        keep = timedelta(seconds=max(self.app.config['NOTIFY_DIGEST_WINDOW'], 60))
+        db.session.execute(
+            delete(NotificationOutbox).where(NotificationOutbox.sent_at < now - keep)
+        )
+        db.session.commit()
+
+
+def build_digest_text(messages, max_items):
+    """Собирает одно сообщение-дайджест из нескольких уведомлений о заявках."""
+    leads = [message.payload or {} for message in messages]
+    by_type = Counter(lead.get('lesson_type', '?') for lead in leads)
+
+    lines = [f"📦 <b>Новые заявки: {len(leads)}</b>\n", "<b>По типу занятия:</b>"]
+    for lesson_type, count in by_type.most_common():
+        lines.append(f"• {escape(lesson_type)}: {count}")
+
+    lines.append(f"\n<b>Первые {min(max_items, len(leads))}:</b>")
+    for lead in leads[:max_items]:
+        lines.append(
+            f"#{lead.get('id')} {escape(lead.get('name', ''))} - {escape(lead.get('phone', ''))} "
+            f"({escape(lead.get('lesson_type', ''))})"
+        )
+    if len(leads) > max_items:
+        lines.append(f"...и еще {len(leads) - max_items}")
+
+    lines.append("\nДля просмотра списка заявок используйте команду /callbacks")
+    return "\n".join(lines)
+
+def init_app(app):
+    """Подключает диспетчер уведомлений к приложению."""
+    dispatcher = OutboxDispatcher(app)
+    app.extensions['notification_dispatcher'] = dispatcher
+
+    if app.config['NOTIFY_DISPATCHER_THREAD']:
+        # Поток стартует лениво в каждом воркере, а не при импорте (безопасно для fork)
+        app.before_request(dispatcher.ensure_started)
+
+    @app.cli.command('dispatch-notifications')
+    def dispatch_notifications_command():
+        """Запускает диспетчер уведомлений в отдельном процессе (вместо потока в воркерах)."""
+        app.logger.info("Outbox dispatcher started in standalone mode")
+        dispatcher._pid = os.getpid()
+        dispatcher._run()
+
+    return dispatcher
+
+
+def get_dispatcher():
+    return current_app.extensions['notification_dispatcher']
@@ -0,0 +1,100 @@
+import gzip
+import hashlib
+import threading
+
+from flask import current_app, render_template, request
+
+try:
+    import brotli # Необязательная зависимость: без нее отдаем только gzip
+except ImportError:
+    brotli = None
+
+MAX_ENTRIES = 128 # Ограничение на число закэшированных вариантов страниц
+MIN_COMPRESS_SIZE = 512 # Маленькие ответы сжимать нет смысла
+
+
+class CachedPage:
+    """Отрендеренная страница: исходный HTML и заранее сжатые варианты с их ETag."""
+
+    def __init__(self, body, version=None):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        if version is not None:
+            digest = f"v{version}-{digest}" # Смена версии данных меняет ETag, даже если HTML совпал
+        # Сильный ETag должен отличаться для каждого представления (Content-Encoding)
+        self.variants = {None: (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+            if brotli is not None:
+                self.variants['br'] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    def choose_encoding(self, accept_encodings):
+        """Выбирает лучший доступный вариант по заголовку Accept-Encoding."""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return None
+
+
+_pages = {}
+_lock = threading.Lock()
+
+
+def clear():
+    """Сбрасывает кэш (например, после изменения шаблонов или данных)."""
+    with _lock:
+        _pages.clear()
+
+
+def _if_none_match_hit(page):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return None
+    if header.strip() == '*':
+        return True
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:] # Слабое сравнение допустимо для If-None-Match
+        if tag in page.etags:
+            return tag
+    return None
+
+
+def render_cached(template_name, cache_key=None, etag_version=None, **context):
+    """Аналог render_template, который рендерит страницу один раз на набор входных данных.
+
+    Ключ кэша - маршрут, шаблон и входные данные (или явный cache_key, если данные
+    большие и у них есть своя версия). Ответ содержит сильный ETag, на If-None-Match
+    отвечаем 304, а тело отдаем заранее сжатым (br/gzip) по Accept-Encoding.
+    etag_version (например, версия справочника цен) добавляется в ETag.
+    """
+    if not current_app.config.get('PAGE_CACHE_ENABLED', True) or current_app.debug:
+        return render_template(template_name, **context)
+
+    key = (request.endpoint, template_name, etag_version,
+           cache_key if cache_key is not None else repr(sorted(context.items())))
+    page = _pages.get(key)
+    if page is None:
+        page = CachedPage(render_template(template_name, **context).encode('utf-8'), etag_version)
+        with _lock:
+            if len(_pages) >= MAX_ENTRIES:
+                _pages.clear()
+            _pages[key] = page
+
+    encoding = page.choose_encoding(request.accept_encodings)
+    body, etag = page.variants[encoding]
+
+    matched = _if_none_match_hit(page)
+    if matched:
+        response = current_app.response_class(status=304)
+        response.headers['ETag'] = etag if matched is True else matched
+    else:
+        response = current_app.response_class(body, mimetype='text/html')
+        response.headers['ETag'] = etag
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Браузер хранит страницу, но каждый раз перепроверяет ее по ETag (год в подвале может смениться)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
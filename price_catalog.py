@@ -0,0 +1,79 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from models import db, CatalogVersion, PricingPlan
+
+CATALOG_NAME = 'pricing' # Строка в catalog_versions
+EDITABLE_FIELDS = ('title', 'description', 'price', 'old_price', 'unit')
+
+
+def plan_to_dict(plan):
+    """Тариф в виде словаря, который ожидает шаблон pricing.html."""
+    return {
+        'title': plan.title,
+        'description': plan.description,
+        'price': plan.price,
+        'old_price': plan.old_price,
+        'unit': plan.unit,
+    }
+
+
+def bump_version_statement():
+    """UPDATE, увеличивающий версию справочника цен. Выполняется в одной транзакции с изменением тарифов."""
+    return (
+        update(CatalogVersion)
+        .where(CatalogVersion.name == CATALOG_NAME)
+        .values(version=CatalogVersion.version + 1, updated_at=datetime.utcnow())
+    )
+
+
+class PricingCache:
+    """Тарифы в памяти процесса с проверкой версии не чаще раза в PRICING_VERSION_CHECK_INTERVAL.
+
+    На обычный запрос /pricing БД не трогается вовсе, раз в интервал читается одна строка
+    catalog_versions, и только при смене версии тарифы перечитываются целиком.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._plans = {}
+        self._checked_at = 0.0
+
+    def get(self):
+        """Возвращает (версия, {ключ: тариф}) для текущего приложения."""
+        interval = current_app.config['PRICING_VERSION_CHECK_INTERVAL']
+        if time.monotonic() - self._checked_at < interval:
+            return self._version, self._plans
+        with self._lock:
+            if time.monotonic() - self._checked_at >= interval: # Другой поток мог уже проверить
+                version = db.session.scalar(
+                    select(CatalogVersion.version).where(CatalogVersion.name == CATALOG_NAME)
+                ) or 0
+                if version != self._version:
+                    plans = db.session.scalars(select(PricingPlan).order_by(PricingPlan.position, PricingPlan.key))
+                    self._plans = {plan.key: plan_to_dict(plan) for plan in plans}
+                    self._version = version
+                    current_app.logger.info(f"Загружены тарифы, версия {version}")
+                self._checked_at = time.monotonic()
+        return self._version, self._plans
+
+    def invalidate(self):
+        """Заставляет проверить версию при следующем запросе."""
+        self._checked_at = 0.0
+
+
+_cache = PricingCache()
+
+
+def get_catalog():
+    """(версия, тарифы) из кэша процесса. Версия входит в ETag страницы /pricing."""
+    return _cache.get()
+
+
+def invalidate():
+    _cache.invalidate()
@@ -0,0 +1,165 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import g, request
+from itsdangerous import BadSignature, TimestampSigner
+
+SAMPLE_INTERVAL = 0.002 # сек. между снимками стека
+PROFILE_SUBDIR = 'profiles' # Внутри папки логов: logs/profiles/*.folded
+TOKEN_SALT = 'profile'
+
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+class StackSampler:
+    """Сэмплирующий профилировщик одного запроса: отдельный поток раз в interval снимает стек.
+
+    Результат - "свернутые" стеки (collapsed stacks: "a;b;c вес"), вес - микросекунды между
+    снимками, поэтому задержки потока-сэмплера из-за GIL не искажают доли. Файл открывается
+    flamegraph.pl, speedscope и т.п.
+
+    thread_id - поток, который профилируется (по умолчанию текущий). task - задача asyncio
+    (обработчик бота): пока она выполняется, снимается стек потока цикла событий от ее корутины,
+    а пока ждет - цепочка await до объекта ожидания (лист "[await]"). Так видно, чего ждет обработчик.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None, task=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.task = task
+        self.stacks = Counter()
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = self._last = None
+
+    def start(self):
+        self._started = self._last = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает сэмплер и возвращает Counter {стек: микросекунды}."""
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, self._last = int((now - self._last) * 1_000_000), now
+            stack = self._task_stack() if self.task is not None else self._thread_stack()
+            if stack:
+                self.stacks[';'.join(stack)] += weight
+
+    def _thread_stack(self, root=None):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            if frame is root:
+                break
+            frame = frame.f_back
+        names.reverse()
+        return names
+
+    def _task_stack(self):
+        coro = self.task.get_coro()
+        if coro.cr_frame is None: # Задача уже завершилась
+            return []
+        if coro.cr_running:
+            return self._thread_stack(root=coro.cr_frame)
+        names = []
+        awaitable = coro
+        while awaitable is not None:
+            frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+            if frame is None: # Future, задача или объект драйвера - дальше кадров нет
+                names.append('[await]')
+                break
+            names.append(_frame_name(frame))
+            awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+        return names
+
+
+def write_profile(directory, label, stacks, elapsed):
+    """Пишет стеки в <directory>/<время>-<label>-<мс>ms.folded. Возвращает путь (None - снимков нет)."""
+    if not stacks:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{label}-{elapsed * 1000:.0f}ms.folded"
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(f"{stack} {weight}\n" for stack, weight in sorted(stacks.items()))
+    return path
+
+
+def parse_names(value):
+    """'submit_callback, index' -> {'submit_callback', 'index'}."""
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+# --- Flask ---
+def init_app(app):
+    """Профилирование выбранных запросов и команда flask profile-token.
+
+    Запрос профилируется, если его endpoint есть в PROFILE_ENDPOINTS (с долей PROFILE_SAMPLE_RATE)
+    или в нем есть заголовок PROFILE_HEADER с действующим токеном из flask profile-token.
+    Токены подписываются отдельным PROFILE_SECRET, а не SECRET_KEY (у него есть общеизвестное значение
+    по умолчанию); без PROFILE_SECRET заголовок игнорируется.
+    """
+    config = app.config
+    endpoints = parse_names(config['PROFILE_ENDPOINTS'])
+    directory = os.path.join(config['LOG_DIR'], PROFILE_SUBDIR)
+    secret = config['PROFILE_SECRET']
+    signer = TimestampSigner(secret, salt=TOKEN_SALT) if secret else None
+
+    def wants_profile():
+        token = request.headers.get(config['PROFILE_HEADER']) if signer else None
+        if token:
+            try:
+                signer.unsign(token, max_age=config['PROFILE_TOKEN_MAX_AGE'])
+                return True
+            except BadSignature:
+                app.logger.warning(f"Недействительный токен профилирования (IP: {request.remote_addr})")
+        if request.endpoint not in endpoints:
+            return False
+        rate = config['PROFILE_SAMPLE_RATE']
+        return rate >= 1 or random.random() < rate
+
+    @app.before_request
+    def start_profiler():
+        if (endpoints or (signer and config['PROFILE_HEADER'] in request.headers)) and wants_profile():
+            g.profiler = StackSampler(config['PROFILE_INTERVAL']).start()
+
+    @app.teardown_request
+    def stop_profiler(exception=None):
+        sampler = g.pop('profiler', None)
+        if sampler is None:
+            return
+        stacks = sampler.stop()
+        label = request.endpoint or 'other'
+        try:
+            path = write_profile(directory, label, stacks, sampler.elapsed)
+        except OSError as e:
+            app.logger.error(f"Не удалось записать профиль запроса: {e}")
+            return
+        app.logger.info(f"Профиль запроса {label} ({sampler.elapsed * 1000:.0f} мс): {path or 'нет снимков'}")
+
+    @app.cli.command('profile-token')
+    def profile_token_command():
+        """Печатает токен для заголовка, включающего профилирование запроса."""
+        if signer is None:
+            raise click.ClickException("Задайте PROFILE_SECRET: без него профилирование по заголовку выключено")
+        minutes = config['PROFILE_TOKEN_MAX_AGE'] // 60
+        click.echo(f"{config['PROFILE_HEADER']}: {signer.sign('profile').decode()}")
+        click.echo(f"Действует {minutes} мин.", err=True)
@@ -51,15 +51,45 @@ document.addEventListener('DOMContentLoaded', (event) => {
         console.log("Theme toggle button not found on this page.");
     }
 
-    // --- Инициализация intl-tel-input ---
+    // --- Ленивая загрузка и инициализация intl-tel-input ---
+    // Библиотека нужна только полю телефона в окне обратного звонка, поэтому ее CSS и JS
+    // загружаются при первом открытии окна (или при наведении на кнопку, которая его открывает),
+    // а не блокируют отрисовку каждой страницы.
+    const INTL_TEL_INPUT_URL = "https://cdnjs.cloudflare.com/ajax/libs/intl-tel-input/17.0.13";
     const phoneInput = document.querySelector("#callback-phone");
     let itiInstance = null; // Переменная для хранения экземпляра библиотеки
+    let itiLoading = null; // Promise загрузки библиотеки (чтобы не грузить ее дважды)
+
+    function loadStylesheet(href, integrity) {
+        const link = document.createElement('link');
+        link.rel = 'stylesheet';
+        link.href = href;
+        if (integrity) {
+            link.integrity = integrity;
+            link.crossOrigin = 'anonymous';
+        }
+        link.referrerPolicy = 'no-referrer';
+        document.head.appendChild(link);
+    }
 
-    if (phoneInput) {
+    function loadScript(src) {
+        return new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = src;
+            script.async = true;
+            script.referrerPolicy = 'no-referrer';
+            script.onload = resolve;
+            script.onerror = () => reject(new Error(`Failed to load ${src}`));
+            document.head.appendChild(script);
+        });
+    }
+
+    function initPhoneInput() {
         console.log("Phone input found, initializing intl-tel-input...");
         try {
             itiInstance = window.intlTelInput(phoneInput, {
-                utilsScript: "https://cdnjs.cloudflare.com/ajax/libs/intl-tel-input/17.0.13/js/utils.js",
+                // utils.js библиотека подгрузит сама - он нужен для форматирования и isValidNumber()
+                utilsScript: `${INTL_TEL_INPUT_URL}/js/utils.js`,
                 initialCountry: "ru",
                 preferredCountries: ['ru', 'by', 'kz', 'ua'],
                 separateDialCode: true,
@@ -89,6 +119,39 @@ document.addEventListener('DOMContentLoaded', (event) => {
                phoneInput.placeholder = "Ошибка загрузки компонента телефона";
             }
         }
+    }
+
+    function ensurePhoneInput() {
+        if (!phoneInput) {
+            return Promise.resolve(null);
+        }
+        if (!itiLoading) {
+            console.log("Loading intl-tel-input on demand...");
+            loadStylesheet(
+                `${INTL_TEL_INPUT_URL}/css/intlTelInput.css`,
+                "sha512-gxWow8Mo6q6pLa1XH/CcH8JyiSDEtiwJV78E+D+QP0EVasFs8wKXq16G8CLD4CJ2SnonHr4Lm/yY2fSI2+cbmw=="
+            );
+            itiLoading = loadScript(`${INTL_TEL_INPUT_URL}/js/intlTelInput.min.js`)
+                .then(initPhoneInput)
+                .catch((e) => {
+                    console.error("Failed to load intl-tel-input:", e);
+                    phoneInput.placeholder = "Ошибка загрузки компонента телефона";
+                });
+        }
+        return itiLoading;
+    }
+
+    if (phoneInput) {
+        const callbackModalForPhone = document.getElementById('callbackModal');
+        if (callbackModalForPhone) {
+            callbackModalForPhone.addEventListener('show.bs.modal', ensurePhoneInput);
+        }
+        // Начинаем загрузку заранее, как только пользователь потянулся к кнопке открытия окна
+        document.querySelectorAll('[data-bs-target="#callbackModal"]').forEach(trigger => {
+            trigger.addEventListener('pointerenter', ensurePhoneInput, { once: true });
+            trigger.addEventListener('focus', ensurePhoneInput, { once: true });
+            trigger.addEventListener('touchstart', ensurePhoneInput, { once: true, passive: true });
+        });
     } else {
         console.log("Phone input #callback-phone not found.");
     }
@@ -134,6 +197,23 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
         const callbackModal = new bootstrap.Modal(callbackModalEl);
 
+        // Ключ отправки формы: создается при открытии окна и не меняется до успешной отправки.
+        // Повтор с тем же ключом (двойной клик, ретрай на плохой сети) сервер не запишет второй раз
+        let submitKey = null;
+        function newSubmitKey() {
+            if (window.crypto && crypto.randomUUID) {
+                return crypto.randomUUID();
+            }
+            const bytes = new Uint8Array(16); // randomUUID есть только на https - запасной вариант
+            crypto.getRandomValues(bytes);
+            return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        }
+        callbackModalEl.addEventListener('show.bs.modal', () => {
+            if (!submitKey) {
+                submitKey = newSubmitKey();
+            }
+        });
+
         // Очистка ошибок при вводе/изменении данных в поле
         ['callback-name', 'callback-phone', 'callback-email'].forEach(id => {
             const field = document.getElementById(id);
@@ -153,7 +233,13 @@ document.addEventListener('DOMContentLoaded', (event) => {
         callbackForm.addEventListener('submit', function(e) {
             e.preventDefault();
             console.log("Callback form submitted (preventDefault).");
+            // intl-tel-input грузится лениво: дожидаемся библиотеки и utils.js, чтобы проверить номер
+            // и заполнить скрытое поле full_phone (при ошибке загрузки сработает запасная проверка)
+            const phoneReady = ensurePhoneInput().then(() => itiInstance ? itiInstance.promise : null);
+            phoneReady.then(validateAndSubmit, validateAndSubmit);
+        });
 
+        function validateAndSubmit() {
             clearAllFormErrors();
 
             const nameInput = document.getElementById('callback-name');
@@ -171,7 +257,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
             }
 
             if (phoneInput) { // Убедимся, что phoneInput существует перед использованием itiInstance
-                if (itiInstance) {
+                if (itiInstance && window.intlTelInputUtils) {
                     if (!phoneInput.value.trim()) {
                         setFieldError('callback-phone', 'Пожалуйста, укажите ваш телефон.');
                         if (!firstInvalidField) firstInvalidField = phoneInput;
@@ -181,7 +267,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
                         if (!firstInvalidField) firstInvalidField = phoneInput;
                         isValid = false;
                     }
-                } else { // Fallback если intl-tel-input не инициализировался, но поле есть
+                } else { // Fallback если intl-tel-input не инициализировался (или еще грузится), но поле есть
                     if (!phoneInput.value.trim() || phoneInput.value.length < 5) {
                         setFieldError('callback-phone', 'Пожалуйста, укажите ваш телефон.');
                         if (!firstInvalidField) firstInvalidField = phoneInput;
@@ -224,9 +310,13 @@ document.addEventListener('DOMContentLoaded', (event) => {
             submitButton.textContent = 'Отправка...';
 
             const formData = new FormData(callbackForm);
+            if (!formData.has('full_phone') && phoneInput) { // intl-tel-input не загрузился - отправляем номер как есть
+                formData.append('full_phone', phoneInput.value.trim());
+            }
 
             fetch('/submit_callback', {
                 method: 'POST',
+                headers: submitKey ? { 'Idempotency-Key': submitKey } : {},
                 body: formData
             })
             .then(response => {
@@ -255,9 +345,10 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 submitButton.disabled = false;
                 submitButton.textContent = 'Записаться';
             });
-        });
+        }
 
         function showSuccessAndReset() {
+             submitKey = null; // Следующая заявка - новый ключ
              callbackForm.style.display = 'none';
              successMessage.style.display = 'block';
              clearAllFormErrors();
@@ -0,0 +1,127 @@
+"""Нагрузочная проверка SQLite: веб-воркеры принимают заявки, пока бот меняет их статусы.
+
+Запуск:    python stress_sqlite.py --seconds 10 --web 4 --bot 2
+Сравнение: SQLITE_PROFILE=0 python stress_sqlite.py (без WAL и busy_timeout)
+
+Работает на временной БД (рабочая database.db не затрагивается). В конце сверяет
+счетчики заявок с реальными данными.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def web_worker(worker_id, seconds, results):
+    """Как веб-воркер gunicorn: POST /submit_callback через полный путь приложения."""
+    from app import create_app
+    client = create_app().test_client()
+    ok = failed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        response = client.post('/submit_callback', data={
+            'name': f'Stress {worker_id}',
+            'full_phone': f'+7999{worker_id:03d}{ok + failed:04d}',
+            'lesson_type': random.choice(['individual_online', 'group_online']),
+            'consent': 'on',
+        })
+        if response.status_code == 200:
+            ok += 1
+        else:
+            failed += 1
+    results.put(('web', ok, failed))
+
+
+def bot_worker(seconds, max_id, results):
+    """Как бот: переключает статусы заявок через update_callback_status."""
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def run():
+        ok = failed = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if await bot.update_callback_status(random.randint(1, max_id), random.randint(0, 1)):
+                ok += 1
+            else:
+                failed += 1
+        await bot.engine.dispose()
+        return ok, failed
+
+    results.put(('bot', *asyncio.run(run())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--web', type=int, default=4, help='процессов веб-приложения')
+    parser.add_argument('--bot', type=int, default=2, help='процессов бота')
+    parser.add_argument('--seed', type=int, default=200, help='заявок в БД до начала теста')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stress-sqlite-')
+    os.chdir(workdir) # Логи приложения пишутся во временную папку
+    sys.path.insert(0, BASE_DIR)
+    os.environ.pop('DATABASE_URL', None)
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'stress.db')
+    os.environ['NOTIFY_DISPATCHER_THREAD'] = '0' # В Telegram ничего не отправляем
+    os.environ['CALLBACK_WRITE_BEHIND'] = '0'
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    os.environ.setdefault('ADMIN_ID', '1')
+    os.environ.setdefault('BOT_TOKEN', '123456:stress-test-token')
+
+    from sqlalchemy import func, select
+    import callback_spool
+    import counters
+    from app import create_app
+    from models import db, Callback, CallbackCounter
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        callback_spool.store_callbacks(
+            [callback_spool.new_entry('Seed', None, f'+7000000{i:04d}', 'individual_online') for i in range(args.seed)],
+            os.environ['ADMIN_ID'],
+        )
+        db.session.commit()
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    print(f"БД: {os.environ['DATABASE_PATH']} (journal_mode={journal_mode})")
+    context = multiprocessing.get_context('spawn') # Каждый процесс создает свои соединения, как в проде
+    results = context.Queue()
+    processes = [context.Process(target=web_worker, args=(i, args.seconds, results)) for i in range(args.web)]
+    processes += [context.Process(target=bot_worker, args=(args.seconds, args.seed, results)) for _ in range(args.bot)]
+    for process in processes:
+        process.start()
+    totals = {'web': [0, 0], 'bot': [0, 0]}
+    for _ in processes:
+        kind, ok, failed = results.get()
+        totals[kind][0] += ok
+        totals[kind][1] += failed
+    for process in processes:
+        process.join()
+
+    for kind, (ok, failed) in totals.items():
+        print(f"{kind}: успешно {ok} ({ok / args.seconds:.0f}/с), ошибок {failed}")
+
+    with app.app_context():
+        stored = dict(db.session.execute(select(CallbackCounter.name, CallbackCounter.value)).all())
+        actual = {
+            counters.TOTAL: db.session.scalar(select(func.count()).select_from(Callback)),
+            counters.PROCESSED: db.session.scalar(select(func.count()).where(Callback.processed)),
+        }
+        actual[counters.UNPROCESSED] = actual[counters.TOTAL] - actual[counters.PROCESSED]
+    mismatched = {name: (stored.get(name, 0), value) for name, value in actual.items() if stored.get(name, 0) != value}
+    print("Счетчики совпадают с данными" if not mismatched else f"Расхождение счетчиков: {mismatched}")
+    return 1 if mismatched or totals['web'][1] or totals['bot'][1] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import os
+
+import click
+from jinja2 import FileSystemBytecodeCache
+
+
+def precompile_templates(app):
+    """Компилирует все шаблоны приложения (они остаются в кэше jinja_env). Возвращает их число."""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def init_app(app):
+    """Кэш байткода шаблонов на диске, компиляция шаблонов при старте и команда flask build-templates.
+
+    Байткод проверяется по контрольной сумме исходника, поэтому измененный шаблон перекомпилируется сам.
+    """
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if directory:
+        path = os.path.join(app.root_path, directory)
+        os.makedirs(path, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(path)
+    if app.config['TEMPLATES_PRECOMPILE']:
+        precompile_templates(app)
+
+    @app.cli.command('build-templates')
+    def build_templates_command():
+        """Заранее компилирует шаблоны в кэш байткода (например, при сборке релиза)."""
+        if not directory:
+            raise click.ClickException("Кэш байткода выключен (JINJA_BYTECODE_CACHE_DIR)")
+        click.echo(f"Скомпилировано шаблонов: {precompile_templates(app)}")
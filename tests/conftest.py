@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import ProductionConfig
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Приложение с пустой БД SQLite и каталогами журнала, ключей и логов во временной папке."""
+    monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'db.sqlite'))
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    config = type('TestConfig', (ProductionConfig,), {
+        'TESTING': True,
+        'BOT_TOKEN': '1:test',
+        'ADMIN_ID': '1',
+        'LOG_DIR': str(tmp_path / 'logs'),
+        'CALLBACK_SPOOL_DIR': str(tmp_path / 'spool'),
+        'CALLBACK_FLUSH_INTERVAL': 3600, # Журнал записываем из тестов явно, а не фоновым потоком
+        'SUBMIT_KEYS_DIR': str(tmp_path / 'keys'),
+        'NOTIFY_DISPATCHER_THREAD': False,
+        'METRICS_ENABLED': False,
+        'JINJA_BYTECODE_CACHE_DIR': None,
+        'TEMPLATES_PRECOMPILE': False,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
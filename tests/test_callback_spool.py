@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+import callback_spool
+from callback_spool import ACTIVE_SUFFIX, SEALED_SUFFIX, CallbackSpool, new_entry, store_callbacks
+from models import db, Callback, CallbackDailyStat
+
+
+def make_entry(n, submission_id=None):
+    return new_entry(f'Имя {n}', '', f'+7900000{n:04d}', 'Групповые', submission_id)
+
+
+def write_spool_file(spool, name, lines):
+    os.makedirs(spool.directory, exist_ok=True)
+    path = os.path.join(spool.directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(lines))
+    return path
+
+
+def stored_ids():
+    return sorted(db.session.scalars(db.select(Callback.submission_id)))
+
+
+@pytest.fixture
+def spool(app):
+    return CallbackSpool(app, app.config['ADMIN_ID'])
+
+
+def test_torn_last_line_is_skipped(spool):
+    entries = [make_entry(1), make_entry(2)]
+    torn = json.dumps(make_entry(3), ensure_ascii=False)[:25] # Процесс упал посреди записи строки
+    path = write_spool_file(spool, f'callbacks-1-1{SEALED_SUFFIX}',
+                            [json.dumps(e, ensure_ascii=False) + '\n' for e in entries] + [torn])
+
+    assert spool.flush() == 2
+    assert stored_ids() == sorted(e['submission_id'] for e in entries)
+    assert not os.path.exists(path)
+
+
+def test_replay_after_commit_before_unlink(spool, monkeypatch):
+    entries = [make_entry(1), make_entry(2)]
+    path = write_spool_file(spool, f'callbacks-1-1{SEALED_SUFFIX}',
+                            [json.dumps(e, ensure_ascii=False) + '\n' for e in entries])
+
+    def crash(path):
+        raise OSError('упали после коммита')
+
+    with monkeypatch.context() as patch, pytest.raises(OSError):
+        patch.setattr(callback_spool.os, 'remove', crash)
+        spool.flush()
+    assert os.path.exists(path) and len(stored_ids()) == 2
+
+    assert spool.flush() == 0 # Повторная запись того же файла не создает дублей
+    assert len(stored_ids()) == 2
+    assert not os.path.exists(path)
+    assert db.session.scalar(db.select(db.func.sum(CallbackDailyStat.submitted))) == 2
+
+
+def test_store_callbacks_dedups_submission_id(app):
+    first = make_entry(1)
+    assert len(store_callbacks([first], app.config['ADMIN_ID'])) == 1
+    db.session.commit()
+
+    second = make_entry(2)
+    created = store_callbacks([first, second, dict(second)], app.config['ADMIN_ID'])
+    db.session.commit()
+    assert [c.submission_id for c in created] == [second['submission_id']]
+    assert stored_ids() == sorted([first['submission_id'], second['submission_id']])
+    assert store_callbacks([first, second], app.config['ADMIN_ID']) == []
+
+
+def test_locked_file_is_left_to_its_owner(app, spool):
+    owner = CallbackSpool(app, app.config['ADMIN_ID'])
+    owner.append(make_entry(1))
+
+    assert spool.flush() == 0 # Файл под flock другого "процесса" не трогаем
+    assert stored_ids() == []
+
+    owner._seal() # Владелец закрыл файл и снял блокировку - забрать может любой
+    assert spool.flush() == 1
+    assert os.listdir(spool.directory) == []
+
+
+def test_active_file_of_dead_process_is_picked_up(app, spool):
+    owner = CallbackSpool(app, app.config['ADMIN_ID'])
+    entry = make_entry(1)
+    owner.append(entry)
+    os.close(owner._fd) # Процесс упал: файл остался .spool, но flock снят
+    owner._fd = None
+    assert owner._path.endswith(ACTIVE_SUFFIX)
+
+    assert spool.flush() == 1
+    assert stored_ids() == [entry['submission_id']]
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import pytest
+
+import idempotency
+from idempotency import PENDING, ResponseStore
+from models import db, Callback
+
+KEY = 'submit:0b8f9d5e-6c4a-4f1e-9a2b-3c7d8e9f0a1b'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResponseStore(str(tmp_path / 'keys'), pending_timeout=30, wait=2.0)
+
+
+def age(store, key, seconds):
+    """Сдвигает время изменения файла ключа в прошлое (как будто прошло seconds секунд)."""
+    path = store._path(key)
+    mtime = os.stat(path).st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_concurrent_same_key_runs_once(store):
+    calls = []
+    started = threading.Event()
+
+    def produce():
+        calls.append(1)
+        started.set()
+        time.sleep(0.3) # Повторы приходят, пока первый запрос выполняется
+        return {'success': True}, 200
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(store.run(KEY, 60, produce)))
+    first.start()
+    started.wait()
+    retries = [threading.Thread(target=lambda: results.append(store.run(KEY, 60, produce))) for _ in range(4)]
+    for thread in retries:
+        thread.start()
+    for thread in [first, *retries]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(replayed for _, replayed in results) == [False] + [True] * 4
+    assert all(response == ({'success': True}, 200) for response, _ in results)
+
+
+def test_pending_after_wait(store):
+    assert store.begin(KEY) is None
+    busy = ResponseStore(store.directory, wait=0)
+    assert busy.begin(KEY) is PENDING
+
+
+def test_failed_attempt_is_not_cached(store):
+    calls = []
+
+    def invalid():
+        calls.append(1)
+        return {'success': False}, 400
+
+    assert store.run(KEY, 60, invalid) == (({'success': False}, 400), False)
+    assert store.run(KEY, 60, invalid) == (({'success': False}, 400), False)
+
+    def broken():
+        calls.append(1)
+        raise RuntimeError('БД недоступна')
+
+    with pytest.raises(RuntimeError):
+        store.run(KEY, 60, broken)
+    assert store.run(KEY, 60, lambda: ({'success': True}, 200)) == (({'success': True}, 200), False)
+    assert len(calls) == 3
+
+
+def test_response_expires_after_ttl(store):
+    store.run(KEY, 60, lambda: ({'n': 1}, 200))
+    assert store.run(KEY, 60, lambda: ({'n': 2}, 200)) == (({'n': 1}, 200), True)
+
+    age(store, KEY, 61)
+    assert store.run(KEY, 60, lambda: ({'n': 3}, 200)) == (({'n': 3}, 200), False)
+
+
+def test_stale_pending_key_is_reclaimed(store):
+    assert store.begin(KEY) is None # Запрос занял ключ и "упал", не вызвав complete/release
+    age(store, KEY, store.pending_timeout + 1)
+    assert store.begin(KEY) is None
+
+
+def test_prune_removes_expired_keys(store, monkeypatch):
+    store.run('old', 60, lambda: ({}, 200))
+    store.run('fresh', 60, lambda: ({}, 200))
+    age(store, 'old', 61)
+
+    monkeypatch.setattr(idempotency, 'PRUNE_INTERVAL', 0)
+    store.begin('other')
+    assert not os.path.exists(store._path('old'))
+    assert os.path.exists(store._path('fresh'))
+
+
+# --- Повторная отправка формы ---
+FORM = {'name': 'Анна', 'full_phone': '+79001234567', 'lesson_type': 'individual_online', 'consent': 'on'}
+
+
+def test_submit_with_same_key_creates_one_callback(app):
+    client = app.test_client()
+    headers = {'Idempotency-Key': '0b8f9d5e-6c4a-4f1e-9a2b-3c7d8e9f0a1b'}
+
+    first = client.post('/submit_callback', data=FORM, headers=headers)
+    retry = client.post('/submit_callback', data=FORM, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json == first.json and retry.headers['Idempotent-Replayed'] == 'true'
+    assert db.session.scalar(db.select(db.func.count()).select_from(Callback)) == 1
+
+
+def test_submit_rejects_invalid_key(app):
+    response = app.test_client().post('/submit_callback', data=FORM, headers={'Idempotency-Key': 'short'})
+    assert response.status_code == 400
+    assert db.session.scalar(db.select(db.func.count()).select_from(Callback)) == 0
+
+
+def test_submit_rejects_unknown_lesson_type(app):
+    response = app.test_client().post('/submit_callback', data={**FORM, 'lesson_type': 'x' * 50})
+    assert response.status_code == 400
+    assert db.session.scalar(db.select(db.func.count()).select_from(Callback)) == 0